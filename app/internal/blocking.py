@@ -0,0 +1,186 @@
+import contextlib
+import ipaddress
+import re
+from collections.abc import Iterable, Iterator, Sequence
+from functools import cache, lru_cache
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from playwright.async_api import Page, Route
+from playwright.async_api import Error as PlaywrightError
+
+from internal.logger import get_logger
+from settings import BLOCKED_DOMAINS
+
+
+_END = ''  # marks the last label of a domain in the trie (labels are never empty)
+
+
+class DomainTrie:
+    """
+    Suffix trie of domain names, keyed by labels from right to left.
+    A domain matches when it or any of its parent domains is in the trie: ads.example.com matches example.com.
+    """
+
+    def __init__(self, domains: Iterable[str] = ()):
+        self._root: dict = {}
+        self._size = 0
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain: str) -> None:
+        labels = _labels(domain)
+        if not labels:
+            return
+        node = self._root
+        for label in labels:
+            node = node.setdefault(label, {})
+        if _END not in node:
+            node[_END] = True
+            self._size += 1
+
+    def match(self, host: str) -> bool:
+        node = self._root
+        for label in _labels(host):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[str]:
+        # only the topmost domains, subdomains of a blocked domain are blocked anyway
+        stack = [(self._root, [])]
+        while stack:
+            node, labels = stack.pop()
+            for label, child in node.items():
+                if label == _END:
+                    continue
+                if _END in child:
+                    yield '.'.join(reversed([*labels, label]))
+                else:
+                    stack.append((child, [*labels, label]))
+
+
+def _labels(domain: str) -> list[str]:
+    return [x for x in reversed(domain.strip().lower().split('.')) if x]
+
+
+def parse_domain_list(lines: Iterable[str]) -> Iterator[str]:
+    # plain lists (one domain per line), hosts files (0.0.0.0 example.com) and adblock domain rules (||example.com^)
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line or line.startswith('!'):
+            continue
+        tokens = line.split()
+        with contextlib.suppress(ValueError):
+            ipaddress.ip_address(tokens[0])
+            tokens = tokens[1:]
+        for token in tokens:
+            token = token.removeprefix('||').removesuffix('^')
+            if token and token != 'localhost' and '/' not in token:
+                yield token
+
+
+@cache
+def blocked_domains() -> DomainTrie:
+    # the list is loaded once per process; a missing file means an empty list
+    path = Path(BLOCKED_DOMAINS)
+    if not path.is_file():
+        return DomainTrie()
+    with open(path, encoding='utf-8') as f:
+        trie = DomainTrie(parse_domain_list(f))
+    get_logger().info(f'{len(trie)} blocked domains loaded from {path}')
+    return trie
+
+
+@lru_cache(maxsize=256)
+def compile_url_patterns(patterns: tuple[str, ...]) -> re.Pattern | None:
+    # `*` matches any sequence of characters (including `/`), the same as in the Chromium's blocked URLs;
+    # other characters are literal, Chromium treats `?` as a wildcard too (see native_patterns)
+    if not patterns:
+        return None
+    alternatives = ('.*'.join(map(re.escape, p.split('*'))) for p in patterns)
+    return re.compile('|'.join(f'(?:{x})' for x in alternatives))
+
+
+class BlockRules:
+    """
+    Declarative request blocking rules: allowed resource types, blocked URL patterns and blocked domains.
+    """
+
+    def __init__(
+        self,
+        resource_types: Sequence[str] | None = None,
+        url_patterns: Sequence[str] = (),
+        domains: DomainTrie | None = None,
+    ):
+        self.resource_types = frozenset(resource_types) if resource_types else None  # allowed resource types
+        self.url_patterns = tuple(url_patterns)
+        self.domains = domains if domains else None
+        self._url_re = compile_url_patterns(self.url_patterns)
+
+    def __bool__(self) -> bool:
+        return self.resource_types is not None or self.has_url_rules()
+
+    def has_url_rules(self) -> bool:
+        return bool(self.url_patterns) or self.domains is not None
+
+    def blocks(self, url: str, resource_type: str) -> bool:
+        if self.resource_types is not None and resource_type not in self.resource_types:
+            return True
+        return self.blocks_url(url)
+
+    def blocks_url(self, url: str) -> bool:
+        if self._url_re and self._url_re.fullmatch(url):
+            return True
+        if self.domains:
+            host = urlsplit(url).hostname
+            return bool(host) and self.domains.match(host)
+        return False
+
+    def native_patterns(self) -> list[str]:
+        # the patterns Chromium matches the same way: it treats `?` as a wildcard, here it's literal
+        return [p for p in self.url_patterns if '?' not in p]
+
+
+async def install_blocking(page: Page, rules: BlockRules, browser_type: str, context_level: bool) -> None:
+    """
+    Install the blocking rules before navigation.
+    All the rules are applied by the route handler. On Chromium, the URL patterns of the request (a short list)
+    are also sent to the browser, so the requests of the page are blocked before they are intercepted. The CDP session
+    is attached to the page only: out-of-process iframes (e.g. cross-origin ads) and workers are other targets,
+    their requests are blocked by the route handler.
+    With context_level, the route handler is installed on the whole context (the page's own context is incognito).
+    """
+    if not rules:
+        return
+
+    native = rules.native_patterns() if browser_type == 'chromium' else []
+    if native:
+        try:
+            session = await page.context.new_cdp_session(page)
+            await session.send('Network.enable')  # the blocked URLs are applied only with the domain enabled
+            await session.send('Network.setBlockedURLs', {'urls': native})
+        except PlaywrightError as exc:
+            get_logger().debug(f'Native URL blocking is not available: {exc}')
+
+    handler = request_blocker(rules)
+    target = page.context if context_level else page
+    await target.route('**/*', handler)
+
+
+def request_blocker(rules: BlockRules):
+    async def block(route: Route):
+        request = route.request
+        if rules.blocks(request.url, request.resource_type):
+            await route.abort()
+        else:
+            # let other handlers (e.g. the subresource cache) handle the request
+            await route.fallback()
+
+    return block
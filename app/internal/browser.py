@@ -1,13 +1,24 @@
+import asyncio
 import contextlib
 import copy
-from collections.abc import Sequence
+from collections.abc import Awaitable, Callable, Sequence
+from typing import TypeVar
 
 from playwright.async_api import Browser, BrowserContext, Page, Route
 from playwright.async_api import Error as PlaywrightError
+from internal import subresources
+from internal.blocking import BlockRules, blocked_domains, install_blocking
+from internal.cluster import BrowserCluster
+from internal.logger import get_logger
+from internal.persistent import PersistentContext
+from internal.pool import ContextPool
+from internal.readiness import NetworkIdleTracker, scroll_down, wait_for_readiness
+from internal.scripts import get_script
 from router.query_params import CommonQueryParams, BrowserQueryParams, ProxyQueryParams
 
 from settings import (
-    USER_DATA_DIR,
+    BROWSER_TYPE,
+    PARSER_SCRIPTS_DIR,
     USER_SCRIPTS_DIR,
     SCREENSHOT_TYPE,
     SCREENSHOT_QUALITY,
@@ -15,16 +26,16 @@ from settings import (
 )
 
 
+T = TypeVar('T')
+
+PRECLEAN_MAX_NODES = 50_000  # nodes examined by clean.js, the rest of a huge page is left as is
+
+
 def get_device_options(device: str) -> dict:
     return copy.deepcopy(DEVICE_REGISTRY[device])
 
 
-@contextlib.asynccontextmanager
-async def new_context(
-    browser: Browser,
-    params: BrowserQueryParams,
-    proxy: ProxyQueryParams,
-):
+def context_options(browser_type: str, params: BrowserQueryParams, proxy: ProxyQueryParams) -> dict:
     # https://playwright.dev/python/docs/emulation
     options = get_device_options(params.device)
 
@@ -32,7 +43,7 @@ async def new_context(
         del options['default_browser_type']
 
     # PlaywrightError: options.isMobile is not supported in Firefox
-    if browser.browser_type.name == 'firefox':
+    if browser_type == 'firefox':
         del options['is_mobile']
 
     options |= {
@@ -70,26 +81,95 @@ async def new_context(
         if proxy.proxy_bypass:
             options['proxy']['bypass'] = proxy.proxy_bypass
 
-    # https://playwright.dev/python/docs/api/class-browser#browser-new-context
-    context: BrowserContext
+    return options
+
 
+@contextlib.asynccontextmanager
+async def new_page(
+    browsers: BrowserCluster,
+    persistent: PersistentContext,
+    params: BrowserQueryParams,
+    proxy: ProxyQueryParams,
+):
     if params.incognito:
-        # create a new incognito browser context
-        # (more efficient way, because it doesn't create a new browser instance)
-        context = await browser.new_context(**options)
+        async with new_context(browsers, params, proxy) as context:
+            # the page is closed together with the context (or by the pool when the context is reset)
+            yield await context.new_page()
     else:
-        # create a persistent browser context
-        # (less efficient way, because it creates a new browser instance)
-        context = await browser.browser_type.launch_persistent_context(
-            headless=True,
-            user_data_dir=USER_DATA_DIR,
-            **options,
-        )
+        # open a page in the long-lived persistent context shared by all non-incognito requests
+        options = context_options(persistent.browser_type, params, proxy)
+        async with persistent.new_page(options) as page:
+            yield page
+
+
+@contextlib.asynccontextmanager
+async def new_context(
+    browsers: BrowserCluster,
+    params: BrowserQueryParams,
+    proxy: ProxyQueryParams,
+):
+    # the context goes to the least-loaded browser instance
+    async with browsers.lease() as process:
+        async with _new_context(process.browser, process.pool, params, proxy) as context:
+            yield context
+
+
+@contextlib.asynccontextmanager
+async def _new_context(
+    browser: Browser,
+    pool: ContextPool,
+    params: BrowserQueryParams,
+    proxy: ProxyQueryParams,
+):
+    options = context_options(browser.browser_type.name, params, proxy)
+
+    # https://playwright.dev/python/docs/api/class-browser#browser-new-context
+    context: BrowserContext
+
+    if pool.max_size:
+        # lease a warm incognito browser context from the pool
+        # (the most efficient way, because the context is reused between requests)
+        async with pool.lease(options) as context:
+            yield context
+        return
+
+    # create a new incognito browser context
+    # (more efficient way, because it doesn't create a new browser instance)
+    context = await browser.new_context(**options)
     try:
         yield context
     finally:
-        # context should always be closed at the end
-        await context.close()
+        # context should always be closed at the end (it's already gone if the browser has crashed)
+        with contextlib.suppress(PlaywrightError):
+            await context.close()
+
+
+async def render(
+    browsers: BrowserCluster,
+    persistent: PersistentContext,
+    params: BrowserQueryParams,
+    proxy: ProxyQueryParams,
+    func: Callable[[Page], Awaitable[T]],
+) -> T:
+    # a request that was in flight when the browser crashed is retried once
+    for attempt in range(2):
+        async with new_page(browsers, persistent, params, proxy) as page:
+            try:
+                return await func(page)
+            except PlaywrightError:
+                if attempt or not is_crashed(page):
+                    raise
+
+        browsers.retries += 1
+        get_logger().warning(f'Browser crashed while processing the page, retrying: {page.url}')
+
+
+def is_crashed(page: Page) -> bool:
+    browser = page.context.browser
+    if browser is not None:
+        return not browser.is_connected()
+    # the persistent context has no browser object, the page is closed together with the context
+    return page.is_closed()
 
 
 async def page_processing(
@@ -99,51 +179,125 @@ async def page_processing(
     browser_params: BrowserQueryParams,
     init_scripts: Sequence[str] = None,
 ):
-    # add extra init scripts
+    # add extra init scripts (script contents, not paths)
     if init_scripts:
-        for path in init_scripts:
-            await page.add_init_script(path=path)
+        for script in init_scripts:
+            await page.add_init_script(script=script)
+
+    # serve static subresources from the shared disk cache (incognito contexts don't share the HTTP cache),
+    # the cache handler is installed first, so it runs after the blocking handler
+    if browser_params.incognito and subresources.cache.enabled:
+        await page.context.route('**/*', subresource_cacher(subresources.cache))
+
+    # block by resource types, URL patterns and domains
+    rules = BlockRules(
+        resource_types=browser_params.resource,
+        url_patterns=browser_params.block_urls or (),
+        domains=blocked_domains() if browser_params.block_trackers else None,
+    )
+    if rules:
+        # the persistent context is shared between requests, so its routes are set per page
+        await install_blocking(page, rules, BROWSER_TYPE.value, context_level=browser_params.incognito)
 
-    # block by resource types
-    if browser_params.resource:
-        handler = resource_blocker(whitelist=browser_params.resource)
-        await page.route('**/*', handler)
+    # in-flight requests must be counted from the very first one
+    tracker = NetworkIdleTracker(page) if browser_params.wait_for_network_idle else None
 
     # navigate to the given url
     await page.goto(url, timeout=browser_params.timeout, wait_until=browser_params.wait_until)
 
+    # wait until the page is ready (selector, network idle, DOM idle), capped by the wait timeout
+    await wait_for_readiness(
+        page,
+        selector=browser_params.wait_for_selector,
+        dom_idle=browser_params.wait_for_dom_idle,
+        network_idle=browser_params.wait_for_network_idle,
+        timeout=browser_params.wait_timeout,
+        tracker=tracker,
+    )
+
     # wait for the given timeout in milliseconds and scroll down the page
-    n = 10
     if browser_params.sleep:
-        for _ in range(n):
-            # scroll down the page by 1/n of the given scroll_down value
-            if browser_params.scroll_down:
-                await page.mouse.wheel(0, browser_params.scroll_down / n)
-            # sleep for 1/n of the given sleep value
-            await page.wait_for_timeout(browser_params.sleep / n)
-
-        # scroll to the top of the page for the screenshot to be in the correct position
         if browser_params.scroll_down:
+            await scroll_down(page, distance=browser_params.scroll_down, sleep=browser_params.sleep)
+            # scroll to the top of the page for the screenshot to be in the correct position
             await page.mouse.wheel(0, 0)
+        else:
+            await page.wait_for_timeout(browser_params.sleep)
 
     # add user scripts for DOM manipulation
     if params.user_scripts:
         for script in params.user_scripts:
-            await page.add_script_tag(path=USER_SCRIPTS_DIR / script)
+            await page.add_script_tag(content=get_script(USER_SCRIPTS_DIR / script))
 
     # wait for the given timeout in milliseconds after user scripts were injected.
     if params.user_scripts_timeout:
         await page.wait_for_timeout(params.user_scripts_timeout)
 
 
-def resource_blocker(whitelist: Sequence[str]):  # list of resource types to allow
-    async def block(route: Route):
-        if route.request.resource_type in whitelist:
-            await route.continue_()
-        else:
-            await route.abort()
+def subresource_cacher(cache: subresources.SubresourceCache):
+    async def handle(route: Route):
+        request = route.request
+        if not cache.accepts(request.method, request.resource_type, request.headers):
+            await route.fallback()
+            return
+
+        cached = await cache.get(request.url)
+        if cached:
+            entry, body = cached
+            await route.fulfill(status=entry.status, headers=entry.headers, body=body)
+            return
+
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except PlaywrightError:
+            # let the browser load the resource itself
+            await route.fallback()
+            return
+
+        await cache.put(request.url, response.status, response.headers, body)
+        # the body is already decoded, so the encoding headers are dropped
+        await route.fulfill(
+            status=response.status, headers=subresources.replayable_headers(response.headers), body=body
+        )
+
+    return handle
+
+
+async def capture(
+    page: Page,
+    content: bool = False,
+    screenshot: bool = False,
+    title: bool = False,
+) -> tuple[str | None, dict, bytes | None, str | None]:
+    """
+    Capture the settled page: social meta tags, and optionally HTML content, a screenshot and the title.
+    These are independent reads of the same page, so they run concurrently.
+    Parser scripts mutate the DOM (e.g. remove invisible elements), so they must run after this.
+    """
+
+    async def skip() -> None:
+        return None
+
+    # the meta tags are read in the page, so the full HTML is only serialized when it's needed
+    page_content, meta, image, page_title = await asyncio.gather(
+        page.content() if content else skip(),
+        page.evaluate(get_script(PARSER_SCRIPTS_DIR / 'meta.js')),
+        get_screenshot(page) if screenshot else skip(),
+        page.title() if title else skip(),
+    )
+    return page_content, meta, image, page_title
+
 
-    return block
+async def clean_page(page: Page, check_size: bool = False, remove_comments: bool = False) -> None:
+    # remove invisible elements (and comments) from the body in a single pass, before a parser runs
+    options = {'checkSize': check_size, 'removeComments': remove_comments, 'maxNodes': PRECLEAN_MAX_NODES}
+    res = await page.evaluate(get_script(PARSER_SCRIPTS_DIR / 'clean.js'), options)
+    if 'err' in res:
+        # the parser can still work on the page as is
+        get_logger().warning(f'{res["err"]}: {page.url}')
+    elif res['truncated']:
+        get_logger().debug(f'Page cleaning stopped after {res["examined"]} nodes: {page.url}')
 
 
 async def get_screenshot(page: Page):
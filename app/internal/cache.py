@@ -1,47 +1,480 @@
-import os
+import asyncio
+import datetime
+import gzip
 import hashlib
 import json
+import re
+import struct
+import time
+import zlib
 
+from collections import OrderedDict
+from enum import Enum
+from functools import cache
 from pathlib import Path
 from typing import Any
 
-from settings import USER_DATA_DIR, SCREENSHOT_TYPE
+from internal.logger import get_logger
+from internal.storage import CONTENT_BLOB, SCREENSHOT_BLOB, Stamp, Storage, open_storage
+from settings import (
+    WORKERS,
+    CACHE_BACKEND,
+    CACHE_WRITE_BEHIND,
+    CACHE_COMPRESSION,
+    CACHE_MAX_SIZE_MB,
+    CACHE_MAX_ENTRIES,
+    CACHE_MEMORY_SIZE_MB,
+    CacheCompression,
+)
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is used without it
+    zstandard = None
+
+# errors of reading a truncated or garbled record (gzip.BadGzipFile is an OSError)
+DECODE_ERRORS = (EOFError, OSError, struct.error, zlib.error, IndexError) + (
+    (zstandard.ZstdError,) if zstandard else ()
+)
+
+
+# on-disk format of results: magic, format version, codec, flags, then the (compressed) compact UTF-8 JSON;
+# version 1 had no flags, files without the magic are results saved as plain JSON by older versions
+MAGIC = b'SCRP'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('>4sBBB')
+HEADER_V1 = struct.Struct('>4sBB')
+FLAG_CONTENT = 1  # the full content of the page is stored apart from the result, in the blob store
+CONTENT_FIELD = 'fullContent'
+# the resultUri field of a stored result, compact or with the spaces of json.dumps defaults (legacy results)
+RESULT_URI = re.compile(rb'"resultUri"\s*:\s*"([^"\\]*)"')
+CODECS = {CacheCompression.NONE: 0, CacheCompression.GZIP: 1, CacheCompression.ZSTD: 2}
+GZIP_LEVEL = 5  # a good ratio for text, noticeably faster than the default 9
+ZSTD_LEVEL = 3
+EPOCH = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+
+# the atime of a result file is its last use, the janitor evicts the least recently used results
+TRACK_ACCESS = bool(CACHE_MAX_SIZE_MB or CACHE_MAX_ENTRIES)
+TOUCH_INTERVAL = 60  # seconds, the atime of results served from memory is updated at most this often
+
+# other workers may rewrite or remove a result, then the copy in memory is checked against the storage
+VALIDATE_MEMORY = WORKERS > 1
+
+
+class Freshness(Enum):
+    FRESH = 'fresh'  # served as is
+    STALE = 'stale'  # served as is, and re-rendered in the background
+    EXPIRED = 'expired'  # re-rendered before the response
+
+
+class MemoryEntry:
+    # a stored result, without its blobs
+    __slots__ = ('payload', 'flags', 'stamp', 'digest', 'touched')
+
+    def __init__(self, payload: bytes, flags: int, stamp: Stamp, digest: str):
+        self.payload = payload  # compact UTF-8 JSON
+        self.flags = flags
+        self.stamp = stamp
+        self.digest = digest  # hash of the payload, the version of the result with its blobs
+        self.touched = time.monotonic()
+
+
+class CachedResult:
+    __slots__ = ('payload', 'date', 'digest')
+
+    def __init__(self, payload: bytes, date: float, digest: str):
+        self.payload = payload  # compact UTF-8 JSON, ready to be sent
+        self.date = date  # when the result was rendered, unix time
+        self.digest = digest
+
+
+class MemoryTier:
+    """
+    Recently read or written results in memory, in front of the disk cache.
+
+    Results are kept serialized (compact UTF-8 JSON), so a hit can be sent as is without re-encoding.
+    The full content of the pages isn't kept here, it's read from the blob store only when a result is sent.
+    The total size of the results is capped, the least recently used are evicted first.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size  # in bytes, 0 disables the tier
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[str, MemoryEntry] = OrderedDict()
+
+    def get(self, key: str) -> MemoryEntry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: MemoryEntry) -> None:
+        self.discard(key)
+        # a result that takes a large part of the budget would evict many others
+        if len(entry.payload) > self.max_size // 8:
+            return
+        self._entries[key] = entry
+        self.size += len(entry.payload)
+        while self.size > self.max_size:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= len(entry.payload)
+            self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.payload)
+
+    def invalidate(self, key: str) -> None:
+        # the result has been rewritten or removed on the disk, the hit is counted as a miss
+        self.discard(key)
+        self.invalidations += 1
+        self.hits -= 1
+        self.misses += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRatio': round(self.hits / total, 3) if total else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'size': self.size,
+            'maxSize': self.max_size,
+        }
+
+
+class DiskTier:
+    # hits and misses of the results read from the disk
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRatio': round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# opened at the startup of a worker (open_cache), other processes that import the module don't need it
+storage: Storage | None = None
+memory = MemoryTier(max_size=CACHE_MEMORY_SIZE_MB * 2**20)
+disk = DiskTier()
+
+# results that are being written in the background (write-behind), they are served from here until then
+_pending: dict[str, tuple[Any, bytes | None]] = {}
+_tasks: set[asyncio.Task] = set()
 
 
 def make_key(s: Any) -> str:
     return hashlib.sha1(str(s).encode()).hexdigest()
 
 
-def dump_result(data: Any, key: str, screenshot: bytes | None = None) -> None:
-    path = json_location(key)
+async def dump_result(data: Any, key: str, screenshot: bytes | None = None) -> None:
+    # the file I/O runs in a thread, so a slow disk doesn't stall the event loop
+    if not CACHE_WRITE_BEHIND:
+        entry = await asyncio.to_thread(_dump_result, data, key, screenshot)
+        _remember(key, entry)
+        return
+
+    # write-behind: the response doesn't wait for the disk
+    _pending[key] = (data, screenshot)
+    memory.discard(key)
+    task = asyncio.create_task(_write_behind(data, key, screenshot))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def load_result(key: str) -> Any | None:
+    if key in _pending:
+        return _pending[key][0]
+    payload = await load_payload(key)
+    if payload is None:
+        return None
+    return json.loads(payload)
+
+
+async def load_payload(key: str) -> bytes | None:
+    # the result as compact UTF-8 JSON, ready to be sent
+    cached = await load_cached(key)
+    return cached.payload if cached else None
+
+
+async def load_cached(key: str, content: bool = True) -> CachedResult | None:
+    # the result ready to be sent, with its date and hash, without decoding it;
+    # without content, the full content of the page isn't read (e.g. only the date and hash are needed)
+    if key in _pending:
+        data = _pending[key][0]
+        payload = serialize(data)
+        return CachedResult(payload, (result_time(data) or time.time_ns()) / 1e9, _digest(payload))
+
+    entry = await _load_record(key)
+    if entry is None:
+        return None
+    payload = entry.payload
+    if content and entry.flags & FLAG_CONTENT:
+        blob = await asyncio.to_thread(_load_blob, key, CONTENT_BLOB)
+        if blob is None:
+            return None  # removed meanwhile
+        payload = attach_content(payload, blob)
+    return CachedResult(payload, entry.stamp[1] / 1e9, entry.digest)
+
+
+def result_time(data: Any) -> int | None:
+    # the date field of a result in ns, it's saved as the mtime of the stored result
+    try:
+        date = datetime.datetime.fromisoformat(data['date'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return (date - EPOCH) // datetime.timedelta(microseconds=1) * 1000
+
+
+def freshness(date: float, max_age: int | None, stale_while_revalidate: int = 0) -> Freshness:
+    # the age of a result is the time since it was rendered, its date is in unix time
+    if max_age is None:
+        return Freshness.FRESH
+    age = time.time() - date
+    if age <= max_age:
+        return Freshness.FRESH
+    if age <= max_age + stale_while_revalidate:
+        return Freshness.STALE
+    return Freshness.EXPIRED
 
-    # create dir if not exists
-    d = os.path.dirname(path)
-    if not os.path.exists(d):
-        os.makedirs(d, exist_ok=True)
 
-    # save result as json
-    with open(path, mode='w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=True)
+async def load_screenshot(key: str) -> Path | bytes | None:
+    # a file can be sent as is, other storages return the screenshot itself
+    if key in _pending:
+        return _pending[key][1]  # not written to the storage yet
+    return await asyncio.to_thread(storage.blob, key, SCREENSHOT_BLOB)
 
-    # save screenshot
+
+def open_cache() -> None:
+    global storage
+    if storage is None:
+        storage = open_storage(CACHE_BACKEND)
+
+
+async def close_cache() -> None:
+    # the results saved in the background are written first
+    global storage
+    await flush()
+    if storage is not None:
+        await asyncio.to_thread(storage.close)
+        storage = None
+
+
+async def flush() -> None:
+    # wait for all background writes, e.g. before shutdown
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
+
+
+def stats() -> dict:
+    return {'memory': memory.stats(), 'disk': disk.stats()}
+
+
+def _remember(key: str, entry: MemoryEntry) -> None:
+    if memory.max_size:
+        memory.put(key, entry)
+
+
+async def _load_record(key: str) -> MemoryEntry | None:
+    if memory.max_size:
+        entry = memory.get(key)
+        if entry is not None and await _still_valid(key, entry):
+            return entry
+
+    entry = await asyncio.to_thread(_load_payload, key)
+    if entry is None:
+        disk.misses += 1
+        return None
+    disk.hits += 1
+    _remember(key, entry)
+    return entry
+
+
+async def _still_valid(key: str, entry: MemoryEntry) -> bool:
+    touch = TRACK_ACCESS and time.monotonic() - entry.touched > TOUCH_INTERVAL
+    if not VALIDATE_MEMORY and not touch:
+        return True
+
+    stamp = await asyncio.to_thread(storage.stamp, key, touch)
+    if stamp != entry.stamp:
+        memory.invalidate(key)
+        return False
+    if touch:
+        entry.touched = time.monotonic()
+    return True
+
+
+async def _write_behind(data: Any, key: str, screenshot: bytes | None) -> None:
+    entry = None
+    try:
+        entry = await asyncio.to_thread(_dump_result, data, key, screenshot)
+    except Exception as exc:
+        get_logger().error(f'Result {key} could not be saved: {exc}')
+    finally:
+        # a newer result for the same key may be pending already
+        if _pending.get(key, (None,))[0] is data:
+            del _pending[key]
+            if entry is not None:
+                _remember(key, entry)
+
+
+def _dump_result(data: Any, key: str, screenshot: bytes | None) -> MemoryEntry:
+    blobs = {}
+    flags = 0
+    if isinstance(data, dict) and isinstance(data.get(CONTENT_FIELD), str):
+        # identical pages share the stored content, and it's read only when the result is sent
+        blobs[CONTENT_BLOB] = data[CONTENT_FIELD].encode()
+        data = {k: v for k, v in data.items() if k != CONTENT_FIELD}
+        flags |= FLAG_CONTENT
     if screenshot:
-        path = screenshot_location(key)
-        with open(path, mode='wb') as f:
-            f.write(screenshot)
+        blobs[SCREENSHOT_BLOB] = screenshot
+    payload = serialize(data)
+    stamp = storage.put(key, encode_payload(payload, flags=flags), blobs, mtime=result_time(data))
+    return MemoryEntry(payload, flags, stamp, _digest(payload))
 
 
-def load_result(key: str) -> Any | None:
-    path = json_location(key)
-    if not path.exists():
+def _load_payload(key: str) -> MemoryEntry | None:
+    res = storage.get(key, touch=TRACK_ACCESS)
+    if res is None:
         return None
-    with open(path, mode='r', encoding='utf-8') as f:
-        return json.load(f)
 
+    raw, stamp = res
+    try:
+        payload, flags = decode_record(raw)
+        return MemoryEntry(payload, flags, stamp, _digest(payload))
+    except ValueError as exc:
+        # e.g. corrupt, saved by a newer version, or with zstd while zstandard isn't installed; it's a cache miss
+        get_logger().warning(f'Result {key} could not be read: {exc}')
+        return None
+
+
+def _load_blob(key: str, name: str) -> bytes | None:
+    blob = storage.blob(key, name)
+    if isinstance(blob, Path):
+        try:
+            return blob.read_bytes()
+        except FileNotFoundError:
+            return None
+    return blob
+
+
+def _digest(payload: bytes) -> str:
+    # the full content and the screenshot are saved along with the result, their change changes its date
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def serialize(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def encode_result(data: Any, compression: CacheCompression | None = None) -> bytes:
+    return encode_payload(serialize(data), compression)
+
+
+def decode_result(raw: bytes) -> Any:
+    return json.loads(decode_payload(raw))
+
+
+def attach_content(payload: bytes, content: bytes) -> bytes:
+    # the full content goes last, {...} becomes {...,"fullContent":"..."}; the rest isn't decoded
+    field = f'"{CONTENT_FIELD}":'.encode() + json.dumps(content.decode(), ensure_ascii=False).encode()
+    return payload[:-1] + (b',' if len(payload) > 2 else b'') + field + b'}'
+
+
+def rebase_uris(payload: bytes, key: str, host_url: str) -> bytes:
+    # the URIs of a result point to the host it was rendered for; for another host they are replaced
+    # as exact JSON strings, without decoding the result (quotes inside strings are escaped)
+    host = json.dumps(host_url, ensure_ascii=False)[1:-1].encode()  # the host comes from the request
+    match = RESULT_URI.search(payload)
+    if match is None or not match.group(1).endswith(f'/result/{key}'.encode()):
+        if b'"resultUri"' in payload:
+            return _rebase_decoded(payload, key, host_url)  # e.g. escaped slashes
+        return payload
+    old = match.group(1)[: -len(f'/result/{key}')]
+    if old == host:
+        return payload
+    for path in ('result', 'screenshot'):
+        suffix = f'/{path}/{key}"'.encode()
+        payload = payload.replace(b'"' + old + suffix, b'"' + host + suffix, 1)
+    return payload
+
+
+def _rebase_decoded(payload: bytes, key: str, host_url: str) -> bytes:
+    data = json.loads(payload)
+    if not isinstance(data, dict):
+        return payload
+    for field, path in (('resultUri', 'result'), ('screenshotUri', 'screenshot')):
+        if isinstance(data.get(field), str) and data[field].endswith(f'/{path}/{key}'):
+            data[field] = f'{host_url}/{path}/{key}'
+    return serialize(data)
+
+
+def encode_payload(payload: bytes, compression: CacheCompression | None = None, flags: int = 0) -> bytes:
+    compression = compression or codec()
+    if compression == CacheCompression.GZIP:
+        payload = gzip.compress(payload, compresslevel=GZIP_LEVEL, mtime=0)
+    elif compression == CacheCompression.ZSTD:
+        payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, CODECS[compression], flags) + payload
+
+
+def decode_payload(raw: bytes) -> bytes:
+    return decode_record(raw)[0]
+
+
+def decode_record(raw: bytes) -> tuple[bytes, int]:
+    # returns the payload and the flags; a record that can't be read (e.g. truncated) raises ValueError
+    try:
+        return _decode_record(raw)
+    except DECODE_ERRORS as exc:
+        raise ValueError(f'corrupt record: {exc!r}') from exc
+
+
+def _decode_record(raw: bytes) -> tuple[bytes, int]:
+    if not raw.startswith(MAGIC):
+        json.loads(raw)  # legacy plain JSON, it's checked once, it's kept in memory after that
+        return raw, 0
 
-def json_location(filename: str) -> Path:
-    return USER_DATA_DIR / '_res' / filename[:2] / filename
+    _, version, codec_id = HEADER_V1.unpack_from(raw)
+    if version == FORMAT_VERSION:
+        flags, offset = raw[HEADER_V1.size], HEADER.size
+    elif version == 1:
+        flags, offset = 0, HEADER_V1.size
+    else:
+        raise ValueError(f'unsupported format version {version}')
+    payload = memoryview(raw)[offset:]
+    if codec_id == CODECS[CacheCompression.GZIP]:
+        return gzip.decompress(payload), flags
+    if codec_id == CODECS[CacheCompression.ZSTD]:
+        if zstandard is None:
+            raise ValueError('zstd compressed, but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(payload), flags
+    if codec_id == CODECS[CacheCompression.NONE]:
+        return bytes(payload), flags
+    raise ValueError(f'unknown codec {codec_id}')
 
 
-def screenshot_location(filename: str) -> Path:
-    return USER_DATA_DIR / '_res' / filename[:2] / (filename + '.' + SCREENSHOT_TYPE.value)
+@cache
+def codec() -> CacheCompression:
+    if CACHE_COMPRESSION == CacheCompression.ZSTD and zstandard is None:
+        get_logger().warning('CACHE_COMPRESSION is zstd, but zstandard is not installed, gzip is used instead')
+        return CacheCompression.GZIP
+    return CACHE_COMPRESSION
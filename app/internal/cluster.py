@@ -0,0 +1,377 @@
+import asyncio
+import contextlib
+import os
+import time
+
+from playwright.async_api import async_playwright, Browser, BrowserType, Playwright
+from playwright.async_api import Error as PlaywrightError
+
+from internal.logger import get_logger
+from internal.pool import ContextPool
+
+
+RELAUNCH_WAIT_TIMEOUT = 60  # seconds to wait for a crashed browser to be relaunched
+
+# one driver starts at a time, so that the new driver process can be told apart from the others
+DRIVER_START = asyncio.Lock()
+
+
+class BrowserProcess:
+    """
+    A launched browser with its own Playwright driver connection and its own pool of warm contexts.
+    """
+
+    def __init__(self, playwright: Playwright, browser: Browser, pool: ContextPool, driver_pid: int | None = None):
+        self.playwright = playwright
+        self.browser = browser
+        self.pool = pool
+        self.driver_pid = driver_pid  # the browser processes are its descendants
+        self.in_use = 0  # number of contexts currently leased from this browser
+        self.contexts_served = 0
+        self.started_at = time.monotonic()
+        self.idle = asyncio.Event()  # set when there are no leased contexts
+        self.idle.set()
+
+    @classmethod
+    async def launch(
+        cls,
+        browser_type: str,
+        pool_size: int,
+        pool_idle_timeout: float,
+        warm_up_options: dict | None = None,
+        pool_max_idle: int | None = None,
+    ) -> 'BrowserProcess':
+        async with DRIVER_START:
+            before = await asyncio.to_thread(driver_pids)
+            playwright = await async_playwright().start()
+            started = await asyncio.to_thread(driver_pids) - before
+        driver_pid = started.pop() if len(started) == 1 else None
+        if driver_pid is None:
+            get_logger().warning('The Playwright driver process is not found, the browser RSS will not be measured')
+
+        try:
+            bt: BrowserType = getattr(playwright, browser_type)
+            browser = await bt.launch(headless=True)
+            pool = ContextPool(browser, max_size=pool_size, idle_timeout=pool_idle_timeout, max_idle=pool_max_idle)
+            pool.start()
+            if warm_up_options:
+                await pool.warm_up(warm_up_options, n=pool_size)
+        except BaseException:
+            await playwright.stop()
+            raise
+        return cls(playwright, browser, pool, driver_pid)
+
+    async def close(self) -> None:
+        await self.pool.close()
+        with contextlib.suppress(PlaywrightError):
+            await self.browser.close()
+        # the driver connection may already be gone if the browser has crashed
+        with contextlib.suppress(Exception):
+            await self.playwright.stop()
+
+    async def drain(self) -> None:
+        # close the browser once its in-flight contexts are finished
+        await self.idle.wait()
+        await self.close()
+
+    def acquire(self) -> None:
+        self.in_use += 1
+        self.contexts_served += 1
+        self.idle.clear()
+
+    def release(self) -> None:
+        self.in_use -= 1
+        if self.in_use == 0:
+            self.idle.set()
+
+    def is_connected(self) -> bool:
+        return self.browser.is_connected()
+
+    def uptime(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def rss(self) -> int | None:
+        # memory of the Playwright driver and all its descendants (the browser processes), in bytes
+        if self.driver_pid is None:
+            return None
+        return process_tree_rss(self.driver_pid)
+
+
+class BrowserInstance:
+    """
+    A slot for a browser process: it survives browser crashes (relaunch) and planned replacements (recycle).
+    """
+
+    def __init__(
+        self,
+        index: int,
+        browser_type: str,
+        pool_size: int,
+        pool_idle_timeout: float,
+        warm_up_options: dict | None = None,
+        pool_max_idle: int | None = None,
+    ):
+        self.index = index
+        self.browser_type = browser_type
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.pool_max_idle = pool_max_idle
+        self.warm_up_options = warm_up_options
+        self.contexts_served = 0
+        self.crashes = 0
+        self.restarts = 0
+        self.recycles = 0
+        self.process: BrowserProcess | None = None
+        self.retiring: set[BrowserProcess] = set()  # replaced processes waiting for their contexts to finish
+        self.ready = asyncio.Event()  # set while the browser is launched and connected
+        self.disconnected = asyncio.Event()  # set when the browser has disconnected unexpectedly
+        self._closing = False
+        self._drain_tasks: set[asyncio.Task] = set()
+        self._switch = asyncio.Lock()  # relaunch and recycle replace the process one at a time
+
+    async def start(self) -> None:
+        self._activate(await self._launch())
+
+    async def relaunch(self) -> None:
+        # the old browser is gone, so are its contexts; the driver connection is restarted as well
+        async with self._switch:
+            if not self.disconnected.is_set():
+                return  # the crashed browser has been replaced by a recycle meanwhile
+            old = self.process
+            if old:
+                await old.close()
+            self._activate(await self._launch(), previous=old)
+            self.restarts += 1
+
+    async def recycle(self) -> None:
+        # start a replacement in the background, move new work to it, then drain the old browser
+        async with self._switch:
+            new = await self._launch()
+            old = self.process
+            self._activate(new, previous=old)
+            self.recycles += 1
+        if old:
+            self.retiring.add(old)
+            task = asyncio.create_task(old.drain())
+            self._drain_tasks.add(task)
+            task.add_done_callback(lambda t: self._retired(t, old))
+
+    async def close(self) -> None:
+        self._closing = True
+        for task in list(self._drain_tasks):
+            task.cancel()
+        for process in [self.process, *self.retiring]:
+            if process:
+                await process.close()
+
+    async def wait_ready(self, timeout: float) -> None:
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.ready.wait(), timeout)
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        process = self.process
+        process.acquire()
+        self.contexts_served += 1
+        try:
+            yield process
+        finally:
+            process.release()
+
+    @property
+    def browser(self) -> Browser | None:
+        return self.process.browser if self.process else None
+
+    @property
+    def pool(self) -> ContextPool | None:
+        return self.process.pool if self.process else None
+
+    @property
+    def in_use(self) -> int:
+        return sum(x.in_use for x in [self.process, *self.retiring] if x)
+
+    def is_connected(self) -> bool:
+        return self.process is not None and self.process.is_connected()
+
+    async def recycle_reason(self, max_contexts: int, max_uptime: float, max_rss: int) -> str | None:
+        # limits equal to 0 are disabled; the browser state is read on the event loop, /proc in a thread
+        process = self.process
+        if process is None or not process.is_connected():
+            return None
+        if max_contexts and process.contexts_served >= max_contexts:
+            return f'{process.contexts_served} contexts served'
+        if max_uptime and process.uptime() >= max_uptime:
+            return f'uptime {int(process.uptime())}s'
+        if max_rss:
+            rss = await asyncio.to_thread(process.rss)
+            if rss is not None and rss >= max_rss:
+                return f'RSS {rss // 2**20} MiB'
+        return None
+
+    def stats(self) -> dict:
+        process = self.process
+        return {
+            'index': self.index,
+            'isConnected': self.is_connected(),
+            'contextsInUse': self.in_use,
+            'contextsOpen': len(process.browser.contexts) if process else 0,
+            'contextsServed': self.contexts_served,
+            'uptime': int(process.uptime()) if process else 0,
+            'crashes': self.crashes,
+            'restarts': self.restarts,
+            'recycles': self.recycles,
+            'retiring': len(self.retiring),
+            'contextPool': process.pool.stats() if process else {},
+        }
+
+    async def _launch(self) -> BrowserProcess:
+        return await BrowserProcess.launch(
+            self.browser_type,
+            pool_size=self.pool_size,
+            pool_idle_timeout=self.pool_idle_timeout,
+            warm_up_options=self.warm_up_options,
+            pool_max_idle=self.pool_max_idle,
+        )
+
+    def _activate(self, process: BrowserProcess, previous: BrowserProcess | None = None) -> None:
+        if previous:
+            process.pool.inherit_stats(previous.pool)
+        process.browser.on('disconnected', lambda _: self._on_disconnected(process))
+        self.process = process
+        self.disconnected.clear()
+        self.ready.set()
+
+    def _on_disconnected(self, process: BrowserProcess) -> None:
+        # only a crash of the current browser matters, retired browsers are closed on purpose
+        if not self._closing and process is self.process:
+            self.ready.clear()
+            self.disconnected.set()
+
+    def _retired(self, task: asyncio.Task, process: BrowserProcess) -> None:
+        self._drain_tasks.discard(task)
+        self.retiring.discard(process)
+
+
+class BrowserCluster:
+    """
+    A set of browser instances; new contexts go to the least-loaded one.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        browser_type: str,
+        pool_size: int,
+        pool_idle_timeout: float,
+        warm_up_options: dict | None = None,
+        pool_max_idle: int | None = None,
+    ):
+        self.instances = [
+            BrowserInstance(i, browser_type, pool_size, pool_idle_timeout, warm_up_options, pool_max_idle)
+            for i in range(size)
+        ]
+        self.retries = 0  # in-flight requests retried after a browser crash
+
+    async def start(self) -> None:
+        await asyncio.gather(*(x.start() for x in self.instances))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(x.close() for x in self.instances))
+
+    def pick(self) -> BrowserInstance:
+        # prefer connected instances, then the least-loaded one
+        return min(self.instances, key=lambda x: (not x.is_connected(), x.in_use))
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        instance = self.pick()
+        if not instance.is_connected():
+            # all instances are down, wait for the supervisor to relaunch the picked one
+            await instance.wait_ready(timeout=RELAUNCH_WAIT_TIMEOUT)
+        async with instance.lease() as process:
+            yield process
+
+    @property
+    def browser(self) -> Browser:
+        # the first instance represents the cluster (browser type, version)
+        return self.instances[0].browser
+
+    def is_connected(self) -> bool:
+        return all(x.is_connected() for x in self.instances)
+
+    def contexts_count(self) -> int:
+        return sum(len(x.browser.contexts) for x in self.instances if x.browser)
+
+    def crashes(self) -> int:
+        return sum(x.crashes for x in self.instances)
+
+    def restarts(self) -> int:
+        return sum(x.restarts for x in self.instances)
+
+    def recycles(self) -> int:
+        return sum(x.recycles for x in self.instances)
+
+    def pool_stats(self) -> dict:
+        # context pool counters summed over all instances
+        res = {}
+        for instance in self.instances:
+            for key, value in (instance.pool.stats() if instance.pool else {}).items():
+                res[key] = res.get(key, 0) + value
+        return res
+
+    def stats(self) -> list[dict]:
+        return [x.stats() for x in self.instances]
+
+
+def process_children() -> dict[int, list[int]] | None:
+    # the child processes of every process, by the parent pid (Linux only)
+    children: dict[int, list[int]] = {}
+    try:
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{name}/stat', encoding='utf-8') as f:
+                    stat = f.read()
+            except OSError:
+                continue  # the process has already exited
+            # the process name may contain spaces, so fields are counted from the closing parenthesis
+            ppid = int(stat[stat.rindex(')') + 2 :].split()[1])
+            children.setdefault(ppid, []).append(int(name))
+    except OSError:
+        return None
+    return children
+
+
+def driver_pids() -> set[int]:
+    # the Playwright drivers started by this process (node ... cli.js run-driver)
+    pids = set()
+    for pid in (process_children() or {}).get(os.getpid(), []):
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                args = f.read().split(b'\0')
+        except OSError:
+            continue
+        if b'run-driver' in args:
+            pids.add(pid)
+    return pids
+
+
+def process_tree_rss(pid: int) -> int | None:
+    # sum of the resident set size of the process and all its descendants (Linux only)
+    children = process_children()
+    if children is None:
+        return None
+
+    rss = 0
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        stack.extend(children.get(p, []))
+        try:
+            with open(f'/proc/{p}/statm', encoding='utf-8') as f:
+                rss += int(f.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            continue
+    return rss
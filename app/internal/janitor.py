@@ -0,0 +1,198 @@
+import asyncio
+import contextlib
+import fcntl
+import json
+import time
+from pathlib import Path
+
+from internal import cache
+from internal.logger import get_logger
+from internal.storage import SHARDS, EntryInfo, Storage, write_atomic
+from settings import USER_DATA_DIR, CACHE_MAX_SIZE_MB, CACHE_MAX_ENTRIES, CACHE_MAX_AGE
+
+
+REMOVE_BATCH = 100  # results removed per thread call
+SHARDS_PER_SWEEP = 4  # of 256, a whole pass takes 64 sweeps
+SUMMARY_BUCKETS = 16  # per shard
+
+Bucket = tuple[float, int, int]  # the last use of its least recently used entry, total size, number of entries
+
+
+class CacheJanitor:
+    """
+    Keeps the result cache within the configured size, number of entries and age.
+
+    The cache is swept in the background, a few shards (see storage.SHARDS) at a time, each one in a thread,
+    so neither the requests nor the memory depend on the size of the cache. An entry is a result with its blobs
+    (full content, screenshot). Expired entries are removed first, then the least recently used ones
+    until the cache fits the limits.
+
+    The shards that aren't being swept are known by a summary of their last sweep: the total size and count
+    of their entries in a few buckets by the last use. The summaries and the position of the sweep are kept
+    in a state file, so with several workers, whichever of them sweeps (one at a time) continues the pass.
+    """
+
+    def __init__(
+        self,
+        storage: Storage | None,
+        lock_path: Path,
+        max_size: int,
+        max_entries: int,
+        max_age: float,
+        shards_per_sweep: int = SHARDS_PER_SWEEP,
+    ):
+        self.storage = storage  # None is the storage of the result cache, opened at startup
+        self.lock_path = lock_path
+        self.state_path = lock_path.with_suffix('.json')
+        self.max_size = max_size  # in bytes, 0 is unlimited
+        self.max_entries = max_entries  # 0 is unlimited
+        self.max_age = max_age  # in seconds, 0 is unlimited
+        self.shards_per_sweep = shards_per_sweep
+        self.size = 0  # as of the last sweep
+        self.entries = 0
+        self.expired = 0
+        self.evicted = 0
+        self.sweeps = 0
+        self.last_sweep_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_size or self.max_entries or self.max_age)
+
+    async def run(self, interval: float) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as exc:
+                get_logger().error(f'Result cache sweep failed: {exc}')
+            await asyncio.sleep(interval)
+
+    async def sweep(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock() as locked:
+            if not locked:
+                return  # another worker is sweeping
+            t0 = time.monotonic()
+            now = time.time()
+            storage = self.storage or cache.storage
+            cursor, summaries = await asyncio.to_thread(self._load_state)
+            for _ in range(min(self.shards_per_sweep, len(SHARDS))):
+                shard = SHARDS[cursor]
+                entries = await asyncio.to_thread(storage.scan_shard, shard, now)
+                others = [b for name, buckets in summaries.items() if name != shard for b in buckets]
+                expired, evicted, kept = self._select(entries, others, now)
+                await self._remove(expired + evicted)
+                summaries[shard] = summarize(kept)
+                self.expired += len(expired)
+                self.evicted += len(evicted)
+                cursor = (cursor + 1) % len(SHARDS)
+            await asyncio.to_thread(self._save_state, cursor, summaries)
+
+            buckets = [b for x in summaries.values() for b in x]
+            self.size = sum(size for _, size, _ in buckets)
+            self.entries = sum(count for _, _, count in buckets)
+            self.sweeps += 1
+            self.last_sweep_ms = round((time.monotonic() - t0) * 1000, 1)
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size,
+            'entries': self.entries,
+            'maxSize': self.max_size,
+            'maxEntries': self.max_entries,
+            'maxAge': self.max_age,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'sweeps': self.sweeps,
+            'lastSweepMs': self.last_sweep_ms,
+        }
+
+    def _select(
+        self, entries: list[EntryInfo], others: list[Bucket], now: float
+    ) -> tuple[list[EntryInfo], list[EntryInfo], list[EntryInfo]]:
+        # returns the expired entries of the shard, the least recently used ones that don't fit the limits
+        # along with the entries of the other shards, and the entries that are kept
+        expired = []
+        if self.max_age:
+            expired = [e for e in entries if now - e.mtime > self.max_age]
+            entries = [e for e in entries if now - e.mtime <= self.max_age]
+
+        # the most recently used first, the buckets of the other shards are whole
+        items = [(e.atime, e.size, 1, e) for e in entries] + [(*b, None) for b in others]
+        items.sort(key=lambda x: x[0], reverse=True)
+        size = count = 0
+        full = False
+        kept, evicted = [], []
+        for _, item_size, item_count, entry in items:
+            # once an item doesn't fit, neither do the ones used less recently than it
+            full = (
+                full
+                or bool(self.max_entries and count + item_count > self.max_entries)
+                or bool(self.max_size and size + item_size > self.max_size)
+            )
+            if full:
+                if entry:
+                    evicted.append(entry)  # the buckets of the other shards are evicted on their turn
+                continue
+            size += item_size
+            count += item_count
+            if entry:
+                kept.append(entry)
+        return expired, evicted, kept
+
+    def _load_state(self) -> tuple[int, dict[str, list[Bucket]]]:
+        # the position of the sweep and the summaries of the shards; a missing or broken file starts a new pass
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            cursor = state['cursor'] % len(SHARDS)
+            summaries = {k: [tuple(b) for b in v] for k, v in state['shards'].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return 0, {}
+        return cursor, summaries
+
+    def _save_state(self, cursor: int, summaries: dict[str, list[Bucket]]) -> None:
+        state = {'cursor': cursor, 'shards': {k: v for k, v in summaries.items() if v}}
+        write_atomic(self.state_path, json.dumps(state, separators=(',', ':')).encode())
+
+    async def _remove(self, entries: list[EntryInfo]) -> None:
+        for i in range(0, len(entries), REMOVE_BATCH):
+            keys = [e.key for e in entries[i : i + REMOVE_BATCH]]
+            await asyncio.to_thread((self.storage or cache.storage).remove, keys)
+            for key in keys:
+                cache.memory.discard(key)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def summarize(entries: list[EntryInfo]) -> list[Bucket]:
+    # the entries of a shard in a few buckets of about the same number of entries, by the last use
+    entries = sorted(entries, key=lambda e: e.atime, reverse=True)
+    step = -(-len(entries) // SUMMARY_BUCKETS)  # ceil
+    buckets = []
+    for i in range(0, len(entries), step or 1):
+        chunk = entries[i : i + step]
+        buckets.append((chunk[-1].atime, sum(e.size for e in chunk), len(chunk)))
+    return buckets
+
+
+janitor = CacheJanitor(
+    storage=None,
+    lock_path=USER_DATA_DIR / '.janitor.lock',
+    max_size=CACHE_MAX_SIZE_MB * 2**20,
+    max_entries=CACHE_MAX_ENTRIES,
+    max_age=CACHE_MAX_AGE,
+)
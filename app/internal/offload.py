@@ -0,0 +1,128 @@
+import asyncio
+import contextlib
+import functools
+import multiprocessing
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TypeVar
+
+from fastapi import HTTPException, status
+
+from internal.logger import get_logger
+
+
+T = TypeVar('T')
+
+
+class ProcessingPool:
+    """
+    Runs CPU-bound post-processing (content cleanup, links grouping) off the event loop.
+
+    Jobs run in a pool of worker processes (spawned, so they don't inherit the browser connections);
+    with 0 workers they run in a thread instead. Jobs beyond the running ones wait in a bounded queue,
+    a request is rejected when the queue is full, and a job that runs longer than the timeout fails the request.
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size  # max number of jobs waiting for a free worker
+        self.timeout = timeout  # in seconds
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.waiting = 0
+        self._started = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._slots = asyncio.Semaphore(max(workers, 1))
+        self._executor: Executor | None = None
+
+    def start(self) -> None:
+        if self.workers:
+            self._executor = self._new_executor()
+
+    async def close(self) -> None:
+        if self._executor:
+            # jobs that are still running are abandoned, their requests are already gone
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        # func and args must be picklable: a module-level function and plain data
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Too many pages are being processed, try again later',
+            )
+
+        t0 = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self._record_wait(time.monotonic() - t0)
+
+        executor = self._executor
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+        except BaseException:
+            self._slots.release()
+            raise
+        # the slot is taken until the job is finished, even if the request has gone away
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            res = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError as exc:
+            self.timeouts += 1
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=f'Page processing took longer than {self.timeout}s',
+            ) from exc
+        except BrokenProcessPool:
+            # a worker process has died (e.g. killed by the OOM killer), the pool can't be used anymore
+            self.failed += 1
+            self._restart(executor)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+
+        self.completed += 1
+        return res
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'running': max(self.workers, 1) - self._slots._value,
+            'waiting': self.waiting,
+            'queueSize': self.queue_size,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'queueWaitAvgMs': round(self._wait_total / self._started * 1000, 1) if self._started else 0.0,
+            'queueWaitMaxMs': round(self._wait_max * 1000, 1),
+        }
+
+    def _record_wait(self, wait: float) -> None:
+        self._started += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+
+    def _new_executor(self) -> Executor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _restart(self, broken: Executor | None) -> None:
+        # several jobs fail at once when the pool breaks, it's replaced only once
+        if broken is None or broken is not self._executor:
+            return
+        get_logger().warning('A post-processing worker has died, restarting the pool')
+        with contextlib.suppress(Exception):
+            broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
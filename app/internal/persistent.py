@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import fcntl
+import os
+from pathlib import Path
+
+from fastapi import HTTPException, status
+from playwright.async_api import async_playwright, Browser, BrowserContext, BrowserType, Page, Playwright
+from playwright.async_api import Error as PlaywrightError
+
+from internal.errors import QueryParsingError
+from internal.logger import get_logger
+
+
+# these options can be applied to a single page of the shared context; HTTP credentials can't: a page-level
+# Authorization header would be sent to every origin the page loads from
+PAGE_LEVEL_OPTIONS = ('viewport', 'extra_http_headers')
+
+LOCK_FILENAME = '.scrapper-profile.lock'
+DEVTOOLS_PORT_FILENAME = 'DevToolsActivePort'  # written by Chromium when --remote-debugging-port is set
+
+
+class PersistentContext:
+    """
+    The persistent browser context (user profile), opened once and shared by all non-incognito requests.
+
+    Only one process may open the profile directory. The worker that takes the profile lock owns the context;
+    with several workers on Chromium, the other workers connect to the owner's browser over CDP.
+    """
+
+    def __init__(self, browser_type: str, user_data_dir: Path, limit: int, options: dict, shared: bool = False):
+        self.browser_type = browser_type
+        self.user_data_dir = user_data_dir
+        self.options = options  # context options the profile is opened with
+        self.shared = shared and browser_type == 'chromium'  # CDP is only supported by Chromium
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.owner = False
+        self.playwright: Playwright | None = None
+        self.browser: Browser | None = None  # CDP connection to the owner's browser (for non-owners only)
+        self.context: BrowserContext | None = None
+        self._lock_fd: int | None = None
+        self._closed = False
+        self._relaunch = asyncio.Lock()  # one launch (or connection) at a time, the profile is opened once
+
+    async def start(self) -> None:
+        self.playwright = await async_playwright().start()
+        self.owner = self._acquire_lock()
+        if self.owner:
+            await self._launch()
+        elif not self.shared:
+            # only Chromium can share the profile with the other workers (over CDP)
+            get_logger().warning(
+                f'The persistent context is owned by another worker process, this one responds with 503 '
+                f'to the requests with incognito=no ({self.browser_type}); set UVICORN_WORKERS=1 to serve them all'
+            )
+
+    async def close(self) -> None:
+        if self.context and self.owner:
+            with contextlib.suppress(PlaywrightError):
+                await self.context.close()
+        if self.browser:
+            with contextlib.suppress(PlaywrightError):
+                await self.browser.close()
+        if self.playwright:
+            await self.playwright.stop()
+        self.context = None
+        self.browser = None
+        self._release_lock()
+
+    def is_connected(self) -> bool:
+        if self.context is None:
+            return False
+        if self.browser:
+            return self.browser.is_connected()
+        # the context of launch_persistent_context has no browser object, it's alive until it is closed
+        return not self._closed
+
+    @contextlib.asynccontextmanager
+    async def new_page(self, options: dict):
+        self._check_options(options)
+
+        async with self.semaphore:
+            context = await self._get_context()
+            page = await context.new_page()
+            try:
+                await apply_page_options(page, options)
+                yield page
+            finally:
+                with contextlib.suppress(PlaywrightError):
+                    await page.close()
+
+    def stats(self) -> dict:
+        return {
+            'owner': self.owner,
+            'isConnected': self.is_connected(),
+            'pagesLimit': self.limit,
+            'pagesInUse': self.limit - self.semaphore._value,
+        }
+
+    def _check_options(self, options: dict) -> None:
+        # context-level options can't be changed for a single page, they must match the profile's options
+        keys = set(options) | set(self.options)
+        mismatch = sorted(k for k in keys if k not in PAGE_LEVEL_OPTIONS and options.get(k) != self.options.get(k))
+        if mismatch:
+            msg = f'These options are not supported with a persistent context: {", ".join(mismatch)}'
+            raise QueryParsingError('incognito', msg, False)
+
+    async def _get_context(self) -> BrowserContext:
+        if self.context is not None and self.is_connected():
+            return self.context
+
+        async with self._relaunch:
+            # the context may have been relaunched by another request while this one waited
+            if self.context is not None and self.is_connected():
+                return self.context
+            if self.owner:
+                await self._launch()
+            elif self.shared:
+                await self._connect()
+            else:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail='The persistent context is owned by another worker process',
+                )
+            return self.context
+
+    async def _launch(self) -> None:
+        browser_type: BrowserType = getattr(self.playwright, self.browser_type)
+        kwargs = {}
+        if self.shared:
+            # let the other workers connect to this browser, the port is written to DevToolsActivePort
+            kwargs['args'] = ['--remote-debugging-address=127.0.0.1', '--remote-debugging-port=0']
+        self.context = await browser_type.launch_persistent_context(
+            headless=True,
+            user_data_dir=self.user_data_dir,
+            **kwargs,
+            **self.options,
+        )
+        self._closed = False
+        self.context.on('close', self._on_close)
+
+    async def _connect(self) -> None:
+        path = self.user_data_dir / DEVTOOLS_PORT_FILENAME
+        try:
+            port = int(path.read_text().splitlines()[0])
+        except (OSError, ValueError, IndexError) as exc:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='The persistent context is not ready yet',
+            ) from exc
+
+        if self.browser:
+            with contextlib.suppress(PlaywrightError):
+                await self.browser.close()
+        self.browser = await self.playwright.chromium.connect_over_cdp(f'http://127.0.0.1:{port}')
+        self.context = self.browser.contexts[0]  # the default context is the persistent one
+        get_logger().debug(f'Connected to the persistent context on port {port}')
+
+    def _on_close(self, _: BrowserContext) -> None:
+        self._closed = True
+
+    def _acquire_lock(self) -> bool:
+        fd = os.open(self.user_data_dir / LOCK_FILENAME, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _release_lock(self) -> None:
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+async def apply_page_options(page: Page, options: dict) -> None:
+    if options.get('viewport'):
+        await page.set_viewport_size(options['viewport'])
+
+    if options.get('extra_http_headers'):
+        await page.set_extra_http_headers(options['extra_http_headers'])
@@ -0,0 +1,225 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import time
+
+from urllib.parse import urlsplit
+
+from playwright.async_api import Browser, BrowserContext, Frame
+from playwright.async_api import Error as PlaywrightError
+
+from internal.logger import get_logger
+
+
+def frame_origin(url: str) -> str | None:
+    # the origin as Chromium spells it, the default port is omitted; about:blank and data: URLs have no storage
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    return f'{parts.scheme}://{parts.netloc.rpartition("@")[2].lower()}'
+
+
+def options_fingerprint(options: dict) -> str:
+    # the same options always produce the same fingerprint, regardless of the key order
+    s = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha1(s.encode()).hexdigest()
+
+
+class ContextPool:
+    """
+    Pool of warm incognito browser contexts, keyed by the fingerprint of the context options.
+    A leased context is reset (pages, cookies, storage, routes) before it is returned to the pool.
+    The pool tracks the origins every context has visited: on Chromium their storage and the HTTP cache
+    are cleared through CDP, other browsers can't clear the storage of origins that aren't open,
+    so their contexts are closed instead once they have visited any origin.
+    """
+
+    def __init__(self, browser: Browser, max_size: int, idle_timeout: float, max_idle: int | None = None):
+        self.browser = browser
+        self.max_size = max_size  # max number of idle contexts per key
+        # max number of idle contexts of all keys (None is unlimited), the least recently returned one is closed
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout  # in seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._idle: dict[str, list[tuple[BrowserContext, float]]] = {}
+        self._origins: dict[BrowserContext, set[str]] = {}  # the origins each open context has visited
+        self._evictor: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.max_size and self._evictor is None:
+            self._evictor = asyncio.create_task(self._evict_loop())
+
+    async def close(self) -> None:
+        if self._evictor:
+            self._evictor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._evictor
+            self._evictor = None
+
+        idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for context, _ in entries:
+                await self._close_context(context)
+
+    @contextlib.asynccontextmanager
+    async def lease(self, options: dict):
+        key = options_fingerprint(options)
+        context = self._take(key)
+        if context:
+            self.hits += 1
+        else:
+            self.misses += 1
+            context = await self._new_context(options)
+
+        try:
+            yield context
+        finally:
+            await self._give_back(key, context)
+
+    async def warm_up(self, options: dict, n: int = 1) -> None:
+        key = options_fingerprint(options)
+        entries = self._idle.setdefault(key, [])
+        while len(entries) < min(n, self.max_size) and not self._full():
+            context = await self._new_context(options)
+            entries.append((context, time.monotonic()))
+        if not entries:
+            del self._idle[key]
+
+    async def evict_idle(self) -> int:
+        deadline = time.monotonic() - self.idle_timeout
+        expired = []
+        for key in list(self._idle):
+            entries = self._idle[key]
+            expired.extend(context for context, released_at in entries if released_at < deadline)
+            entries[:] = [x for x in entries if x[1] >= deadline]
+            if not entries:
+                del self._idle[key]
+
+        for context in expired:
+            await self._close_context(context)
+        self.evictions += len(expired)
+        return len(expired)
+
+    def inherit_stats(self, other: 'ContextPool') -> None:
+        # keep the counters cumulative when the browser is replaced
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'idle': self._idle_count(),
+            'keys': len(self._idle),
+        }
+
+    async def _new_context(self, options: dict) -> BrowserContext:
+        context = await self.browser.new_context(**options)
+        origins = self._origins[context] = set()
+
+        def on_navigated(frame: Frame) -> None:
+            # every document that could have stored something, including redirect targets and removed iframes
+            origin = frame_origin(frame.url)
+            if origin:
+                origins.add(origin)
+
+        context.on('page', lambda page: page.on('framenavigated', on_navigated))
+        return context
+
+    def _take(self, key: str) -> BrowserContext | None:
+        entries = self._idle.get(key)
+        if not entries:
+            return None
+        context, _ = entries.pop()  # the most recently used context is the warmest one
+        if not entries:
+            del self._idle[key]
+        return context
+
+    async def _give_back(self, key: str, context: BrowserContext) -> None:
+        entries = self._idle.get(key, [])
+        if len(entries) >= self.max_size or not self.browser.is_connected():
+            await self._close_context(context)
+            return
+
+        chromium = self.browser.browser_type.name == 'chromium'
+        try:
+            reusable = await reset_context(context, self._origins.get(context, set()), chromium)
+        except PlaywrightError:
+            reusable = False
+        if not reusable:
+            # the context can't be reused if its state couldn't be reset
+            await self._close_context(context)
+            return
+
+        # requests with distinct options (headers, proxies) must not pile up idle contexts
+        while self._idle and self._full():
+            await self._close_context(self._take_oldest())
+            self.evictions += 1
+        self._idle.setdefault(key, []).append((context, time.monotonic()))
+
+    def _full(self) -> bool:
+        return self.max_idle is not None and self._idle_count() >= self.max_idle
+
+    def _idle_count(self) -> int:
+        return sum(len(x) for x in self._idle.values())
+
+    def _take_oldest(self) -> BrowserContext:
+        # the entries of a key are in the order they were returned
+        key = min(self._idle, key=lambda k: self._idle[k][0][1])
+        context, _ = self._idle[key].pop(0)
+        if not self._idle[key]:
+            del self._idle[key]
+        return context
+
+    async def _evict_loop(self) -> None:
+        logger = get_logger()
+        interval = max(self.idle_timeout / 2, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                n = await self.evict_idle()
+            except Exception as exc:  # the loop must survive any error
+                logger.warning(f'Context pool eviction failed: {exc}')
+            else:
+                if n:
+                    logger.debug(f'Context pool: {n} idle contexts evicted')
+
+    async def _close_context(self, context: BrowserContext) -> None:
+        self._origins.pop(context, None)
+        with contextlib.suppress(PlaywrightError):
+            await context.close()
+
+
+async def reset_context(context: BrowserContext, origins: set[str], chromium: bool) -> bool:
+    """
+    Clear the state of the context: pages, storage of the visited origins, HTTP cache, routes, cookies, permissions.
+    Returns False if the state can't be cleared completely, such a context must not be reused.
+    """
+    if origins and not chromium:
+        return False
+
+    for page in context.pages:
+        await page.close()  # before the storage is cleared, so that no script writes to it meanwhile
+
+    if origins:
+        # the storage of the origins (local storage, IndexedDB, service workers, cache storage...) is
+        # cleared through a blank page, the origins don't have to be open; the HTTP cache is per context
+        page = await context.new_page()
+        try:
+            session = await context.new_cdp_session(page)
+            for origin in sorted(origins):
+                await session.send('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+            await session.send('Network.clearBrowserCache')
+        finally:
+            await page.close()
+        origins.clear()
+
+    await context.unroute_all(behavior='ignoreErrors')
+    await context.clear_cookies()
+    await context.clear_permissions()
+    return True
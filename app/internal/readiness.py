@@ -0,0 +1,133 @@
+import asyncio
+import contextlib
+import time
+
+from playwright.async_api import Page, Request
+from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+
+from internal.logger import get_logger
+
+
+# resolves to true once the DOM hasn't changed for `idle` ms, or to false when `timeout` ms have passed
+DOM_IDLE_SCRIPT = """([idle, timeout]) => new Promise(resolve => {
+    let timer = null;
+    let observer = null;
+    const finish = (res) => {
+        if (observer) observer.disconnect();
+        clearTimeout(timer);
+        clearTimeout(cap);
+        resolve(res);
+    };
+    const cap = setTimeout(() => finish(false), timeout);
+    observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(() => finish(true), idle);
+    });
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    timer = setTimeout(() => finish(true), idle);
+})"""
+
+# returns the page height and whether the bottom of the page is reached
+SCROLL_STATE_SCRIPT = """() => {
+    let height = document.documentElement.scrollHeight;
+    return [height, window.scrollY + window.innerHeight >= height - 1];
+}"""
+
+
+class NetworkIdleTracker:
+    """
+    Counts in-flight requests of the page, so it's possible to wait until the network is quiet for N ms.
+    Must be attached before navigation.
+    """
+
+    def __init__(self, page: Page):
+        self.inflight = 0
+        self.last_activity = time.monotonic()
+        self._changed = asyncio.Event()
+        page.on('request', self._on_request)
+        page.on('requestfinished', self._on_request_done)
+        page.on('requestfailed', self._on_request_done)
+
+    async def wait(self, idle: float, deadline: float) -> bool:
+        # idle is in seconds, deadline is a time.monotonic() value
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            quiet = now - self.last_activity
+            if self.inflight == 0 and quiet >= idle:
+                return True
+            delay = idle - quiet if self.inflight == 0 else idle
+            self._changed.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._changed.wait(), min(delay, deadline - now))
+
+    def _on_request(self, _: Request) -> None:
+        self.inflight += 1
+        self._touch()
+
+    def _on_request_done(self, _: Request) -> None:
+        self.inflight = max(self.inflight - 1, 0)
+        self._touch()
+
+    def _touch(self) -> None:
+        self.last_activity = time.monotonic()
+        self._changed.set()
+
+
+async def wait_for_readiness(
+    page: Page,
+    selector: str | None,
+    dom_idle: int,
+    network_idle: int,
+    timeout: int,
+    tracker: NetworkIdleTracker | None = None,
+) -> None:
+    """
+    Wait until the page is ready: the selector is attached, the network is quiet and the DOM stops changing.
+    All waits share one overall cap (timeout, in ms); when the cap is reached, processing goes on as is.
+    """
+    logger = get_logger()
+    deadline = time.monotonic() + timeout / 1000
+
+    def remaining() -> float:
+        return max(deadline - time.monotonic(), 0)
+
+    # (Playwright treats a zero timeout as no timeout, so every wait is skipped when the cap is reached)
+    if selector and remaining():
+        try:
+            await page.wait_for_selector(selector, state='attached', timeout=remaining() * 1000)
+        except PlaywrightTimeoutError:
+            logger.debug(f'Selector {selector!r} not found within the wait timeout: {page.url}')
+
+    if network_idle and tracker:
+        if not await tracker.wait(network_idle / 1000, deadline):
+            logger.debug(f'Network was not idle within the wait timeout: {page.url}')
+
+    if dom_idle and remaining():
+        try:
+            idle = await page.evaluate(DOM_IDLE_SCRIPT, [dom_idle, remaining() * 1000])
+        except PlaywrightError as exc:
+            # e.g. the page navigated away while waiting
+            logger.debug(f'Waiting for DOM idle failed: {exc}')
+        else:
+            if not idle:
+                logger.debug(f'DOM was not idle within the wait timeout: {page.url}')
+
+
+async def scroll_down(page: Page, distance: int, sleep: int, n: int = 10) -> None:
+    """
+    Scroll the page down by `distance` px within `sleep` ms, in n steps.
+    Stops early once the page height stops growing and its bottom is reached.
+    """
+    height = None
+    for _ in range(n):
+        # scroll down the page by 1/n of the given distance
+        await page.mouse.wheel(0, distance / n)
+        # sleep for 1/n of the given sleep value
+        await page.wait_for_timeout(sleep / n)
+
+        prev_height = height
+        height, bottom = await page.evaluate(SCROLL_STATE_SCRIPT)
+        if bottom and height == prev_height:
+            break
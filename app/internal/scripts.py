@@ -0,0 +1,77 @@
+import os
+import time
+from pathlib import Path
+
+from settings import SCRIPTS_DIR, USER_SCRIPTS_DIR
+
+
+CHECK_INTERVAL = 1.0  # seconds between mtime checks of the same file
+
+
+class Script:
+    __slots__ = ('content', 'mtime', 'checked_at')
+
+    def __init__(self, content: str, mtime: int, checked_at: float):
+        self.content = content
+        self.mtime = mtime
+        self.checked_at = checked_at
+
+
+class ScriptRegistry:
+    """
+    In-memory copy of JavaScript files. A file is read again only when its mtime changes,
+    and the mtime of the same file is checked at most once per CHECK_INTERVAL.
+    """
+
+    def __init__(self, *dirs: Path):
+        self.dirs = dirs
+        self._scripts: dict[Path, Script] = {}
+
+    def load(self) -> None:
+        # preload all scripts, so the first requests don't read them from disk
+        for d in self.dirs:
+            for path in Path(d).rglob('*.js'):
+                self._read(path)
+
+    def get(self, path: Path) -> str:
+        path = Path(path)
+        script = self._scripts.get(path)
+        now = time.monotonic()
+        if script is None:
+            return self._read(path).content
+
+        if now - script.checked_at >= CHECK_INTERVAL:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                del self._scripts[path]
+                raise
+            if mtime != script.mtime:
+                return self._read(path).content
+            script.checked_at = now
+        return script.content
+
+    def exists(self, path: Path) -> bool:
+        try:
+            self.get(path)
+        except (FileNotFoundError, IsADirectoryError):
+            return False
+        return True
+
+    def _read(self, path: Path) -> Script:
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, encoding='utf-8') as f:
+            script = Script(f.read(), mtime, time.monotonic())
+        self._scripts[path] = script
+        return script
+
+
+registry = ScriptRegistry(SCRIPTS_DIR, USER_SCRIPTS_DIR)
+
+
+def get_script(path: Path) -> str:
+    return registry.get(path)
+
+
+def script_exists(path: Path) -> bool:
+    return registry.exists(path)
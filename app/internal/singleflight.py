@@ -0,0 +1,151 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+from internal import cache
+from internal.logger import get_logger
+from settings import USER_DATA_DIR
+
+
+LOCK_POLL_INTERVAL = 0.05  # seconds between attempts to take a lock held by another worker
+REVALIDATE_CONCURRENCY = 1  # background re-renders of stale results at a time, per worker
+REVALIDATE_POLL_INTERVAL = 0.1  # seconds between checks for a free browser slot
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests (the same result ID) that are in flight at the same time.
+
+    Within a worker, the first request renders the page and the others wait for its result.
+    Across workers, the first one takes a lock on the result ID: a worker that finds the ID locked waits
+    until the lock is released, then serves the result the other worker has just saved in the cache.
+    The lock is a one-byte POSIX record lock at an offset derived from the ID, all in a single lock file.
+
+    Stale results are re-rendered in the background with a low priority: a few at a time,
+    and only when there is a free browser slot, so the requests go first.
+    """
+
+    def __init__(self, lock_path: Path):
+        self.lock_path = lock_path
+        self.leaders = 0  # requests that have rendered the page
+        self.coalesced = 0  # requests that have waited for a render in the same worker
+        self.shared = 0  # requests served with the result rendered by another worker
+        self.revalidations = 0  # background re-renders of stale results
+        self._flights: dict[str, asyncio.Task] = {}
+        self._background: dict[str, asyncio.Task] = {}
+        self._low_priority = asyncio.Semaphore(REVALIDATE_CONCURRENCY)
+        self._fd: int | None = None
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._flights.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # the render runs in its own task, it's not cancelled when the first client goes away
+            task = asyncio.create_task(self._lead(key, func))
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def revalidate(self, key: str, func: Callable[[], Awaitable[Any]], slots: asyncio.Semaphore) -> None:
+        # re-renders a stale result in the background, the request doesn't wait for it
+        if key in self._flights or key in self._background:
+            return
+        task = asyncio.create_task(self._revalidate(key, func, slots))
+        self._background[key] = task
+        task.add_done_callback(lambda _: self._background.pop(key, None))
+
+    def stats(self) -> dict:
+        return {
+            'inFlight': len(self._flights),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'shared': self.shared,
+            'revalidating': len(self._background),
+            'revalidations': self.revalidations,
+        }
+
+    async def close(self) -> None:
+        if self._background:
+            for task in self._background.values():
+                task.cancel()
+            await asyncio.gather(*self._background.values(), return_exceptions=True)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    async def _lead(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.time()
+        waited = await self._lock(key)
+        try:
+            if waited:
+                # only a result the other worker has just rendered; an older one is there when its render failed
+                # (or the write-behind hasn't finished), and it may be expired for this request
+                cached = await cache.load_cached(key)
+                if cached and cached.date >= started:
+                    self.shared += 1
+                    return json.loads(cached.payload)
+            self.leaders += 1
+            return await func()
+        finally:
+            self._unlock(key)
+
+    async def _revalidate(self, key: str, func: Callable[[], Awaitable[Any]], slots: asyncio.Semaphore) -> None:
+        async with self._low_priority:
+            # wait for a free browser slot, the requests take the slots first
+            while slots.locked():
+                await asyncio.sleep(REVALIDATE_POLL_INTERVAL)
+            try:
+                await self.do(key, func)
+            except Exception as exc:
+                get_logger().warning(f'Result {key} could not be revalidated: {exc}')
+                return
+            self.revalidations += 1
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, even if all the requests waiting for it have gone away
+
+    async def _lock(self, key: str) -> bool:
+        # returns True if the lock was held by another worker
+        waited = False
+        while True:
+            try:
+                fcntl.lockf(self._lock_fd(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, _offset(key))
+                return waited
+            except (BlockingIOError, PermissionError):
+                waited = True
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+            except OSError as exc:
+                # the lock is an optimization, the request goes on without it
+                get_logger().warning(f'Result {key} could not be locked: {exc}')
+                return False
+
+    def _unlock(self, key: str) -> None:
+        if self._fd is None:
+            return
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _offset(key))
+        except OSError as exc:
+            get_logger().warning(f'Result {key} could not be unlocked: {exc}')
+
+    def _lock_fd(self) -> int:
+        # record locks are released when any descriptor of the file is closed, so it's opened once
+        if self._fd is None:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+
+def _offset(key: str) -> int:
+    return int(key[:15], 16)  # 60 bits of the result ID, fits the file offset
+
+
+flights = SingleFlight(USER_DATA_DIR / '.singleflight.lock')
@@ -0,0 +1,535 @@
+import abc
+import contextlib
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from pathlib import Path
+
+from settings import USER_DATA_DIR, SCREENSHOT_TYPE, CacheBackend, ScreenshotType
+
+
+Stamp = tuple[int, int]  # changes on every rewrite of a result, the second item is its mtime in ns
+
+STALE_TEMP_AGE = 3600  # temp files (and unreferenced blobs) older than this are left over
+SCAN_BATCH = 1000  # entries per batch of Storage.scan
+WRITE_BATCH = 256  # writes committed in one transaction, at most
+
+# large parts of a result are stored apart from it, as blobs by name
+CONTENT_BLOB = 'content'  # full HTML contents of the page
+SCREENSHOT_BLOB = 'screenshot'
+BLOBS = (CONTENT_BLOB, SCREENSHOT_BLOB)
+BLOB_DIR = 'blobs'  # of FileStorage, next to the shards
+SHARDS = tuple(f'{i:02x}' for i in range(256))  # results by the first two characters of the key (hex)
+
+
+class EntryInfo:
+    __slots__ = ('key', 'size', 'atime', 'mtime')
+
+    def __init__(self, key: str, size: int, atime: float, mtime: float):
+        self.key = key
+        self.size = size  # the result with its screenshot, in bytes
+        self.atime = atime  # last use of the result, unix time
+        self.mtime = mtime  # when the result was saved, unix time
+
+
+class Storage(abc.ABC):
+    """
+    Storage backend of the result cache: stored results (see cache.encode_payload) and their blobs by key.
+    Blobs are content-addressed and reference-counted: identical blobs of different results are stored once.
+    The methods do blocking I/O, they are called in a thread.
+    """
+
+    @abc.abstractmethod
+    def put(self, key: str, record: bytes, blobs: dict[str, bytes], mtime: int | None = None) -> Stamp:
+        # saves the result with its blobs (by name) atomically, the blobs of the previous version are released;
+        # mtime (in ns) is set when results are imported
+        raise NotImplementedError
+
+    def put_many(self, items: list[tuple[str, bytes, dict[str, bytes], int | None]]) -> None:
+        for item in items:
+            self.put(*item)
+
+    @abc.abstractmethod
+    def get(self, key: str, touch: bool = False) -> tuple[bytes, Stamp] | None:
+        # touch marks the result as used, for the LRU eviction
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stamp(self, key: str, touch: bool = False) -> Stamp | None:
+        # a cheap check whether the result has been rewritten or removed
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def blob(self, key: str, name: str) -> Path | bytes | None:
+        # a file can be sent as is, it's not read into memory
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def scan(self, now: float) -> Iterator[list[EntryInfo]]:
+        # all the results in batches, each batch is read by a separate call of next()
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def scan_shard(self, shard: str, now: float) -> list[EntryInfo]:
+        # the results whose keys start with the shard (see SHARDS), for a sweep in small steps
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove(self, keys: list[str]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class FileStorage(Storage):
+    """
+    One file per result, with its blobs in sibling files, in 256 subdirectories (shards) by the first
+    two characters of the key. The recency of a result is the atime of its file, set explicitly.
+
+    Blobs are stored once in the blob store by their SHA-256, the sibling files are hard links to them,
+    so the link count of a blob is its reference count. Blobs no result links to are removed by the scan.
+    """
+
+    def __init__(self, root: Path, screenshot_type: ScreenshotType = ScreenshotType.JPEG):
+        self.root = root
+        self.screenshot_type = screenshot_type
+
+    def put(self, key: str, record: bytes, blobs: dict[str, bytes], mtime: int | None = None) -> Stamp:
+        # blobs go first, so the result never refers to a missing blob
+        written = set()
+        for name, data in blobs.items():
+            path = self.blob_location(key, name)
+            self._link_blob(path, data)
+            written.add(path)
+        path = self.json_location(key)
+        write_atomic(path, record, mtime)
+        st = os.stat(path)
+        # the blobs of the previous version that this one doesn't have
+        self._unlink([p for p in self._blob_paths(key) if p not in written])
+        return st.st_ino, st.st_mtime_ns
+
+    def get(self, key: str, touch: bool = False) -> tuple[bytes, Stamp] | None:
+        try:
+            with open(self.json_location(key), mode='rb') as f:
+                record = f.read()
+                st = os.fstat(f.fileno())
+                if touch:
+                    # set explicitly, it doesn't depend on the atime mount options; mtime is the time it was saved
+                    os.utime(f.fileno(), ns=(time.time_ns(), st.st_mtime_ns))
+        except FileNotFoundError:
+            return None
+        return record, (st.st_ino, st.st_mtime_ns)
+
+    def stamp(self, key: str, touch: bool = False) -> Stamp | None:
+        path = self.json_location(key)
+        try:
+            st = os.stat(path)
+            if touch:
+                os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def blob(self, key: str, name: str) -> Path | None:
+        path = self.blob_location(key, name)
+        return path if path.exists() else None
+
+    def scan(self, now: float) -> Iterator[list[EntryInfo]]:
+        # one shard per batch, then the blob store is cleaned up
+        for shard in _subdirs(self.root):
+            if shard.name != BLOB_DIR:
+                yield self._scan_shard(shard, now)
+        for shard in _subdirs(self.root / BLOB_DIR):
+            self._collect_blobs(shard, now)
+            yield []
+
+    def scan_shard(self, shard: str, now: float) -> list[EntryInfo]:
+        # the blobs with the same first characters of the digest are cleaned up along with it
+        entries = self._scan_shard(self.root / shard, now) if (self.root / shard).is_dir() else []
+        if (self.root / BLOB_DIR / shard).is_dir():
+            self._collect_blobs(self.root / BLOB_DIR / shard, now)
+        return entries
+
+    def remove(self, keys: list[str]) -> None:
+        for key in keys:
+            # the result file goes first, so a result never refers to a missing blob
+            self._unlink([self.json_location(key), *self._blob_paths(key)])
+
+    def json_location(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def blob_location(self, key: str, name: str) -> Path:
+        suffix = self.screenshot_type.value if name == SCREENSHOT_BLOB else 'html'
+        return self.root / key[:2] / f'{key}.{suffix}'
+
+    def _blob_paths(self, key: str) -> list[Path]:
+        # the screenshots of all types, the type may have been changed since the result was saved
+        return [self.root / key[:2] / f'{key}.{suffix}' for suffix in ('html', *(t.value for t in ScreenshotType))]
+
+    def _link_blob(self, path: Path, data: bytes) -> None:
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.root / BLOB_DIR / digest[:2] / digest
+        tmp = temp_location(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.unlink(missing_ok=True)
+        try:
+            try:
+                os.link(blob, tmp)
+            except FileNotFoundError:
+                write_atomic(blob, data, exclusive=True)
+                os.link(blob, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            # e.g. a file system without hard links, the blob is stored with the result
+            tmp.unlink(missing_ok=True)
+            write_atomic(path, data)
+
+    @staticmethod
+    def _unlink(paths: list[Path]) -> None:
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+
+    @staticmethod
+    def _scan_shard(shard: Path, now: float) -> list[EntryInfo]:
+        entries: dict[str, EntryInfo] = {}
+        with os.scandir(shard) as it:
+            for e in it:
+                try:
+                    st = e.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if e.name.startswith('.'):
+                    # a temp file of an unfinished write
+                    if now - st.st_mtime > STALE_TEMP_AGE:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.unlink(e.path)
+                    continue
+
+                key = e.name.split('.', 1)[0]
+                entry = entries.get(key)
+                if entry is None:
+                    entry = entries[key] = EntryInfo(key, 0, 0.0, 0.0)
+                entry.size += st.st_size
+                if e.name == key:
+                    # the result file
+                    entry.atime = max(st.st_atime, st.st_mtime)
+                    entry.mtime = st.st_mtime
+                else:
+                    # a blob, without the result file it's removed along with the oldest entries
+                    entry.mtime = entry.mtime or st.st_mtime
+                    entry.atime = entry.atime or st.st_mtime
+        return list(entries.values())
+
+    @staticmethod
+    def _collect_blobs(shard: Path, now: float) -> None:
+        # a blob with a single link isn't referenced; a new one is kept for a while, it's being linked
+        with os.scandir(shard) as it:
+            for e in it:
+                try:
+                    st = e.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if now - st.st_mtime > STALE_TEMP_AGE and (st.st_nlink == 1 or e.name.startswith('.')):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(e.path)
+
+
+SCHEMA = """
+PRAGMA auto_vacuum = INCREMENTAL;
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    atime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    record BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    refs INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_blobs (
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (key, name)
+);
+"""
+
+
+class SQLiteStorage(Storage):
+    """
+    All results and blobs in a single SQLite database in WAL mode, so readers don't wait for the writer.
+    Blobs are in a separate table with their reference count, they are not read along with the results.
+
+    Each thread reads with its own connection. Writes go through a single writer thread, which commits
+    all the writes queued by then in one transaction (group commit); a write returns once it's committed.
+    With several workers, each one has its own writer, SQLite serializes them.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: threading.Thread | None = None
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+
+    def put(self, key: str, record: bytes, blobs: dict[str, bytes], mtime: int | None = None) -> Stamp:
+        mtime = mtime or time.time_ns()
+        refs = _digests(blobs)  # hashed in the calling thread, not in the writer
+
+        def write(conn: sqlite3.Connection) -> None:
+            self._put(conn, key, record, refs, mtime)
+
+        self._write(write)
+        return len(record), mtime
+
+    def put_many(self, items: list[tuple[str, bytes, dict[str, bytes], int | None]]) -> None:
+        items = [(key, record, _digests(blobs), mtime or time.time_ns()) for key, record, blobs, mtime in items]
+
+        def write(conn: sqlite3.Connection) -> None:
+            for item in items:
+                self._put(conn, *item)
+
+        self._write(write)
+
+    def get(self, key: str, touch: bool = False) -> tuple[bytes, Stamp] | None:
+        row = self._connection().execute('SELECT record, mtime FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if touch:
+            self._touch(key)
+        record, mtime = row
+        return record, (len(record), mtime)
+
+    def stamp(self, key: str, touch: bool = False) -> Stamp | None:
+        sql = 'SELECT length(record), mtime FROM results WHERE key = ?'
+        row = self._connection().execute(sql, (key,)).fetchone()
+        if row is None:
+            return None
+        if touch:
+            self._touch(key)
+        return row[0], row[1]
+
+    def blob(self, key: str, name: str) -> bytes | None:
+        sql = 'SELECT data FROM result_blobs JOIN blobs USING (digest) WHERE key = ? AND name = ?'
+        row = self._connection().execute(sql, (key, name)).fetchone()
+        return row[0] if row else None
+
+    def scan(self, now: float) -> Iterator[list[EntryInfo]]:
+        # the batches may be read in different threads, the scan has its own connection
+        sql = 'SELECT rowid, key, size, atime, mtime FROM results WHERE rowid > ? ORDER BY rowid LIMIT ?'
+        last = 0
+        with contextlib.closing(self._connect()) as conn:
+            while True:
+                rows = conn.execute(sql, (last, SCAN_BATCH)).fetchall()
+                if not rows:
+                    return
+                last = rows[-1][0]
+                yield [EntryInfo(key, size, atime / 1e9, mtime / 1e9) for _, key, size, atime, mtime in rows]
+
+    def scan_shard(self, shard: str, now: float) -> list[EntryInfo]:
+        # a range of the primary key, the keys are hex
+        sql = 'SELECT key, size, atime, mtime FROM results WHERE key >= ? AND key < ?'
+        rows = self._connection().execute(sql, (shard, shard + '~')).fetchall()
+        return [EntryInfo(key, size, atime / 1e9, mtime / 1e9) for key, size, atime, mtime in rows]
+
+    def remove(self, keys: list[str]) -> None:
+        def write(conn: sqlite3.Connection) -> None:
+            for key in keys:
+                self._release(conn, key)
+            conn.executemany('DELETE FROM results WHERE key = ?', [(key,) for key in keys])
+
+        self._write(write)
+        # give the free pages back to the file system
+        self._write(lambda conn: conn.execute('PRAGMA incremental_vacuum'), transaction=False)
+
+    def close(self) -> None:
+        # the queued writes are committed first; the storage can still be used, the connections are reopened
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._queue.put(None)
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        if writer is not None:
+            writer.join()
+        for conn in connections:
+            conn.close()
+
+    def _put(self, conn: sqlite3.Connection, key: str, record: bytes, refs: list[tuple], mtime: int) -> None:
+        self._release(conn, key)
+        size = len(record) + sum(len(data) for _, _, data in refs)
+        conn.execute(
+            'INSERT OR REPLACE INTO results (key, mtime, atime, size, record) VALUES (?, ?, ?, ?, ?)',
+            (key, mtime, mtime, size, record),
+        )
+        for name, digest, data in refs:
+            conn.execute(
+                'INSERT INTO blobs (digest, refs, data) VALUES (?, 1, ?) '
+                'ON CONFLICT (digest) DO UPDATE SET refs = refs + 1',
+                (digest, data),
+            )
+            conn.execute('INSERT INTO result_blobs (key, name, digest) VALUES (?, ?, ?)', (key, name, digest))
+
+    @staticmethod
+    def _release(conn: sqlite3.Connection, key: str) -> None:
+        # the blobs of the result are dereferenced, the ones no longer referenced are removed
+        digests = [(d,) for (d,) in conn.execute('SELECT digest FROM result_blobs WHERE key = ?', (key,))]
+        if not digests:
+            return
+        conn.execute('DELETE FROM result_blobs WHERE key = ?', (key,))
+        conn.executemany('UPDATE blobs SET refs = refs - 1 WHERE digest = ?', digests)
+        conn.executemany('DELETE FROM blobs WHERE digest = ? AND refs <= 0', digests)
+
+    def _touch(self, key: str) -> None:
+        # the last use isn't worth waiting for, it's committed with the next batch
+        now = time.time_ns()
+        self._write(lambda conn: conn.execute('UPDATE results SET atime = ? WHERE key = ?', (now, key)), wait=False)
+
+    def _write(self, func: Callable[[sqlite3.Connection], object], wait: bool = True, transaction: bool = True):
+        future = Future() if wait else None
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='sqlite-writer', daemon=True)
+                self._writer.start()
+            self._queue.put((func, future, transaction))
+        if future is not None:
+            future.result()
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stop = False
+        while not stop:
+            op = self._queue.get()
+            if op is None:
+                break
+            batch = [op]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is None:
+                    stop = True
+                    break
+                batch.append(op)
+
+            writes = [op for op in batch if op[2]]
+            try:
+                with transaction(conn):
+                    for func, _, _ in writes:
+                        func(conn)
+            except Exception:
+                # one bad write must not fail the others, they are retried one by one
+                for op in writes:
+                    self._run(conn, [op])
+            else:
+                for _, future, _ in writes:
+                    if future is not None:
+                        future.set_result(None)
+
+            for op in batch:
+                if not op[2]:
+                    self._run(conn, [op])
+        conn.close()
+
+    @staticmethod
+    def _run(conn: sqlite3.Connection, ops: list) -> None:
+        for func, future, in_transaction in ops:
+            try:
+                if in_transaction:
+                    with transaction(conn):
+                        func(conn)
+                else:
+                    func(conn)
+            except Exception as exc:
+                if future is not None:
+                    future.set_exception(exc)
+            else:
+                if future is not None:
+                    future.set_result(None)
+
+    def _connection(self) -> sqlite3.Connection:
+        # a connection per thread, for reading
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')  # in WAL mode, a commit survives a crash of the application
+        return conn
+
+
+@contextlib.contextmanager
+def transaction(conn: sqlite3.Connection):
+    # the connections are in autocommit mode, transactions are explicit
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def open_storage(backend: CacheBackend) -> Storage:
+    if backend == CacheBackend.SQLITE:
+        return SQLiteStorage(USER_DATA_DIR / '_res.sqlite3')
+    return FileStorage(USER_DATA_DIR / '_res', SCREENSHOT_TYPE)
+
+
+def _digests(blobs: dict[str, bytes]) -> list[tuple[str, str, bytes]]:
+    return [(name, hashlib.sha256(data).hexdigest(), data) for name, data in blobs.items()]
+
+
+def _subdirs(path: Path) -> list[Path]:
+    if not path.is_dir():
+        return []
+    with os.scandir(path) as it:
+        return [Path(e.path) for e in it if e.is_dir(follow_symlinks=False)]
+
+
+def write_atomic(path: Path, data: bytes, mtime: int | None = None, exclusive: bool = False) -> None:
+    # readers see either the old file or the new one, never a partially written file;
+    # an exclusive write keeps the existing file, e.g. a blob that another writer has just stored
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = temp_location(path)
+    try:
+        with open(tmp, mode='wb') as f:
+            f.write(data)
+            f.flush()
+            if mtime:
+                os.utime(f.fileno(), ns=(mtime, mtime))
+            os.fsync(f.fileno())
+        if exclusive:
+            with contextlib.suppress(FileExistsError):
+                os.link(tmp, path)
+            tmp.unlink()
+        else:
+            os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def temp_location(path: Path) -> Path:
+    # unique per writer: the writes run in threads, and several of them may store the same blob at once
+    return path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
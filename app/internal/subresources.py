@@ -0,0 +1,318 @@
+import asyncio
+import email.utils
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from internal.logger import get_logger
+from settings import USER_DATA_DIR, SUBRESOURCE_CACHE_SIZE_MB, WORKERS
+
+
+CACHEABLE_TYPES = frozenset(('stylesheet', 'script', 'font', 'image'))
+
+# response headers that aren't replayed: the body is stored decoded, cookies must not leak between contexts
+SKIPPED_HEADERS = frozenset((
+    'content-encoding',
+    'content-length',
+    'transfer-encoding',
+    'connection',
+    'keep-alive',
+    'set-cookie',
+    'date',
+    'age',
+))
+
+
+class Entry:
+    __slots__ = ('digest', 'size', 'expires', 'status', 'headers')
+
+    def __init__(self, digest: str, size: int, expires: float, status: int, headers: dict[str, str]):
+        self.digest = digest  # sha256 of the body, the name of the blob file
+        self.size = size
+        self.expires = expires  # unix time
+        self.status = status
+        self.headers = headers
+
+
+class SubresourceCache:
+    """
+    Shared on-disk cache of static subresources (stylesheets, scripts, fonts, images) for incognito contexts.
+
+    Bodies are content-addressed blobs, so the same file served from several URLs is stored once.
+    Only responses with explicit freshness (Cache-Control max-age or Expires) are stored, and only while fresh.
+    The total size of the blobs is capped, the least recently used entries are evicted first.
+
+    Every worker process keeps its index in memory, so each one owns a slot: a subdirectory of the root
+    that no other worker reads or writes, and its share of the size cap.
+    """
+
+    def __init__(self, root: Path, max_size: int, slots: int = 1):
+        self.root = root
+        self.dir = root  # the directory of the slot, see load()
+        self.max_size = max_size  # in bytes per slot, 0 disables the cache
+        self.slots = slots
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.size = 0  # total size of the referenced blobs
+        self._index: OrderedDict[str, Entry] = OrderedDict()  # url key -> entry, in LRU order
+        self._refs: dict[str, int] = {}  # blob digest -> number of entries
+        self._lock_fd: int | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def load(self) -> None:
+        # claim a free slot, then restore its index from the metadata files, the least recently used first
+        if not self.enabled:
+            return
+        slot = self._claim_slot()
+        if slot is None:
+            get_logger().warning(f'Subresource cache: all {self.slots} slots are taken, the cache is disabled')
+            self.max_size = 0
+            return
+        self.dir = self.root / str(slot)
+
+        metas = []
+        for path in (self.dir / 'meta').glob('*/*.json'):
+            try:
+                metas.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+
+        now = time.time()
+        for _, path in sorted(metas):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                entry = Entry(meta['digest'], meta['size'], meta['expires'], meta['status'], meta['headers'])
+            except (OSError, ValueError, KeyError):
+                continue
+            if entry.expires <= now or not self._blob_path(entry.digest).exists():
+                self._unlink(path)
+                continue
+            self._add(path.stem, entry)
+        self._evict()
+        get_logger().info(f'Subresource cache: slot {slot}, {len(self._index)} entries, {self.size // 2**20} MiB')
+
+    def close(self) -> None:
+        # the slot is free for the next worker
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def accepts(self, method: str, resource_type: str, headers: dict[str, str]) -> bool:
+        # partial and authenticated requests always go to the network
+        return (
+            self.enabled
+            and method == 'GET'
+            and resource_type in CACHEABLE_TYPES
+            and 'range' not in headers
+            and 'authorization' not in headers
+        )
+
+    async def get(self, url: str) -> tuple[Entry, bytes] | None:
+        key = url_key(url)
+        entry = self._index.get(key)
+        if entry is not None and entry.expires <= time.time():
+            self._remove(key)
+            entry = None
+
+        body = None
+        if entry is not None:
+            try:
+                body = await asyncio.to_thread(_read, self._blob_path(entry.digest))
+            except OSError as exc:
+                # the resource is loaded from the network, the cache must not stall the page
+                get_logger().warning(f'Subresource cache read failed: {exc}')
+            if body is None and self._index.get(key) is entry:
+                # removed from the disk by someone else
+                self._remove(key)
+
+        if body is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if key in self._index:
+            self._index.move_to_end(key)
+        return entry, body
+
+    async def put(self, url: str, status: int, headers: dict[str, str], body: bytes) -> bool:
+        headers = {k.lower(): v for k, v in headers.items()}
+        expires = freshness_deadline(status, headers)
+        if expires is None or len(body) > self.max_size:
+            return False
+
+        key = url_key(url)
+        headers = replayable_headers(headers)
+        meta = {'url': url, 'size': len(body), 'expires': expires, 'status': status, 'headers': headers}
+        # hashing and writing happen off the event loop
+        try:
+            digest = await asyncio.to_thread(self._store, key, meta, body)
+        except OSError as exc:
+            get_logger().warning(f'Subresource cache write failed: {exc}')
+            return False
+
+        # the new entry is added first, so a blob shared with the replaced entry is kept
+        old = self._index.pop(key, None)
+        self._add(key, Entry(digest, len(body), expires, status, headers))
+        if old:
+            self._release(old)
+        self.stores += 1
+        self._evict()
+        return True
+
+    def _store(self, key: str, meta: dict, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        blob = self._blob_path(digest)
+        if not blob.exists():
+            _write_atomic(blob, body)
+        _write_atomic(self._meta_path(key), json.dumps(meta | {'digest': digest}).encode())
+        return digest
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRatio': round(self.hits / total, 4) if total else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'entries': len(self._index),
+            'size': self.size,
+            'maxSize': self.max_size,
+        }
+
+    def _add(self, key: str, entry: Entry) -> None:
+        self._index[key] = entry
+        refs = self._refs.get(entry.digest, 0)
+        if refs == 0:
+            self.size += entry.size
+        self._refs[entry.digest] = refs + 1
+
+    def _remove(self, key: str) -> None:
+        self._release(self._index.pop(key))
+        self._unlink(self._meta_path(key))
+
+    def _release(self, entry: Entry) -> None:
+        # the blob is deleted when the last entry referencing it is gone
+        refs = self._refs[entry.digest] - 1
+        if refs:
+            self._refs[entry.digest] = refs
+        else:
+            del self._refs[entry.digest]
+            self.size -= entry.size
+            self._unlink(self._blob_path(entry.digest))
+
+    def _evict(self) -> None:
+        while self.size > self.max_size and self._index:
+            key = next(iter(self._index))
+            self._remove(key)
+            self.evictions += 1
+
+    def _claim_slot(self) -> int | None:
+        # the lock is held while the worker lives, a restarted worker takes over the slot of the exited one
+        self.root.mkdir(parents=True, exist_ok=True)
+        for slot in range(self.slots):
+            fd = os.open(self.root / f'{slot}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            self._lock_fd = fd
+            return slot
+        return None
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.dir / 'blobs' / digest[:2] / digest
+
+    def _meta_path(self, key: str) -> Path:
+        return self.dir / 'meta' / key[:2] / f'{key}.json'
+
+    @staticmethod
+    def _unlink(path: Path) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass  # removed already, or a file that can't be removed is left over
+
+
+def replayable_headers(headers: dict[str, str]) -> dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in SKIPPED_HEADERS}
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+def freshness_deadline(status: int, headers: dict[str, str]) -> float | None:
+    # unix time until which the response is fresh, or None if it mustn't be stored (headers are lowercase)
+    if status != 200 or 'set-cookie' in headers:
+        return None
+    vary = {x.strip().lower() for x in headers.get('vary', '').split(',') if x.strip()}
+    if vary - {'accept-encoding'}:
+        return None
+
+    now = time.time()
+    directives = {}
+    for part in headers.get('cache-control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if {'no-store', 'no-cache', 'private'} & set(directives):
+        return None
+
+    # this cache is shared between contexts, so s-maxage takes precedence
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                max_age = int(directives[name])
+            except ValueError:
+                return None
+            return now + max_age if max_age > 0 else None
+
+    if 'expires' in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers['expires']).timestamp()
+        except (TypeError, ValueError):
+            return None
+        if 'date' in headers:
+            # correct the clock skew between the origin server and this host
+            try:
+                expires += now - email.utils.parsedate_to_datetime(headers['date']).timestamp()
+            except (TypeError, ValueError):
+                pass
+        return expires if expires > now else None
+
+    return None
+
+
+def _read(path: Path) -> bytes | None:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    # a reader sees the file fully written or not at all; writer threads may store the same blob at once
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp, mode='wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# the cap is split between the worker processes
+cache = SubresourceCache(USER_DATA_DIR / '_subres', SUBRESOURCE_CACHE_SIZE_MB * 2**20 // WORKERS, slots=WORKERS)
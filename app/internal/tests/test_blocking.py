@@ -0,0 +1,96 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from internal.blocking import BlockRules, DomainTrie, install_blocking, parse_domain_list
+
+
+def test_domain_trie():
+    trie = DomainTrie(['example.com', 'ads.example.com', 'tracker.net.', 'Doubleclick.NET'])
+    assert len(trie) == 4
+    assert trie.match('example.com')
+    assert trie.match('a.b.example.com')
+    assert trie.match('doubleclick.net')
+    assert trie.match('tracker.net')
+    assert not trie.match('notexample.com')
+    assert not trie.match('com')
+    assert not trie.match('net')
+    # subdomains of a listed domain are redundant
+    assert sorted(trie) == ['doubleclick.net', 'example.com', 'tracker.net']
+
+
+def test_parse_domain_list():
+    lines = [
+        '# comment',
+        '',
+        'example.com',
+        '0.0.0.0 ads.example.org  # hosts file',
+        '127.0.0.1 localhost',
+        '||tracker.net^',
+        '! adblock comment',
+        'example.com/path',
+    ]
+    assert list(parse_domain_list(lines)) == ['example.com', 'ads.example.org', 'tracker.net']
+
+
+def test_block_rules():
+    rules = BlockRules(
+        resource_types=['document', 'script'],
+        url_patterns=['*.png', 'https://cdn.example.org/ads/*'],
+        domains=DomainTrie(['tracker.net']),
+    )
+    assert rules
+    assert rules.blocks('https://example.com/style.css', 'stylesheet')
+    assert rules.blocks('https://example.com/img.png', 'script')
+    assert rules.blocks('https://cdn.example.org/ads/banner.js', 'script')
+    assert rules.blocks('https://px.tracker.net/t.js', 'script')
+    assert not rules.blocks('https://example.com/app.js', 'script')
+    assert not rules.blocks('https://example.com/img.png?x=1', 'document')
+
+    assert not BlockRules()
+    assert not BlockRules(domains=DomainTrie())
+    # `?` is literal, Chromium would match it as any character
+    rules = BlockRules(url_patterns=['*.png', '*/ad?.js'])
+    assert rules.native_patterns() == ['*.png']
+    assert rules.blocks('https://example.com/ad?.js', 'script')
+    assert not rules.blocks('https://example.com/ads.js', 'script')
+
+
+def make_page() -> MagicMock:
+    page = MagicMock()
+    page.route = AsyncMock()
+    page.context.route = AsyncMock()
+    page.context.new_cdp_session = AsyncMock()
+    return page
+
+
+@pytest.mark.asyncio
+async def test_install_blocking():
+    # chromium: URL patterns also go to the browser, the route handler blocks the requests of other targets
+    # (out-of-process iframes, workers)
+    page = make_page()
+    rules = BlockRules(url_patterns=['*.png'])
+    await install_blocking(page, rules, 'chromium', context_level=True)
+    session = page.context.new_cdp_session.return_value
+    session.send.assert_any_await('Network.setBlockedURLs', {'urls': ['*.png']})
+    page.route.assert_not_awaited()
+    page.context.route.assert_awaited_once()
+
+    # other browsers: the route handler is installed on the context
+    page = make_page()
+    await install_blocking(page, rules, 'firefox', context_level=True)
+    page.context.new_cdp_session.assert_not_awaited()
+    page.context.route.assert_awaited_once()
+
+    # the blocked domains are matched by the route handler, they are not sent to the browser
+    page = make_page()
+    await install_blocking(page, BlockRules(domains=DomainTrie(['tracker.net'])), 'chromium', context_level=True)
+    page.context.new_cdp_session.assert_not_awaited()
+    page.context.route.assert_awaited_once()
+
+    # resource types always need the route handler
+    page = make_page()
+    rules = BlockRules(resource_types=['document'])
+    await install_blocking(page, rules, 'chromium', context_level=False)
+    page.context.new_cdp_session.assert_not_awaited()
+    page.route.assert_awaited_once()
@@ -0,0 +1,64 @@
+import asyncio
+import errno
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from internal.browser import capture, subresource_cacher
+from internal.subresources import SubresourceCache
+
+
+@pytest.mark.asyncio
+async def test_capture_runs_reads_concurrently():
+    started = []
+
+    async def read(name, value):
+        started.append(name)
+        await asyncio.sleep(0.01)
+        # every read has started before the first one is finished
+        assert len(started) == 4
+        return value
+
+    page = MagicMock()
+    page.content = lambda: read('content', '<html></html>')
+    page.screenshot = lambda **kwargs: read('screenshot', b'png')
+    page.title = lambda: read('title', 'Title')
+    page.evaluate = lambda script: read('meta', {'og': {'title': 'Title'}})
+
+    res = await capture(page, content=True, screenshot=True, title=True)
+    assert res == ('<html></html>', {'og': {'title': 'Title'}}, b'png', 'Title')
+
+
+@pytest.mark.asyncio
+async def test_capture_skips_optional_reads():
+    page = MagicMock()
+    page.content = AsyncMock(return_value='<html></html>')
+    page.screenshot = AsyncMock()
+    page.title = AsyncMock()
+    page.evaluate = AsyncMock(return_value={})
+
+    assert await capture(page) == (None, {}, None, None)
+    page.content.assert_not_awaited()
+    page.screenshot.assert_not_awaited()
+    page.title.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_subresource_cacher_disk_error(tmp_path):
+    cache = SubresourceCache(tmp_path, max_size=10)
+    cache.load()
+    route = MagicMock()
+    route.request.method = 'GET'
+    route.request.resource_type = 'stylesheet'
+    route.request.headers = {}
+    route.request.url = 'https://example.com/a.css'
+    response = MagicMock(status=200, headers={'cache-control': 'max-age=100'})
+    response.body = AsyncMock(return_value=b'abcd')
+    route.fetch = AsyncMock(return_value=response)
+    route.fulfill = AsyncMock()
+
+    # the fetched body is served even if it can't be stored
+    with patch('internal.subresources._write_atomic', side_effect=OSError(errno.EACCES, 'Permission denied')):
+        await subresource_cacher(cache)(route)
+    route.fulfill.assert_awaited_once_with(status=200, headers={'cache-control': 'max-age=100'}, body=b'abcd')
+    cache.close()
@@ -0,0 +1,254 @@
+import datetime
+import json
+import os
+import time
+
+import pytest
+
+from internal import cache
+from internal.storage import BLOB_DIR, SCREENSHOT_BLOB, FileStorage, write_atomic
+from settings import CacheCompression
+
+
+@pytest.fixture
+def tmp_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, 'storage', FileStorage(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_dump_and_load(tmp_cache):
+    key = cache.make_key('http://example.com')
+    assert await cache.load_result(key) is None
+
+    await cache.dump_result({'title': 'Тест'}, key=key, screenshot=b'image')
+    assert await cache.load_result(key) == {'title': 'Тест'}
+    assert cache.storage.blob_location(key, SCREENSHOT_BLOB).read_bytes() == b'image'
+    # no temp files are left behind
+    assert sorted(p.name for p in cache.storage.json_location(key).parent.iterdir()) == [key, key + '.jpeg']
+
+
+@pytest.mark.asyncio
+async def test_write_behind(tmp_cache, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_WRITE_BEHIND', True)
+    key = cache.make_key('http://example.com')
+
+    await cache.dump_result({'title': 'title'}, key=key, screenshot=b'image')
+    # the result is served from memory until it's written
+    assert await cache.load_result(key) == {'title': 'title'}
+    assert await cache.load_screenshot(key) == b'image'
+
+    await cache.flush()
+    assert await cache.load_screenshot(key) == cache.storage.blob_location(key, SCREENSHOT_BLOB)
+    assert cache.storage.json_location(key).exists()
+    assert await cache.load_result(key) == {'title': 'title'}
+
+
+@pytest.mark.parametrize('compression', [CacheCompression.NONE, CacheCompression.GZIP])
+def test_encode_decode(compression):
+    data = {'title': 'Заголовок', 'content': '内容 ' * 100, 'length': 300}
+    raw = cache.encode_result(data, compression)
+    assert raw.startswith(cache.MAGIC)
+    # non-ASCII characters are not escaped in the stored result
+    assert len(raw) < len(json.dumps(data, ensure_ascii=True))
+    assert cache.decode_result(raw) == data
+
+
+@pytest.mark.asyncio
+async def test_load_legacy_json(tmp_cache):
+    key = cache.make_key('http://example.com')
+    path = cache.storage.json_location(key)
+    path.parent.mkdir(parents=True)
+    path.write_text(json.dumps({'title': 'Тест'}, ensure_ascii=True))
+    assert await cache.load_result(key) == {'title': 'Тест'}
+
+
+@pytest.mark.asyncio
+async def test_load_unsupported_version(tmp_cache):
+    key = cache.make_key('http://example.com')
+    path = cache.storage.json_location(key)
+    path.parent.mkdir(parents=True)
+    path.write_bytes(cache.HEADER.pack(cache.MAGIC, cache.FORMAT_VERSION + 1, 0, 0) + b'{}')
+    assert await cache.load_result(key) is None
+
+    # version 1 had no flags
+    path.write_bytes(cache.HEADER_V1.pack(cache.MAGIC, 1, 0) + b'{"title":"title"}')
+    assert await cache.load_result(key) == {'title': 'title'}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'raw',
+    [
+        cache.encode_result({'title': 'title'}, CacheCompression.GZIP)[:-5],  # truncated
+        cache.HEADER.pack(cache.MAGIC, cache.FORMAT_VERSION, 1, 0) + b'garbage',  # not gzip
+        cache.MAGIC,  # no header
+        cache.MAGIC + bytes([cache.FORMAT_VERSION, 0]),  # no flags
+        b'garbage',  # neither a record nor JSON
+    ],
+)
+async def test_load_corrupt(tmp_cache, raw):
+    # a corrupt result is a cache miss
+    key = cache.make_key('http://example.com')
+    write_atomic(cache.storage.json_location(key), raw)
+    assert await cache.load_result(key) is None
+
+
+@pytest.mark.asyncio
+async def test_full_content_blob(tmp_cache, monkeypatch):
+    monkeypatch.setattr(cache, 'memory', cache.MemoryTier(max_size=2**20))
+    html = '<html>Тест "quoted"</html>' * 100
+    key1, key2 = cache.make_key('http://example.com/1'), cache.make_key('http://example.com/2')
+
+    await cache.dump_result({'title': 'one', 'fullContent': html}, key=key1, screenshot=b'image')
+    await cache.dump_result({'title': 'two', 'fullContent': html}, key=key2, screenshot=b'image')
+    assert await cache.load_result(key1) == {'title': 'one', 'fullContent': html}
+    assert await cache.load_result(key2) == {'title': 'two', 'fullContent': html}
+
+    # the result itself and the copy in memory don't have the content
+    assert html.encode() not in cache.storage.json_location(key1).read_bytes()
+    assert cache.memory.size < len(html)
+    # identical blobs are stored once
+    assert len(list((tmp_cache / BLOB_DIR).glob('*/*'))) == 2
+
+    # a rewrite without the content doesn't refer to the old one
+    await cache.dump_result({'title': 'one'}, key=key1)
+    assert await cache.load_result(key1) == {'title': 'one'}
+    assert await cache.load_screenshot(key1) is None
+
+
+@pytest.mark.asyncio
+async def test_load_tracks_access(tmp_cache, monkeypatch):
+    monkeypatch.setattr(cache, 'TRACK_ACCESS', True)
+    key = cache.make_key('http://example.com')
+    await cache.dump_result({'title': 'title'}, key=key)
+    path = cache.storage.json_location(key)
+    os.utime(path, (1000, 2000))
+
+    assert await cache.load_result(key) == {'title': 'title'}
+    # atime is the last use, mtime is kept as the time the result was saved
+    st = path.stat()
+    assert st.st_atime > 2000
+    assert st.st_mtime == 2000
+
+
+def test_memory_tier_lru_by_bytes():
+    tier = cache.MemoryTier(max_size=160)
+    tier.put('big', cache.MemoryEntry(b'x' * 21, 0, (1, 1), ''))  # more than 1/8 of the budget, it's not kept
+    assert tier.get('big') is None
+    for i in range(8):
+        tier.put(str(i), cache.MemoryEntry(b'x' * 20, 0, (1, 1), ''))
+    assert tier.get('0') is not None
+
+    # the least recently used one is evicted
+    tier.put('8', cache.MemoryEntry(b'x' * 20, 0, (1, 1), ''))
+    assert tier.get('1') is None
+    assert tier.get('0') is not None
+    stats = tier.stats()
+    assert stats['size'] == 160
+    assert stats['entries'] == 8
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+
+
+@pytest.mark.asyncio
+async def test_memory_tier(tmp_cache, monkeypatch):
+    monkeypatch.setattr(cache, 'memory', cache.MemoryTier(max_size=2**20))
+    monkeypatch.setattr(cache, 'disk', cache.DiskTier())
+    monkeypatch.setattr(cache, 'VALIDATE_MEMORY', True)
+    key = cache.make_key('http://example.com')
+
+    # a saved result is served from memory, serialized
+    await cache.dump_result({'title': 'Тест'}, key=key)
+    assert await cache.load_payload(key) == '{"title":"Тест"}'.encode()
+    assert cache.memory.hits == 1
+    assert cache.disk.hits == 0
+
+    # the result is rewritten on the disk (e.g. by another worker)
+    write_atomic(cache.storage.json_location(key), cache.encode_result({'title': 'new'}))
+    assert await cache.load_result(key) == {'title': 'new'}
+    assert cache.memory.invalidations == 1
+    assert cache.disk.hits == 1
+    assert await cache.load_result(key) == {'title': 'new'}
+    assert cache.memory.hits == 2
+    assert cache.memory.misses == 1
+
+
+def test_freshness():
+    now = time.time()
+    assert cache.freshness(now - 10_000, max_age=None) == cache.Freshness.FRESH
+    assert cache.freshness(now - 10, max_age=60) == cache.Freshness.FRESH
+    assert cache.freshness(now - 100, max_age=60) == cache.Freshness.EXPIRED
+    assert cache.freshness(now - 100, max_age=60, stale_while_revalidate=60) == cache.Freshness.STALE
+    assert cache.freshness(now - 200, max_age=60, stale_while_revalidate=60) == cache.Freshness.EXPIRED
+
+
+@pytest.mark.asyncio
+async def test_load_cached(tmp_cache):
+    key = cache.make_key('http://example.com')
+    date = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+    data = {'title': 'title', 'date': date.isoformat(), 'resultUri': f'http://localhost:3000/result/{key}'}
+    await cache.dump_result(data, key=key)
+
+    # the date of the result is its mtime, it's known without decoding the result
+    cached = await cache.load_cached(key)
+    assert cached.date == date.timestamp()
+    assert cache.storage.json_location(key).stat().st_mtime_ns == cache.result_time(data)
+    assert json.loads(cached.payload) == data
+
+    # the hash is the same wherever the result comes from, and changes with the result
+    digest = cached.digest
+    cache.memory.discard(key)
+    assert (await cache.load_cached(key)).digest == digest
+    await cache.dump_result({**data, 'title': 'new'}, key=key)
+    assert (await cache.load_cached(key)).digest != digest
+
+
+def test_rebase_uris():
+    key = 'ab12'
+    data = {
+        'content': '<a href="http://old/result/ab12">',
+        'resultUri': 'http://old/result/ab12',
+        'screenshotUri': 'http://old/screenshot/ab12',
+    }
+    payload = cache.serialize(data)
+    assert cache.rebase_uris(payload, key, 'http://old') is payload
+    assert json.loads(cache.rebase_uris(payload, key, 'https://new:8080')) == {
+        'content': '<a href="http://old/result/ab12">',
+        'resultUri': 'https://new:8080/result/ab12',
+        'screenshotUri': 'https://new:8080/screenshot/ab12',
+    }
+    assert cache.rebase_uris(b'{"title":"title"}', key, 'http://new') == b'{"title":"title"}'
+
+
+def test_rebase_uris_hostile_host():
+    key = 'ab12'
+    payload = cache.serialize({'resultUri': 'http://old/result/ab12', 'screenshotUri': 'http://old/screenshot/ab12'})
+    # the host comes from the request, it can't add fields to the result
+    rebased = json.loads(cache.rebase_uris(payload, key, 'http://a","x":"1'))
+    assert rebased == {'resultUri': 'http://a","x":"1/result/ab12', 'screenshotUri': 'http://a","x":"1/screenshot/ab12'}
+
+
+def test_rebase_uris_legacy():
+    key = 'ab12'
+    data = {'resultUri': 'http://old/result/ab12', 'screenshotUri': 'http://old/screenshot/ab12'}
+    expected = {'resultUri': 'http://new/result/ab12', 'screenshotUri': 'http://new/screenshot/ab12'}
+    # saved with the json.dumps defaults, with spaces
+    assert json.loads(cache.rebase_uris(json.dumps(data).encode(), key, 'http://new')) == expected
+    # escaped slashes are rewritten by decoding the result
+    escaped = json.dumps(data).replace('/', '\\/').encode()
+    assert json.loads(cache.rebase_uris(escaped, key, 'http://new')) == expected
+
+
+@pytest.mark.asyncio
+async def test_open_cache(monkeypatch, tmp_path):
+    # the storage isn't opened on import, only once at the startup of a worker
+    monkeypatch.setattr(cache, 'storage', None)
+    monkeypatch.setattr(cache, 'open_storage', lambda _: FileStorage(tmp_path))
+    cache.open_cache()
+    storage = cache.storage
+    cache.open_cache()
+    assert cache.storage is storage
+    await cache.close_cache()
+    assert cache.storage is None
@@ -0,0 +1,117 @@
+import os
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from internal.cluster import BrowserCluster, BrowserProcess, driver_pids, process_tree_rss
+
+
+def make_process() -> BrowserProcess:
+    browser = MagicMock()
+    browser.is_connected.return_value = True
+    browser.contexts = []
+    pool = MagicMock()
+    pool.stats.return_value = {'hits': 0}
+    pool.close = AsyncMock()
+    process = BrowserProcess(MagicMock(), browser, pool)
+    process.playwright.stop = AsyncMock()
+    browser.close = AsyncMock()
+    return process
+
+
+def make_cluster(size: int) -> BrowserCluster:
+    cluster = BrowserCluster(size=size, browser_type='chromium', pool_size=0, pool_idle_timeout=60)
+    for instance in cluster.instances:
+        instance._activate(make_process())
+    return cluster
+
+
+@pytest.mark.asyncio
+async def test_lease_least_loaded_instance():
+    cluster = make_cluster(3)
+
+    async with cluster.lease() as first:
+        async with cluster.lease() as second:
+            async with cluster.lease() as third:
+                assert len({first, second, third}) == 3
+                assert [x['contextsInUse'] for x in cluster.stats()] == [1, 1, 1]
+
+    assert [x['contextsInUse'] for x in cluster.stats()] == [0, 0, 0]
+    assert [x['contextsServed'] for x in cluster.stats()] == [1, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_lease_skips_disconnected_instance():
+    cluster = make_cluster(2)
+    cluster.instances[0].browser.is_connected.return_value = False
+    assert not cluster.is_connected()
+
+    async with cluster.lease() as process:
+        assert process is cluster.instances[1].process
+    async with cluster.lease() as process:
+        assert process is cluster.instances[1].process
+
+
+@pytest.mark.asyncio
+async def test_recycle_drains_old_process():
+    cluster = make_cluster(1)
+    instance = cluster.instances[0]
+    old = instance.process
+    new = make_process()
+    assert await instance.recycle_reason(max_contexts=1, max_uptime=0, max_rss=0) is None
+
+    with patch('internal.cluster.BrowserProcess.launch', new=AsyncMock(return_value=new)):
+        async with cluster.lease() as process:
+            assert process is old
+            assert await instance.recycle_reason(max_contexts=1, max_uptime=0, max_rss=0) == '1 contexts served'
+            await instance.recycle()
+
+            # new work goes to the replacement, the old browser is still open for the in-flight context
+            async with cluster.lease() as replacement:
+                assert replacement is new
+            assert instance.retiring == {old}
+            old.browser.close.assert_not_awaited()
+
+        # the old browser is closed once its last context is released
+        await next(iter(instance._drain_tasks))
+        old.browser.close.assert_awaited_once()
+        assert instance.retiring == set()
+        assert instance.recycles == 1
+
+
+@pytest.mark.asyncio
+async def test_relaunch_after_recycle():
+    cluster = make_cluster(1)
+    instance = cluster.instances[0]
+    crashed = instance.process
+    crashed.browser.is_connected.return_value = False
+    instance._on_disconnected(crashed)
+
+    # the recycle replaces the crashed browser first, the supervisor has nothing to relaunch then
+    with patch('internal.cluster.BrowserProcess.launch', new=AsyncMock(side_effect=[make_process(), make_process()])):
+        await instance.recycle()
+        new = instance.process
+        await instance.relaunch()
+    assert instance.process is new
+    assert (instance.recycles, instance.restarts) == (1, 0)
+    await instance.close()
+
+
+@pytest.mark.asyncio
+async def test_recycle_reason_rss():
+    cluster = make_cluster(1)
+    instance = cluster.instances[0]
+    # the driver pid is unknown, the RSS isn't measured
+    assert await instance.recycle_reason(max_contexts=0, max_uptime=0, max_rss=1) is None
+    instance.process.driver_pid = os.getpid()
+    assert (await instance.recycle_reason(max_contexts=0, max_uptime=0, max_rss=1)).startswith('RSS')
+
+
+def test_process_tree_rss():
+    rss = process_tree_rss(os.getpid())
+    assert rss is not None and rss > 0
+
+
+def test_driver_pids():
+    # the current process is not a Playwright driver
+    assert os.getpid() not in driver_pids()
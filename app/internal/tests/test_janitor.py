@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+from internal.janitor import CacheJanitor, summarize
+from internal.storage import SHARDS, EntryInfo, FileStorage, SQLiteStorage
+
+
+def make_entry(root, key, size, atime, mtime, screenshot=0):
+    shard = root / key[:2]
+    shard.mkdir(parents=True, exist_ok=True)
+    (shard / key).write_bytes(b'x' * size)
+    os.utime(shard / key, (atime, mtime))
+    if screenshot:
+        (shard / (key + '.jpeg')).write_bytes(b'x' * screenshot)
+
+
+@pytest.mark.asyncio
+async def test_sweep_lru_and_age(tmp_path):
+    now = time.time()
+    make_entry(tmp_path, 'aa01', 100, atime=now - 10, mtime=now - 100, screenshot=50)
+    make_entry(tmp_path, 'aa02', 100, atime=now - 50, mtime=now - 100)
+    make_entry(tmp_path, 'bb03', 100, atime=now - 1, mtime=now - 100)
+    make_entry(tmp_path, 'bb04', 100, atime=now, mtime=now - 10_000)  # expired
+    # a leftover of a crashed write
+    stale = tmp_path / 'bb' / '.bb05.1.tmp'
+    stale.write_bytes(b'x')
+    os.utime(stale, (now - 7200, now - 7200))
+
+    janitor = CacheJanitor(
+        FileStorage(tmp_path),
+        tmp_path / '.janitor.lock',
+        max_size=300,
+        max_entries=0,
+        max_age=3600,
+        shards_per_sweep=len(SHARDS),
+    )
+    await janitor.sweep()
+    # the expired result is gone; the least recently used one was swept before the size limit was exceeded
+    assert sorted(p.name for p in tmp_path.glob('*/*')) == ['aa01', 'aa01.jpeg', 'aa02', 'bb03']
+    assert janitor.stats()['size'] == 350
+
+    # on the next pass it doesn't fit the size limit, the screenshot counts too
+    await janitor.sweep()
+    assert sorted(p.name for p in tmp_path.glob('*/*')) == ['aa01', 'aa01.jpeg', 'bb03']
+    stats = janitor.stats()
+    assert stats['size'] == 250
+    assert stats['entries'] == 2
+    assert stats['expired'] == 1
+    assert stats['evicted'] == 1
+
+    janitor.max_entries = 1
+    await janitor.sweep()
+    assert sorted(p.name for p in tmp_path.glob('*/*')) == ['bb03']
+    assert janitor.stats()['evicted'] == 2
+
+
+@pytest.mark.asyncio
+async def test_sweep_disabled(tmp_path):
+    make_entry(tmp_path, 'aa01', 100, atime=0, mtime=0)
+    janitor = CacheJanitor(FileStorage(tmp_path), tmp_path / '.janitor.lock', max_size=0, max_entries=0, max_age=0)
+    assert not janitor.enabled
+    await janitor.sweep()
+    assert (tmp_path / 'aa' / 'aa01').exists()
+
+
+@pytest.mark.asyncio
+async def test_sweep_in_steps(tmp_path):
+    storage = SQLiteStorage(tmp_path / 'res.sqlite3')
+    mtime = time.time_ns()
+    storage.put_many([(f'{shard}01', b'x' * 100, {}, mtime + i * 10**9) for i, shard in enumerate(('00', '01', '02'))])
+    lock_path = tmp_path / '.janitor.lock'
+    janitor = CacheJanitor(storage, lock_path, max_size=250, max_entries=0, max_age=0, shards_per_sweep=2)
+
+    # a sweep goes through 2 shards, the next one continues where it stopped, even in another worker
+    await janitor.sweep()
+    assert janitor.stats()['entries'] == 2
+    other = CacheJanitor(storage, lock_path, max_size=250, max_entries=0, max_age=0, shards_per_sweep=2)
+    await other.sweep()
+    # the most recently used result is kept, the least recently used one is evicted on its turn
+    assert other.stats()['entries'] == 3
+    assert other.stats()['evicted'] == 0
+
+    other.shards_per_sweep = len(SHARDS)
+    await other.sweep()
+    assert other.stats()['entries'] == 2
+    assert other.stats()['evicted'] == 1
+    assert storage.scan_shard('00', 0) == []
+    storage.close()
+
+
+def test_summarize():
+    entries = [EntryInfo(f'aa{i:02}', 10, atime=i, mtime=0) for i in range(40)]
+    buckets = summarize(entries)
+    assert len(buckets) == 14  # 3 entries each, the least recently used bucket has one
+    assert buckets[0] == (37, 30, 3)
+    assert sum(size for _, size, _ in buckets) == 400
+    assert summarize([]) == []
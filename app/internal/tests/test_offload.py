@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from internal.offload import ProcessingPool
+
+
+@pytest.mark.asyncio
+async def test_process_pool():
+    pool = ProcessingPool(workers=1, queue_size=4, timeout=30)
+    pool.start()
+    try:
+        assert await pool.run(sum, [1, 2, 3]) == 6
+        with pytest.raises(TypeError):
+            await pool.run(sum, ['a'])
+    finally:
+        await pool.close()
+
+    stats = pool.stats()
+    assert stats['completed'] == 1
+    assert stats['failed'] == 1
+    assert stats['running'] == 0
+
+
+@pytest.mark.asyncio
+async def test_thread_pool_queue_and_timeout():
+    # with 0 workers, jobs run in a thread one at a time
+    pool = ProcessingPool(workers=0, queue_size=1, timeout=0.05)
+    pool.start()
+
+    running = asyncio.create_task(pool.run(time.sleep, 0.2))
+    await asyncio.sleep(0.01)
+    waiting = asyncio.create_task(pool.run(time.sleep, 0))
+    await asyncio.sleep(0.01)
+    assert pool.stats()['waiting'] == 1
+
+    # the queue is full
+    with pytest.raises(HTTPException) as exc:
+        await pool.run(time.sleep, 0)
+    assert exc.value.status_code == 503
+
+    with pytest.raises(HTTPException) as exc:
+        await running
+    assert exc.value.status_code == 504
+
+    # the next job starts only after the timed out one is really finished
+    await waiting
+    stats = pool.stats()
+    assert stats['rejected'] == 1
+    assert stats['timeouts'] == 1
+    assert stats['completed'] == 1
+    assert stats['queueWaitMaxMs'] >= 100
+    await pool.close()
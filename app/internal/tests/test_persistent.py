@@ -0,0 +1,87 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from internal.errors import QueryParsingError
+from internal.persistent import PersistentContext, apply_page_options
+
+
+OPTIONS = {
+    'viewport': {'width': 1280, 'height': 720},
+    'user_agent': 'Mozilla/5.0',
+    'locale': None,
+    'extra_http_headers': None,
+    'http_credentials': None,
+}
+
+
+def test_check_options(tmp_path):
+    persistent = PersistentContext('chromium', tmp_path, limit=1, options=OPTIONS)
+
+    # page-level options may differ
+    persistent._check_options(OPTIONS | {'viewport': {'width': 390, 'height': 844}, 'extra_http_headers': {'A': 'b'}})
+
+    with pytest.raises(QueryParsingError) as excinfo:
+        persistent._check_options(OPTIONS | {'locale': 'de-DE', 'user_agent': 'curl'})
+    assert excinfo.value.errors()[0]['msg'].endswith(': locale, user_agent')
+
+    # the credentials would be sent to every origin the page loads from
+    with pytest.raises(QueryParsingError) as excinfo:
+        persistent._check_options(OPTIONS | {'http_credentials': {'username': 'u', 'password': 'p'}})
+    assert excinfo.value.errors()[0]['msg'].endswith(': http_credentials')
+
+
+def test_profile_lock(tmp_path):
+    first = PersistentContext('chromium', tmp_path, limit=1, options=OPTIONS)
+    second = PersistentContext('chromium', tmp_path, limit=1, options=OPTIONS)
+    assert first._acquire_lock() is True
+    assert second._acquire_lock() is False
+    first._release_lock()
+    assert second._acquire_lock() is True
+    second._release_lock()
+
+
+@pytest.mark.asyncio
+async def test_apply_page_options():
+    page = MagicMock()
+    page.set_viewport_size = AsyncMock()
+    page.set_extra_http_headers = AsyncMock()
+
+    await apply_page_options(page, OPTIONS | {'extra_http_headers': {'X-Api-Key': '1'}})
+    page.set_viewport_size.assert_awaited_once_with({'width': 1280, 'height': 720})
+    page.set_extra_http_headers.assert_awaited_once_with({'X-Api-Key': '1'})
+
+
+@pytest.mark.asyncio
+async def test_single_launch(tmp_path):
+    persistent = PersistentContext('chromium', tmp_path, limit=2, options=OPTIONS)
+    persistent.owner = True
+    launches = 0
+
+    async def launch():
+        nonlocal launches
+        launches += 1
+        await asyncio.sleep(0.01)
+        persistent.context = MagicMock()
+        persistent._closed = False
+
+    persistent._launch = launch
+    # requests that find the context down at the same time launch it once
+    contexts = await asyncio.gather(persistent._get_context(), persistent._get_context())
+    assert launches == 1
+    assert contexts[0] is contexts[1]
+
+
+@pytest.mark.asyncio
+async def test_start_not_owner(tmp_path, caplog):
+    owner = PersistentContext('firefox', tmp_path, limit=1, options=OPTIONS)
+    assert owner._acquire_lock()
+    other = PersistentContext('firefox', tmp_path, limit=1, options=OPTIONS, shared=True)
+    # the profile can't be shared by Firefox, the requests with incognito=no can't be served by this worker
+    with caplog.at_level('WARNING', logger='scrapper'):
+        await other.start()
+    assert not other.owner
+    assert 'incognito=no' in caplog.text
+    await other.close()
+    owner._release_lock()
@@ -0,0 +1,160 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from internal.pool import ContextPool, frame_origin, options_fingerprint
+
+
+def make_browser(name='chromium'):
+    browser = MagicMock()
+    browser.is_connected.return_value = True
+    browser.browser_type.name = name
+    browser.new_context = AsyncMock(side_effect=lambda **_: make_context())
+    return browser
+
+
+def make_context():
+    context = MagicMock()
+    context.pages = []
+    context.close = AsyncMock()
+    context.unroute_all = AsyncMock()
+    context.clear_cookies = AsyncMock()
+    context.clear_permissions = AsyncMock()
+    context.new_page = AsyncMock(return_value=MagicMock(close=AsyncMock()))
+    context.new_cdp_session = AsyncMock(return_value=MagicMock(send=AsyncMock()))
+    return context
+
+
+def navigate(context, *urls):
+    # what the pages of the context do, as seen by the pool
+    (event, on_page), *_ = [c.args for c in context.on.call_args_list]
+    assert event == 'page'
+    page = MagicMock()
+    on_page(page)
+    (event, on_navigated), *_ = [c.args for c in page.on.call_args_list]
+    assert event == 'framenavigated'
+    for url in urls:
+        on_navigated(MagicMock(url=url))
+
+
+def test_options_fingerprint():
+    a = {'locale': 'en-US', 'viewport': {'width': 1280, 'height': 720}}
+    b = {'viewport': {'height': 720, 'width': 1280}, 'locale': 'en-US'}
+    assert options_fingerprint(a) == options_fingerprint(b)
+    assert options_fingerprint(a) != options_fingerprint(a | {'locale': 'de-DE'})
+
+
+@pytest.mark.asyncio
+async def test_lease_reuses_context():
+    browser = make_browser()
+    pool = ContextPool(browser, max_size=1, idle_timeout=60)
+    options = {'locale': 'en-US'}
+
+    async with pool.lease(options) as first:
+        pass
+    first.clear_cookies.assert_awaited_once()
+    first.unroute_all.assert_awaited_once()
+
+    async with pool.lease(options) as second:
+        assert second is first
+
+    # different options never share a context
+    async with pool.lease({'locale': 'de-DE'}) as third:
+        assert third is not first
+
+    assert pool.stats() == {'hits': 1, 'misses': 2, 'evictions': 0, 'idle': 2, 'keys': 2}
+
+
+@pytest.mark.asyncio
+async def test_lease_respects_max_size():
+    browser = make_browser()
+    pool = ContextPool(browser, max_size=1, idle_timeout=60)
+    options = {'locale': 'en-US'}
+
+    async with pool.lease(options) as first:
+        async with pool.lease(options) as second:
+            pass
+        second.close.assert_not_awaited()
+    # the pool already holds one idle context for these options
+    first.close.assert_awaited_once()
+    assert pool.stats()['idle'] == 1
+
+
+@pytest.mark.asyncio
+async def test_evict_idle():
+    browser = make_browser()
+    pool = ContextPool(browser, max_size=2, idle_timeout=0.01)
+    await pool.warm_up({'locale': 'en-US'}, n=2)
+    assert pool.stats()['idle'] == 2
+
+    await asyncio.sleep(0.02)
+    assert await pool.evict_idle() == 2
+    assert pool.stats()['idle'] == 0
+    assert pool.stats()['evictions'] == 2
+
+    await pool.close()
+
+
+def test_frame_origin():
+    assert frame_origin('https://User@Example.com:8443/path?q=1') == 'https://example.com:8443'
+    assert frame_origin('http://example.com/') == 'http://example.com'
+    assert frame_origin('about:blank') is None
+    assert frame_origin('data:text/html,hi') is None
+
+
+@pytest.mark.asyncio
+async def test_reset_clears_visited_origins():
+    browser = make_browser()
+    pool = ContextPool(browser, max_size=1, idle_timeout=60)
+
+    async with pool.lease({}) as context:
+        navigate(context, 'https://a.example/', 'https://b.example/redirected', 'about:blank')
+
+    session = context.new_cdp_session.return_value
+    calls = [c.args for c in session.send.await_args_list]
+    assert calls == [
+        ('Storage.clearDataForOrigin', {'origin': 'https://a.example', 'storageTypes': 'all'}),
+        ('Storage.clearDataForOrigin', {'origin': 'https://b.example', 'storageTypes': 'all'}),
+        ('Network.clearBrowserCache',),
+    ]
+    context.new_page.return_value.close.assert_awaited_once()
+    assert pool.stats()['idle'] == 1
+
+    # the origins are cleared once, a context that visited nothing since needs no CDP calls
+    async with pool.lease({}) as again:
+        assert again is context
+    assert session.send.await_count == 3
+    await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_reset_closes_context_not_chromium():
+    browser = make_browser('firefox')
+    pool = ContextPool(browser, max_size=1, idle_timeout=60)
+
+    async with pool.lease({}) as context:
+        navigate(context, 'https://a.example/')
+    # the storage of the origin can't be cleared, the context is not reused
+    context.close.assert_awaited_once()
+    context.new_cdp_session.assert_not_awaited()
+    assert pool.stats()['idle'] == 0
+
+
+@pytest.mark.asyncio
+async def test_max_idle():
+    browser = make_browser()
+    pool = ContextPool(browser, max_size=2, idle_timeout=60, max_idle=2)
+
+    # every request has its own options, the least recently returned context makes room for the new one
+    contexts = []
+    for token in ('a', 'b', 'c'):
+        async with pool.lease({'extra_http_headers': {'X-Token': token}}) as context:
+            contexts.append(context)
+    contexts[0].close.assert_awaited_once()
+    contexts[1].close.assert_not_awaited()
+    assert pool.stats() == {'hits': 0, 'misses': 3, 'evictions': 1, 'idle': 2, 'keys': 2}
+
+    async with pool.lease({'extra_http_headers': {'X-Token': 'b'}}) as context:
+        assert context is contexts[1]
+    await pool.close()
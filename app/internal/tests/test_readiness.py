@@ -0,0 +1,60 @@
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from internal.readiness import NetworkIdleTracker, scroll_down, wait_for_readiness
+
+
+def make_tracker() -> tuple[NetworkIdleTracker, dict]:
+    handlers = {}
+    page = MagicMock()
+    page.on.side_effect = lambda event, handler: handlers.__setitem__(event, handler)
+    return NetworkIdleTracker(page), handlers
+
+
+@pytest.mark.asyncio
+async def test_network_idle():
+    tracker, handlers = make_tracker()
+    assert set(handlers) == {'request', 'requestfinished', 'requestfailed'}
+
+    handlers['request'](None)
+    handlers['request'](None)
+    assert tracker.inflight == 2
+
+    # a request is still in flight
+    handlers['requestfinished'](None)
+    assert not await tracker.wait(0.01, time.monotonic() + 0.05)
+
+    handlers['requestfailed'](None)
+    assert tracker.inflight == 0
+    assert await tracker.wait(0.01, time.monotonic() + 1)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_readiness_skips_waits_after_cap():
+    page = MagicMock()
+    page.wait_for_selector = AsyncMock()
+    page.evaluate = AsyncMock(return_value=True)
+
+    await wait_for_readiness(page, selector='#app', dom_idle=100, network_idle=0, timeout=1000)
+    page.wait_for_selector.assert_awaited_once()
+    page.evaluate.assert_awaited_once()
+
+    # a zero timeout means "wait forever" to Playwright, so nothing may be awaited once the cap is reached
+    page.wait_for_selector.reset_mock()
+    page.evaluate.reset_mock()
+    page.wait_for_selector.side_effect = lambda *args, **kwargs: time.sleep(0.01)
+    await wait_for_readiness(page, selector='#app', dom_idle=100, network_idle=0, timeout=5)
+    page.evaluate.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_scroll_down_stops_at_bottom():
+    page = MagicMock()
+    page.mouse.wheel = AsyncMock()
+    page.wait_for_timeout = AsyncMock()
+    page.evaluate = AsyncMock(side_effect=[[1000, False], [2000, True], [2000, True]])
+
+    await scroll_down(page, distance=5000, sleep=1000)
+    assert page.mouse.wheel.await_count == 3
@@ -0,0 +1,40 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from internal.scripts import ScriptRegistry
+
+
+def test_registry_reloads_on_mtime_change(tmp_path):
+    path = tmp_path / 'script.js'
+    path.write_text('console.log(1);')
+
+    registry = ScriptRegistry(tmp_path)
+    registry.load()
+    assert registry.get(path) == 'console.log(1);'
+
+    path.write_text('console.log(2);')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    # the mtime isn't checked again within the check interval
+    assert registry.get(path) == 'console.log(1);'
+
+    with patch('internal.scripts.CHECK_INTERVAL', 0):
+        assert registry.get(path) == 'console.log(2);'
+
+
+def test_registry_missing_script(tmp_path):
+    path = tmp_path / 'script.js'
+    path.write_text('console.log(1);')
+
+    registry = ScriptRegistry(tmp_path)
+    assert registry.exists(path)
+    assert not registry.exists(tmp_path / 'not-exists.js')
+
+    path.unlink()
+    with patch('internal.scripts.CHECK_INTERVAL', 0):
+        assert not registry.exists(path)
+        with pytest.raises(FileNotFoundError):
+            registry.get(path)
@@ -0,0 +1,138 @@
+import asyncio
+import fcntl
+import multiprocessing
+
+import pytest
+
+from internal import cache
+from internal.singleflight import SingleFlight, _offset
+from internal.storage import FileStorage
+
+
+KEY = cache.make_key('http://example.com')
+
+
+@pytest.fixture
+def flights(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'storage', FileStorage(tmp_path))
+    monkeypatch.setattr(cache, 'memory', cache.MemoryTier(max_size=0))
+    sf = SingleFlight(tmp_path / '.singleflight.lock')
+    yield sf
+    asyncio.run(sf.close())
+
+
+@pytest.mark.asyncio
+async def test_coalesced_in_worker(flights):
+    renders = 0
+
+    async def produce():
+        nonlocal renders
+        renders += 1
+        await asyncio.sleep(0.05)
+        return {'id': KEY}
+
+    results = await asyncio.gather(*(flights.do(KEY, produce) for _ in range(10)))
+    assert renders == 1
+    assert all(r == {'id': KEY} for r in results)
+    stats = flights.stats()
+    assert (stats['inFlight'], stats['leaders'], stats['coalesced'], stats['shared']) == (0, 1, 9, 0)
+
+    # the next request renders again
+    await flights.do(KEY, produce)
+    assert renders == 2
+
+
+@pytest.mark.asyncio
+async def test_error_is_shared(flights):
+    async def produce():
+        await asyncio.sleep(0.01)
+        raise ValueError('failed')
+
+    results = await asyncio.gather(*(flights.do(KEY, produce) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def hold_lock(path, key, locked, release):
+    # another worker rendering the same page
+    with open(path, 'a+') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX, 1, _offset(key))
+        locked.set()
+        release.wait(5)
+
+
+@pytest.mark.asyncio
+async def test_shared_across_workers(flights):
+    ctx = multiprocessing.get_context('fork')
+    locked, release = ctx.Event(), ctx.Event()
+    worker = ctx.Process(target=hold_lock, args=(flights.lock_path, KEY, locked, release))
+    worker.start()
+    try:
+        assert await asyncio.to_thread(locked.wait, 5)
+
+        async def produce():
+            raise AssertionError('the page is rendered by the other worker')
+
+        task = asyncio.create_task(flights.do(KEY, produce))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+
+        # the other worker saves the result and releases the lock
+        await cache.dump_result({'id': KEY}, key=KEY)
+        release.set()
+        assert await task == {'id': KEY}
+        assert flights.shared == 1
+    finally:
+        release.set()
+        worker.join()
+
+
+@pytest.mark.asyncio
+async def test_other_worker_failed(flights):
+    # an old result is in the cache, the other worker fails to render a new one
+    old = {'id': KEY, 'date': '2024-01-01T00:00:00+00:00'}
+    await cache.dump_result(old, key=KEY)
+    ctx = multiprocessing.get_context('fork')
+    locked, release = ctx.Event(), ctx.Event()
+    worker = ctx.Process(target=hold_lock, args=(flights.lock_path, KEY, locked, release))
+    worker.start()
+    try:
+        assert await asyncio.to_thread(locked.wait, 5)
+
+        async def produce():
+            return {'id': KEY, 'date': 'now'}
+
+        task = asyncio.create_task(flights.do(KEY, produce))
+        await asyncio.sleep(0.1)
+        release.set()
+        # the old result isn't served, the page is rendered here
+        assert await task == {'id': KEY, 'date': 'now'}
+        assert (flights.shared, flights.leaders) == (0, 1)
+    finally:
+        release.set()
+        worker.join()
+
+
+@pytest.mark.asyncio
+async def test_revalidate_low_priority(flights, monkeypatch):
+    monkeypatch.setattr('internal.singleflight.REVALIDATE_POLL_INTERVAL', 0.01)
+    slots = asyncio.Semaphore(1)
+    renders = 0
+
+    async def produce():
+        nonlocal renders
+        renders += 1
+        return {'id': KEY}
+
+    # all browser slots are taken by requests, the re-render waits
+    await slots.acquire()
+    flights.revalidate(KEY, produce, slots)
+    flights.revalidate(KEY, produce, slots)  # already scheduled
+    await asyncio.sleep(0.05)
+    assert renders == 0
+    assert flights.stats()['revalidating'] == 1
+
+    slots.release()
+    await asyncio.sleep(0.05)
+    assert renders == 1
+    assert flights.stats()['revalidating'] == 0
+    assert flights.revalidations == 1
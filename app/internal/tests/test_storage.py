@@ -0,0 +1,128 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from internal.storage import BLOB_DIR, CONTENT_BLOB, SCREENSHOT_BLOB, FileStorage, SQLiteStorage, Storage
+from migrate_cache import migrate, read_blob
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteStorage(tmp_path / 'res.sqlite3')
+    yield storage
+    storage.close()
+
+
+def test_storage_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_sqlite_put_get(sqlite_storage):
+    assert sqlite_storage.get('aa01') is None
+    assert sqlite_storage.stamp('aa01') is None
+
+    stamp = sqlite_storage.put('aa01', b'record', {SCREENSHOT_BLOB: b'screenshot'})
+    assert sqlite_storage.get('aa01') == (b'record', stamp)
+    assert sqlite_storage.stamp('aa01') == stamp
+    assert sqlite_storage.blob('aa01', SCREENSHOT_BLOB) == b'screenshot'
+    assert sqlite_storage.blob('aa01', CONTENT_BLOB) is None
+
+    # a rewrite changes the stamp, and drops the old screenshot
+    new_stamp = sqlite_storage.put('aa01', b'new record', {})
+    assert new_stamp != stamp
+    assert sqlite_storage.get('aa01') == (b'new record', new_stamp)
+    assert sqlite_storage.blob('aa01', SCREENSHOT_BLOB) is None
+
+
+def test_sqlite_blob_refs(sqlite_storage):
+    def blob_refs():
+        return sqlite_storage._connection().execute('SELECT refs FROM blobs ORDER BY refs').fetchall()
+
+    sqlite_storage.put('aa01', b'1', {CONTENT_BLOB: b'html', SCREENSHOT_BLOB: b'image'})
+    sqlite_storage.put('bb02', b'2', {CONTENT_BLOB: b'html'})
+    assert blob_refs() == [(1,), (2,)]  # the same content is stored once
+
+    sqlite_storage.put('aa01', b'1', {CONTENT_BLOB: b'new html'})
+    assert blob_refs() == [(1,), (1,)]
+    sqlite_storage.remove(['aa01', 'bb02'])
+    assert blob_refs() == []
+
+
+def test_sqlite_scan_touch_remove(sqlite_storage):
+    mtime = time.time_ns() - 100 * 10**9
+    sqlite_storage.put_many([('aa01', b'x' * 10, {SCREENSHOT_BLOB: b'y' * 5}, mtime), ('bb02', b'x' * 20, {}, mtime)])
+    sqlite_storage.get('aa01', touch=True)
+    sqlite_storage.close()  # the touch is committed in the background
+
+    entries = {e.key: e for batch in sqlite_storage.scan(time.time()) for e in batch}
+    assert sorted(entries) == ['aa01', 'bb02']
+    assert entries['aa01'].size == 15
+    assert entries['aa01'].mtime == pytest.approx(mtime / 1e9)
+    assert entries['aa01'].atime > entries['bb02'].atime == pytest.approx(mtime / 1e9)
+
+    sqlite_storage.remove(['aa01'])
+    assert sqlite_storage.get('aa01') is None
+    assert sqlite_storage.blob('aa01', SCREENSHOT_BLOB) is None
+    assert [e.key for batch in sqlite_storage.scan(time.time()) for e in batch] == ['bb02']
+
+
+def test_file_blobs(tmp_path):
+    storage = FileStorage(tmp_path)
+    storage.put('aa01', b'1', {CONTENT_BLOB: b'html', SCREENSHOT_BLOB: b'image'})
+    storage.put('bb02', b'2', {CONTENT_BLOB: b'html'})
+
+    # the blobs of the results are hard links to the blob store
+    content = storage.blob('aa01', CONTENT_BLOB)
+    assert content.read_bytes() == b'html'
+    assert content.stat().st_ino == storage.blob('bb02', CONTENT_BLOB).stat().st_ino
+    assert content.stat().st_nlink == 3
+    blobs = list((tmp_path / BLOB_DIR).glob('*/*'))
+    assert len(blobs) == 2
+
+    # the blobs no result refers to are removed by the scan, once they're old enough
+    storage.remove(['aa01', 'bb02'])
+    assert storage.blob('aa01', CONTENT_BLOB) is None
+    assert [e for batch in storage.scan(time.time()) for e in batch] == []
+    assert len(list((tmp_path / BLOB_DIR).glob('*/*'))) == 2
+    for blob in blobs:
+        os.utime(blob, (0, 0))
+    assert [e for batch in storage.scan(time.time()) for e in batch] == []
+    assert list((tmp_path / BLOB_DIR).glob('*/*')) == []
+
+
+def test_file_blobs_concurrent(tmp_path):
+    # the writes run in threads, several results may store the same blob at once
+    storage = FileStorage(tmp_path)
+    data = os.urandom(2**20)
+    keys = [f'aa{i:02}' for i in range(8)]
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        list(executor.map(lambda key: storage.put(key, b'1', {CONTENT_BLOB: data}), keys))
+
+    (blob,) = (tmp_path / BLOB_DIR).glob('*/*')
+    assert blob.read_bytes() == data
+    assert blob.stat().st_nlink == len(keys) + 1  # no result fell back to a copy of its own
+    assert list(tmp_path.glob('*/.*')) == []
+
+
+def test_migrate(tmp_path, sqlite_storage):
+    files = FileStorage(tmp_path / '_res')
+    mtime = time.time_ns() - 10**9
+    files.put('aa01', b'record 1', {CONTENT_BLOB: b'html', SCREENSHOT_BLOB: b'screenshot'}, mtime=mtime)
+    files.put('bb02', b'record 2', {})
+
+    assert migrate(files, sqlite_storage, batch_size=1, delete=False) == (2, 30)
+    assert sqlite_storage.get('aa01')[0] == b'record 1'
+    assert sqlite_storage.stamp('aa01')[1] == mtime
+    assert read_blob(sqlite_storage, 'aa01', CONTENT_BLOB) == b'html'
+    assert read_blob(sqlite_storage, 'aa01', SCREENSHOT_BLOB) == b'screenshot'
+    assert sqlite_storage.blob('bb02', SCREENSHOT_BLOB) is None
+
+    # and back, removing the copied results
+    back = FileStorage(tmp_path / '_back')
+    assert migrate(sqlite_storage, back, batch_size=10, delete=True) == (2, 30)
+    assert read_blob(back, 'aa01', SCREENSHOT_BLOB) == b'screenshot'
+    assert back.get('bb02')[0] == b'record 2'
+    assert list(sqlite_storage.scan(time.time())) == []
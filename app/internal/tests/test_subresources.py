@@ -0,0 +1,112 @@
+import errno
+import time
+from unittest.mock import patch
+
+import pytest
+
+from internal.subresources import SubresourceCache, freshness_deadline
+
+
+def test_freshness_deadline():
+    now = time.time()
+    assert freshness_deadline(200, {'cache-control': 'public, max-age=100'}) == pytest.approx(now + 100, abs=5)
+    assert freshness_deadline(200, {'cache-control': 'max-age=100, s-maxage=10'}) == pytest.approx(now + 10, abs=5)
+    assert freshness_deadline(200, {'expires': 'Thu, 01 Jan 2099 00:00:00 GMT'}) > now
+
+    assert freshness_deadline(200, {}) is None
+    assert freshness_deadline(200, {'cache-control': 'max-age=0'}) is None
+    assert freshness_deadline(200, {'cache-control': 'no-store, max-age=100'}) is None
+    assert freshness_deadline(200, {'cache-control': 'private, max-age=100'}) is None
+    assert freshness_deadline(200, {'cache-control': 'max-age=100', 'set-cookie': 'a=b'}) is None
+    assert freshness_deadline(200, {'cache-control': 'max-age=100', 'vary': 'Cookie'}) is None
+    assert freshness_deadline(200, {'cache-control': 'max-age=100', 'vary': 'Accept-Encoding'}) is not None
+    assert freshness_deadline(206, {'cache-control': 'max-age=100'}) is None
+    assert freshness_deadline(200, {'expires': 'Thu, 01 Jan 1970 00:00:00 GMT'}) is None
+
+
+@pytest.mark.asyncio
+async def test_subresource_cache(tmp_path):
+    cache = SubresourceCache(tmp_path, max_size=10)
+    cache.load()
+    headers = {'Cache-Control': 'max-age=100', 'Content-Type': 'text/css', 'Content-Encoding': 'gzip'}
+
+    assert await cache.get('https://example.com/a.css') is None
+    assert await cache.put('https://example.com/a.css', 200, headers, b'abcd')
+    # the same body from another URL is stored once
+    assert await cache.put('https://example.com/b.css', 200, headers, b'abcd')
+    assert cache.size == 4
+    assert not await cache.put('https://example.com/c.css', 200, {}, b'ab')
+
+    entry, body = await cache.get('https://example.com/a.css')
+    assert body == b'abcd'
+    assert entry.headers == {'cache-control': 'max-age=100', 'content-type': 'text/css'}
+
+    # b.css is the least recently used, a.css and b.css share the blob, so both go
+    assert await cache.put('https://example.com/d.css', 200, headers, b'12345678')
+    assert cache.size == 8
+    assert await cache.get('https://example.com/a.css') is None
+    assert await cache.get('https://example.com/d.css') is not None
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['hitRatio'] == 0.5
+    assert stats['entries'] == 1
+
+    # the index is restored from disk, once the slot is free
+    cache.close()
+    restored = SubresourceCache(tmp_path, max_size=10)
+    restored.load()
+    assert restored.size == 8
+    entry, body = await restored.get('https://example.com/d.css')
+    assert body == b'12345678'
+    restored.close()
+
+
+@pytest.mark.asyncio
+async def test_subresource_cache_slots(tmp_path):
+    headers = {'Cache-Control': 'max-age=100'}
+    first = SubresourceCache(tmp_path, max_size=10, slots=2)
+    first.load()
+    second = SubresourceCache(tmp_path, max_size=10, slots=2)
+    second.load()
+    assert (first.dir, second.dir) == (tmp_path / '0', tmp_path / '1')
+
+    # the workers never remove the blobs of each other
+    assert await first.put('https://example.com/a.css', 200, headers, b'abcd')
+    assert await second.put('https://example.com/a.css', 200, headers, b'abcd')
+    assert await second.put('https://example.com/b.css', 200, headers, b'1234567890')
+    assert await first.get('https://example.com/a.css') is not None
+
+    # no slot is left for a third worker
+    third = SubresourceCache(tmp_path, max_size=10, slots=2)
+    third.load()
+    assert not third.enabled
+    first.close()
+    second.close()
+
+
+def test_accepts():
+    cache = SubresourceCache(None, max_size=1)
+    assert cache.accepts('GET', 'script', {})
+    assert not cache.accepts('POST', 'script', {})
+    assert not cache.accepts('GET', 'document', {})
+    assert not cache.accepts('GET', 'image', {'range': 'bytes=0-10'})
+    assert not SubresourceCache(None, max_size=0).accepts('GET', 'script', {})
+
+
+@pytest.mark.asyncio
+async def test_subresource_cache_io_errors(tmp_path):
+    # the cache is optional, a disk error is a miss, not a failed request
+    cache = SubresourceCache(tmp_path, max_size=10)
+    cache.load()
+    headers = {'Cache-Control': 'max-age=100'}
+    with patch('internal.subresources._write_atomic', side_effect=OSError(errno.ENOSPC, 'No space left')):
+        assert not await cache.put('https://example.com/a.css', 200, headers, b'abcd')
+    assert cache.size == 0
+
+    assert await cache.put('https://example.com/a.css', 200, headers, b'abcd')
+    with patch('internal.subresources._read', side_effect=OSError(errno.EIO, 'I/O error')):
+        assert await cache.get('https://example.com/a.css') is None
+    assert cache.stats()['misses'] == 1
+    cache.close()
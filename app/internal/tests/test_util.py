@@ -1,4 +1,16 @@
-from internal.util import levenshtein_similarity
+from pathlib import Path
+
+import pytest
+
+from internal.util import improve_content, levenshtein_similarity
+
+
+GOLDEN_DIR = Path(__file__).parent / 'golden' / 'improve_content'
+GOLDEN_TITLES = {
+    'article': 'How the new bridge was built',
+    'existing_article': 'Breaking: the market rallies',
+    'nested': 'Nested',
+}
 
 
 def test_levenshtein_similarity():
@@ -7,3 +19,22 @@ def test_levenshtein_similarity():
     assert levenshtein_similarity('hello', 'hell') == 0.8
     assert levenshtein_similarity('hello', 'helo') == 0.8
     assert levenshtein_similarity('hello', 'buy') == 0.0
+
+
+@pytest.mark.parametrize('name', sorted(GOLDEN_TITLES))
+def test_improve_content_golden(name):
+    # the expected outputs were produced by the original find_all/find implementation
+    content = (GOLDEN_DIR / f'{name}.html').read_text(encoding='utf-8')
+    expected = (GOLDEN_DIR / f'{name}.expected.html').read_text(encoding='utf-8')
+    assert improve_content(GOLDEN_TITLES[name], content) == expected
+
+
+def test_improve_content_removes_empty_blocks():
+    # the stripped strings are glued together (get_text(strip=True)), so <b>two</b> <i>words</i> is one word
+    content = (
+        '<div><p>one</p><p>12 34</p><p><b>two</b> <i>words</i></p><p>two <i>more words</i></p>'
+        '<div><p>x</p><img src="a.png"></div><p><!-- a comment with words --></p></div>'
+    )
+    assert improve_content('Title', content) == (
+        '<article><h1>Title</h1><div><p>two <i>more words</i></p><div><img src="a.png"/></div></div></article>'
+    )
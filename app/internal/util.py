@@ -1,7 +1,7 @@
 from collections.abc import MutableMapping
 from urllib.parse import parse_qs
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
 from starlette.datastructures import URL
 
 
@@ -9,46 +9,46 @@ TITLE_MAX_DISTANCE = 350
 ACCEPTABLE_LINK_TEXT_LEN = 40
 
 
+# p and div elements containing any of these tags are never removed as empty
+CONTENT_TAGS = frozenset((
+    'img',
+    'picture',
+    'svg',
+    'canvas',
+    'video',
+    'audio',
+    'iframe',
+    'embed',
+    'object',
+    'param',
+    'source',
+    'h1',
+    'h2',
+    'h3',
+    'h4',
+    'h5',
+    'h6',
+    'pre',
+    'code',
+    'blockquote',
+    'dl',
+    'ol',
+    'ul',
+    'table',
+    'form',
+))
+
+# the same string types as Tag.get_text() takes into account (no comments, scripts, styles)
+TEXT_STRING_TYPES = frozenset((NavigableString, CData))
+
+
 def improve_content(title: str, content: str) -> str:
     tree = BeautifulSoup(content, 'html.parser')
 
     # 1. remove all p and div tags that contain one word or less (or only digits),
     # and not contain any images (or headers)
-    for el in tree.find_all(['p', 'div']):
-        # skip if the element has any images, headers, code blocks, lists, tables, forms, etc.
-        if el.find([
-            'img',
-            'picture',
-            'svg',
-            'canvas',
-            'video',
-            'audio',
-            'iframe',
-            'embed',
-            'object',
-            'param',
-            'source',
-            'h1',
-            'h2',
-            'h3',
-            'h4',
-            'h5',
-            'h6',
-            'pre',
-            'code',
-            'blockquote',
-            'dl',
-            'ol',
-            'ul',
-            'table',
-            'form',
-        ]):
-            continue
-        text = el.get_text(strip=True)
-        # remove the element if it contains one word or less (or only digits)
-        words = text.split()
-        if len(words) <= 1 or (''.join(words)).isnumeric():
-            el.decompose()
+    for el in empty_blocks(tree):
+        el.decompose()
 
     # 2. move the first tag h1 (or h2) to the top of the tree
     title_distance = 0
@@ -75,16 +75,75 @@ def improve_content(title: str, content: str) -> str:
             break
 
     # 3.1 check if article tag already exists, and then insert the title into it
-    for el in tree.find_all():
-        if el.name == 'article':
-            el.insert(0, BeautifulSoup(f'<h1>{title}</h1>', 'html.parser'))
-            return str(tree)
+    el = tree.find('article')
+    if el is not None:
+        el.insert(0, BeautifulSoup(f'<h1>{title}</h1>', 'html.parser'))
+        return str(tree)
 
     # 3.2 if not, create a new article tag and insert the title into it
     content = str(tree)
     return f'<article><h1>{title}</h1>{content}</article>'
 
 
+class _TextStats:
+    # what get_text(strip=True).split() of an element would give, without building the text:
+    # adjacent stripped strings are glued together, so each next string merges with the last word
+    __slots__ = ('words', 'strings', 'numeric', 'has_content')
+
+    def __init__(self):
+        self.words = 0  # sum of the word counts of the stripped strings
+        self.strings = 0  # number of non-empty stripped strings
+        self.numeric = True  # all non-whitespace characters are numeric
+        self.has_content = False  # there is a descendant from CONTENT_TAGS
+
+    def add(self, other: '_TextStats') -> None:
+        self.words += other.words
+        self.strings += other.strings
+        self.numeric = self.numeric and other.numeric
+
+
+def empty_blocks(tree: Tag) -> list[Tag]:
+    """
+    Find the p and div elements without content: one word or less (or only digits), and no CONTENT_TAGS inside.
+    Only the outermost of them are returned, the nested ones are removed together with them.
+    Every element is visited a constant number of times, whatever the nesting depth is.
+    """
+    tags = [x for x in tree.descendants if isinstance(x, Tag)]
+
+    # children come after their parents in document order, so the stats are summed up in reverse
+    stats: dict[int, _TextStats] = {}
+    for el in reversed(tags):
+        st = _TextStats()
+        for child in el.contents:
+            if isinstance(child, Tag):
+                st.add(stats[id(child)])
+                st.has_content = st.has_content or child.name in CONTENT_TAGS or stats[id(child)].has_content
+            elif type(child) in TEXT_STRING_TYPES:
+                words = child.split()
+                if words:
+                    st.words += len(words)
+                    st.strings += 1
+                    st.numeric = st.numeric and ''.join(words).isnumeric()
+        stats[id(el)] = st
+
+    res = []
+    removed: set[int] = set()
+    for el in tags:
+        if id(el.parent) in removed:
+            removed.add(id(el))
+            continue
+        if el.name not in ('p', 'div'):
+            continue
+        st = stats[id(el)]
+        if st.has_content:
+            continue
+        words = st.words - st.strings + 1 if st.strings else 0
+        if words <= 1 or st.numeric and st.strings:
+            removed.add(id(el))
+            res.append(el)
+    return res
+
+
 def improve_link(link: MutableMapping) -> MutableMapping:
     lines = link['text'].splitlines()
     text = ''
@@ -100,28 +159,6 @@ def improve_link(link: MutableMapping) -> MutableMapping:
     return link
 
 
-def social_meta_tags(full_page_content: str) -> dict:
-    og = {}  # open graph
-    twitter = {}
-    tree = BeautifulSoup(full_page_content, 'html.parser')
-    for el in tree.find_all('meta'):
-        attrs = el.attrs
-        # open Graph protocol
-        if 'property' in attrs and attrs['property'].startswith('og:'):
-            key = attrs['property'][3:]  # len('og:') == 3
-            if key and 'content' in attrs:
-                og[key] = attrs['content']
-
-        # twitter protocol
-        if 'name' in attrs and attrs['name'].startswith('twitter:'):
-            key = attrs['name'][8:]  # len('twitter:') == 8
-            if key and 'content' in attrs:
-                twitter[key] = attrs['content']
-
-    res = {key: props for key, props in (('og', og), ('twitter', twitter)) if props}
-    return res
-
-
 def levenshtein_similarity(str1: str, str2: str) -> float:
     # create a matrix to hold the distances
     d = [[0] * (len(str2) + 1) for _ in range(len(str1) + 1)]
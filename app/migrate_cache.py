@@ -0,0 +1,102 @@
+import argparse
+import time
+
+from dataclasses import dataclass
+from pathlib import Path
+
+from internal.storage import BLOBS, FileStorage, SQLiteStorage, Storage
+from settings import USER_DATA_DIR, SCREENSHOT_TYPE, CacheBackend
+
+
+DEFAULT_BATCH = 500
+
+
+@dataclass
+class Options:
+    source: CacheBackend = CacheBackend.FILES
+    target: CacheBackend = CacheBackend.SQLITE
+    batch: int = DEFAULT_BATCH
+    delete: bool = False
+
+
+def open_backend(backend: CacheBackend) -> Storage:
+    # the same locations as the server uses, see internal.storage.open_storage
+    if backend == CacheBackend.SQLITE:
+        return SQLiteStorage(USER_DATA_DIR / '_res.sqlite3')
+    return FileStorage(USER_DATA_DIR / '_res', SCREENSHOT_TYPE)
+
+
+def read_blob(storage: Storage, key: str, name: str) -> bytes | None:
+    blob = storage.blob(key, name)
+    if isinstance(blob, Path):
+        return blob.read_bytes()
+    return blob
+
+
+def migrate(source: Storage, target: Storage, batch_size: int, delete: bool) -> tuple[int, int]:
+    # results are copied as stored (any format version), with the time they were saved
+    count = size = 0
+    items = []
+    copied = []
+
+    def flush():
+        target.put_many(items)
+        if delete:
+            source.remove(copied)
+        items.clear()
+        copied.clear()
+
+    for batch in source.scan(time.time()):
+        for entry in batch:
+            res = source.get(entry.key)
+            if res is None:
+                continue  # a blob without the result, or removed meanwhile
+            record, (_, mtime) = res  # the stamp of both backends ends with the mtime in ns
+            blobs = {name: read_blob(source, entry.key, name) for name in BLOBS}
+            items.append((entry.key, record, {k: v for k, v in blobs.items() if v is not None}, mtime))
+            copied.append(entry.key)
+            count += 1
+            size += entry.size
+            if len(items) >= batch_size:
+                flush()
+                print(f'{count} results, {size / 2**20:.1f} MiB')
+    flush()
+    return count, size
+
+
+def process_args() -> Options:
+    backends = [b.value for b in CacheBackend]
+    parser = argparse.ArgumentParser(
+        description=f'Copy the result cache in {USER_DATA_DIR} from one storage backend (CACHE_BACKEND) to another.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,  # show defaults in help
+    )
+    parser.add_argument('--from', dest='source', choices=backends, default=CacheBackend.FILES.value, help='source')
+    parser.add_argument('--to', dest='target', choices=backends, default=CacheBackend.SQLITE.value, help='target')
+    parser.add_argument('-b', '--batch', metavar='N', type=int, default=DEFAULT_BATCH, help='results per commit')
+    parser.add_argument('--delete', action='store_true', help='remove the results from the source once copied')
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error('Source and target must be different')
+    if args.batch < 1:
+        parser.error('Batch must be > 0')
+
+    return Options(CacheBackend(args.source), CacheBackend(args.target), args.batch, args.delete)
+
+
+def main() -> None:
+    opt = process_args()
+    source, target = open_backend(opt.source), open_backend(opt.target)
+    t0 = time.monotonic()
+    try:
+        count, size = migrate(source, target, opt.batch, opt.delete)
+    finally:
+        target.close()
+        source.close()
+    print(f'Done: {count} results, {size / 2**20:.1f} MiB in {time.monotonic() - t0:.1f}s')
+
+
+if __name__ == '__main__':
+    # How to run (stop the server first, then set CACHE_BACKEND=sqlite):
+    # python migrate_cache.py --from files --to sqlite
+    main()
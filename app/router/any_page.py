@@ -6,20 +6,26 @@ import tldextract
 
 from fastapi import APIRouter, Query, Depends
 from fastapi.requests import Request
+from fastapi.responses import Response
 from pydantic import BaseModel
-from playwright.async_api import Browser
+from playwright.async_api import Page
 
 from internal import util, cache
+from internal.cluster import BrowserCluster
+from internal.persistent import PersistentContext
 from internal.browser import (
-    new_context,
+    render,
     page_processing,
-    get_screenshot,
+    capture,
 )
+from internal.singleflight import flights
+from . import conditional
 from .query_params import (
     URLParam,
     CommonQueryParams,
     BrowserQueryParams,
     ProxyQueryParams,
+    result_key,
 )
 from server.auth import AuthRequired
 
@@ -48,7 +54,7 @@ async def get_any_page(
     browser_params: Annotated[BrowserQueryParams, Depends()],
     proxy_params: Annotated[ProxyQueryParams, Depends()],
     _: AuthRequired,
-) -> dict:
+) -> dict | Response:
     """
     Get any page from the given URL.<br><br>
     Page is fetched using Playwright, but no additional processing is done.
@@ -56,50 +62,66 @@ async def get_any_page(
     # split URL into parts: host with scheme, path with query, query params as a dict
     host_url, full_path, query_dict = util.split_url(request.url)
 
-    # get cache data if exists
-    r_id = cache.make_key(full_path)  # unique result ID
-    if params.cache:
-        data = cache.load_result(key=r_id)
-        if data:
-            return data
+    # unique result ID, the same for requests that differ only in spelling
+    r_id = result_key(request.url.path, url, params, browser_params, proxy_params)
 
-    browser: Browser = request.state.browser
+    browsers: BrowserCluster = request.state.browsers
+    persistent: PersistentContext = request.state.persistent_context
     semaphore: asyncio.Semaphore = request.state.semaphore
 
-    # create a new browser context
-    async with semaphore:
-        async with new_context(browser, browser_params, proxy_params) as context:
-            page = await context.new_page()
-            await page_processing(
-                page=page,
-                url=url.url,
-                params=params,
-                browser_params=browser_params,
+    async def scrape(page: Page) -> tuple:
+        await page_processing(
+            page=page,
+            url=url.url,
+            params=params,
+            browser_params=browser_params,
+        )
+        page_content, meta, screenshot, title = await capture(
+            page, content=params.full_content, screenshot=params.screenshot, title=True
+        )
+        return page_content, meta, screenshot, page.url, title
+
+    async def produce() -> dict:
+        # open a new page in an incognito (or the persistent) browser context
+        async with semaphore:
+            page_content, meta, screenshot, page_url, title = await render(
+                browsers, persistent, browser_params, proxy_params, scrape
             )
-            page_content = await page.content()
-            screenshot = await get_screenshot(page) if params.screenshot else None
-            page_url = page.url
-            title = await page.title()
-
-    now = datetime.datetime.now(datetime.timezone.utc).isoformat()  # ISO 8601 format
-    domain = tldextract.extract(page_url).registered_domain
-
-    r = {
-        'id': r_id,
-        'url': page_url,
-        'domain': domain,
-        'date': now,
-        'resultUri': f'{host_url}/result/{r_id}',
-        'query': query_dict,
-        'title': title,
-        'meta': util.social_meta_tags(page_content),
-    }
-
-    if params.full_content:
-        r['fullContent'] = page_content
-    if params.screenshot:
-        r['screenshotUri'] = f'{host_url}/screenshot/{r_id}'
-
-    # save result to disk
-    cache.dump_result(r, key=r_id, screenshot=screenshot)
-    return r
+
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()  # ISO 8601 format
+        domain = tldextract.extract(page_url).registered_domain
+
+        r = {
+            'id': r_id,
+            'url': page_url,
+            'domain': domain,
+            'date': now,
+            'resultUri': f'{host_url}/result/{r_id}',
+            'query': query_dict,
+            'title': title,
+            'meta': meta,
+        }
+
+        if params.full_content:
+            r['fullContent'] = page_content
+        if params.screenshot:
+            r['screenshotUri'] = f'{host_url}/screenshot/{r_id}'
+
+        # save result to disk
+        await cache.dump_result(r, key=r_id, screenshot=screenshot)
+        return r
+
+    # get cache data if exists
+    if params.cache:
+        cached = await cache.load_cached(key=r_id)
+        if cached:
+            freshness = cache.freshness(cached.date, params.max_age, params.stale_while_revalidate)
+            if freshness == cache.Freshness.STALE:
+                # the stale result is returned at once, the cache is refreshed in the background
+                flights.revalidate(r_id, produce, semaphore)
+            if freshness != cache.Freshness.EXPIRED:
+                # sent as stored, it's not decoded and validated against the response model again
+                return conditional.result_response(request, cached, r_id, str(host_url))
+
+    # identical requests in flight share one render
+    return await flights.do(r_id, produce)
@@ -6,22 +6,31 @@ import tldextract
 
 from fastapi import APIRouter, Query, Depends
 from fastapi.requests import Request
+from fastapi.responses import Response
 from pydantic import BaseModel
-from playwright.async_api import Browser
+from playwright.async_api import Page
 
 from internal import util, cache
+from internal.cluster import BrowserCluster
+from internal.persistent import PersistentContext
 from internal.browser import (
-    new_context,
+    render,
     page_processing,
-    get_screenshot,
+    capture,
+    clean_page,
 )
 from internal.errors import ArticleParsingError
+from internal.offload import ProcessingPool
+from internal.scripts import get_script
+from internal.singleflight import flights
+from . import conditional
 from .query_params import (
     URLParam,
     CommonQueryParams,
     BrowserQueryParams,
     ProxyQueryParams,
     ReadabilityQueryParams,
+    result_key,
 )
 from server.auth import AuthRequired
 from settings import READABILITY_SCRIPT, PARSER_SCRIPTS_DIR
@@ -61,7 +70,7 @@ async def parse_article(
     proxy_params: Annotated[ProxyQueryParams, Depends()],
     readability_params: Annotated[ReadabilityQueryParams, Depends()],
     _: AuthRequired,
-) -> dict:
+) -> dict | Response:
     """
     Parse article from the given URL.<br><br>
     The page from the URL should contain the text of the article that needs to be extracted.
@@ -69,66 +78,95 @@ async def parse_article(
     # split URL into parts: host with scheme, path with query, query params as a dict
     host_url, full_path, query_dict = util.split_url(request.url)
 
-    # get cache data if exists
-    r_id = cache.make_key(full_path)  # unique result ID
-    if params.cache:
-        data = cache.load_result(key=r_id)
-        if data:
-            return data
+    # unique result ID, the same for requests that differ only in spelling
+    r_id = result_key(request.url.path, url, params, browser_params, proxy_params, readability_params)
 
-    browser: Browser = request.state.browser
+    browsers: BrowserCluster = request.state.browsers
+    persistent: PersistentContext = request.state.persistent_context
     semaphore: asyncio.Semaphore = request.state.semaphore
+    processing: ProcessingPool = request.state.processing
+
+    async def scrape(page: Page) -> tuple:
+        await page_processing(
+            page=page,
+            url=url.url,
+            params=params,
+            browser_params=browser_params,
+            init_scripts=[get_script(READABILITY_SCRIPT)],
+        )
+        # the parser mutates the DOM, so the page is captured first
+        page_content, meta, screenshot, _ = await capture(
+            page, content=params.full_content, screenshot=params.screenshot
+        )
 
-    # create a new browser context
-    async with semaphore:
-        async with new_context(browser, browser_params, proxy_params) as context:
-            page = await context.new_page()
-            await page_processing(
-                page=page,
-                url=url.url,
-                params=params,
-                browser_params=browser_params,
-                init_scripts=[READABILITY_SCRIPT],
+        # evaluating JavaScript: remove invisible elements and comments, parse DOM and extract article content
+        await clean_page(page, check_size=True, remove_comments=True)
+        parser_args = {
+            # Readability options:
+            'maxElemsToParse': readability_params.max_elems_to_parse,
+            'nbTopCandidates': readability_params.nb_top_candidates,
+            'charThreshold': readability_params.char_threshold,
+            # TODO: add linkDensityModifier option
+        }
+        article = await page.evaluate(get_script(PARSER_SCRIPTS_DIR / 'article.js'), parser_args)
+        return page_content, meta, screenshot, page.url, article
+
+    async def produce() -> dict:
+        # open a new page in an incognito (or the persistent) browser context
+        async with semaphore:
+            page_content, meta, screenshot, page_url, article = await render(
+                browsers, persistent, browser_params, proxy_params, scrape
             )
-            page_content = await page.content()
-            screenshot = await get_screenshot(page) if params.screenshot else None
-            page_url = page.url
-
-            # evaluating JavaScript: parse DOM and extract article content
-            parser_args = {
-                # Readability options:
-                'maxElemsToParse': readability_params.max_elems_to_parse,
-                'nbTopCandidates': readability_params.nb_top_candidates,
-                'charThreshold': readability_params.char_threshold,
-                # TODO: add linkDensityModifier option
-            }
-            with open(PARSER_SCRIPTS_DIR / 'article.js', encoding='utf-8') as f:
-                article = await page.evaluate(f.read() % parser_args)
-
-    if article is None:
-        raise ArticleParsingError(page_url, "The page doesn't contain any articles.")
-
-    # parser error: article is not extracted, result has 'err' field
-    if 'err' in article:
-        raise ArticleParsingError(page_url, article['err'])
-
-    now = datetime.datetime.now(datetime.timezone.utc).isoformat()  # ISO 8601 format
-    domain = tldextract.extract(page_url).registered_domain
-
-    # set common fields
-    article['id'] = r_id
-    article['url'] = page_url
-    article['domain'] = domain
-    article['date'] = now
-    article['resultUri'] = f'{host_url}/result/{r_id}'
-    article['query'] = query_dict
-    article['meta'] = util.social_meta_tags(page_content)
-
-    if params.full_content:
-        article['fullContent'] = page_content
-    if params.screenshot:
-        article['screenshotUri'] = f'{host_url}/screenshot/{r_id}'
 
+        if article is None:
+            raise ArticleParsingError(page_url, "The page doesn't contain any articles.")
+
+        # parser error: article is not extracted, result has 'err' field
+        if 'err' in article:
+            raise ArticleParsingError(page_url, article['err'])
+
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()  # ISO 8601 format
+        domain = tldextract.extract(page_url).registered_domain
+
+        # set common fields
+        article['id'] = r_id
+        article['url'] = page_url
+        article['domain'] = domain
+        article['date'] = now
+        article['resultUri'] = f'{host_url}/result/{r_id}'
+        article['query'] = query_dict
+        article['meta'] = meta
+
+        if params.full_content:
+            article['fullContent'] = page_content
+        if params.screenshot:
+            article['screenshotUri'] = f'{host_url}/screenshot/{r_id}'
+
+        # CPU-bound cleanup of the article runs outside the event loop
+        article = await processing.run(improve_article, article)
+
+        # save result to disk
+        await cache.dump_result(article, key=r_id, screenshot=screenshot)
+        return article
+
+    # get cache data if exists
+    if params.cache:
+        cached = await cache.load_cached(key=r_id)
+        if cached:
+            freshness = cache.freshness(cached.date, params.max_age, params.stale_while_revalidate)
+            if freshness == cache.Freshness.STALE:
+                # the stale result is returned at once, the cache is refreshed in the background
+                flights.revalidate(r_id, produce, semaphore)
+            if freshness != cache.Freshness.EXPIRED:
+                # sent as stored, it's not decoded and validated against the response model again
+                return conditional.result_response(request, cached, r_id, str(host_url))
+
+    # identical requests in flight share one render
+    return await flights.do(r_id, produce)
+
+
+def improve_article(article: dict) -> dict:
+    # runs in a worker process of the processing pool
     if 'title' in article and 'content' in article:
         article['content'] = util.improve_content(
             title=article['title'],
@@ -138,7 +176,4 @@ async def parse_article(
     if 'textContent' in article:
         article['textContent'] = util.improve_text_content(article['textContent'])
         article['length'] = len(article['textContent']) - article['textContent'].count('\n')
-
-    # save result to disk
-    cache.dump_result(article, key=r_id, screenshot=screenshot)
     return article
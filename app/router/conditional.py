@@ -0,0 +1,71 @@
+import email.utils
+import hashlib
+import re
+
+from fastapi.requests import Request
+from fastapi.responses import Response
+
+from internal import cache
+
+
+RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def validators(etag: str, date: float) -> dict:
+    # a strong ETag, and the date of the result as Last-Modified
+    return {'etag': etag, 'last-modified': email.utils.formatdate(date, usegmt=True)}
+
+
+def not_modified(request: Request, headers: dict, date: float) -> bool:
+    # If-Modified-Since is used only without If-None-Match (RFC 9110, 13.1.3)
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or headers['etag'] in tags
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(date) <= since.timestamp()
+    return False
+
+
+def result_response(request: Request, cached: cache.CachedResult, key: str, host_url: str) -> Response:
+    """
+    The cached result as stored, with the validators of the result for the given host.
+    A client that has the result already gets 304 Not Modified.
+    """
+    # the URIs in the result depend on the host, so does the ETag
+    tag = hashlib.blake2b(f'{cached.digest}:{host_url}'.encode(), digest_size=16).hexdigest()
+    headers = validators(f'"{tag}"', cached.date)
+    if not_modified(request, headers, cached.date):
+        return Response(status_code=304, headers=headers)
+    payload = cache.rebase_uris(cached.payload, key, host_url)
+    return Response(payload, media_type='application/json', headers=headers)
+
+
+def range_response(request: Request, data: bytes, media_type: str, headers: dict) -> Response:
+    # a single byte range (RFC 9110, 14); other ranges are ignored, the whole body is sent
+    headers = {**headers, 'accept-ranges': 'bytes'}
+    http_range = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    match = RANGE.fullmatch(http_range.strip()) if http_range else None
+    if match is None or not any(match.groups()) or if_range not in (None, headers['etag'], headers['last-modified']):
+        return Response(data, media_type=media_type, headers=headers)
+
+    size = len(data)
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1  # the last bytes
+        if not int(last):
+            start = size  # an empty suffix can't be satisfied
+    if start >= size or start > end:
+        return Response(status_code=416, headers={**headers, 'content-range': f'bytes */{size}'})
+
+    headers['content-range'] = f'bytes {start}-{end}/{size}'
+    return Response(data[start : end + 1], status_code=206, media_type=media_type, headers=headers)
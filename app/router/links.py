@@ -12,22 +12,31 @@ import tldextract
 
 from fastapi import APIRouter, Query, Depends
 from fastapi.requests import Request
+from fastapi.responses import Response
 from pydantic import BaseModel
-from playwright.async_api import Browser
+from playwright.async_api import Page
 
 from internal import util, cache
+from internal.cluster import BrowserCluster
+from internal.persistent import PersistentContext
 from internal.browser import (
-    new_context,
+    render,
     page_processing,
-    get_screenshot,
+    capture,
+    clean_page,
 )
 from internal.errors import LinksParsingError
+from internal.offload import ProcessingPool
+from internal.scripts import get_script
+from internal.singleflight import flights
+from . import conditional
 from .query_params import (
     URLParam,
     CommonQueryParams,
     BrowserQueryParams,
     ProxyQueryParams,
     LinkParserQueryParams,
+    result_key,
 )
 from server.auth import AuthRequired
 from settings import PARSER_SCRIPTS_DIR
@@ -59,7 +68,7 @@ async def parser_links(
     proxy_params: Annotated[ProxyQueryParams, Depends()],
     link_parser_params: Annotated[LinkParserQueryParams, Depends()],
     _: AuthRequired,
-) -> dict:
+) -> dict | Response:
     """
     Parse news links from the given URL.<br><br>
     The page from the URL should contain hyperlinks to news articles. For example, this could be the main page of a website.
@@ -67,42 +76,96 @@ async def parser_links(
     # split URL into parts: host with scheme, path with query, query params as a dict
     host_url, full_path, query_dict = util.split_url(request.url)
 
-    # get cache data if exists
-    r_id = cache.make_key(full_path)  # unique result ID
-    if params.cache:
-        data = cache.load_result(key=r_id)
-        if data:
-            return data
+    # unique result ID, the same for requests that differ only in spelling
+    r_id = result_key(request.url.path, url, params, browser_params, proxy_params, link_parser_params)
 
-    browser: Browser = request.state.browser
+    browsers: BrowserCluster = request.state.browsers
+    persistent: PersistentContext = request.state.persistent_context
     semaphore: asyncio.Semaphore = request.state.semaphore
+    processing: ProcessingPool = request.state.processing
+
+    async def scrape(page: Page) -> tuple:
+        await page_processing(
+            page=page,
+            url=url.url,
+            params=params,
+            browser_params=browser_params,
+        )
+        # the parser mutates the DOM, so the page is captured first
+        page_content, meta, screenshot, title = await capture(
+            page, content=params.full_content, screenshot=params.screenshot, title=True
+        )
 
-    # create a new browser context
-    async with semaphore:
-        async with new_context(browser, browser_params, proxy_params) as context:
-            page = await context.new_page()
-            await page_processing(
-                page=page,
-                url=url.url,
-                params=params,
-                browser_params=browser_params,
+        # evaluating JavaScript: remove invisible elements, parse DOM and extract links of articles
+        await clean_page(page)
+        links = await page.evaluate(get_script(PARSER_SCRIPTS_DIR / 'links.js'))
+        return page_content, meta, screenshot, page.url, title, links
+
+    async def produce() -> dict:
+        # open a new page in an incognito (or the persistent) browser context
+        async with semaphore:
+            page_content, meta, screenshot, page_url, title, links = await render(
+                browsers, persistent, browser_params, proxy_params, scrape
             )
-            page_content = await page.content()
-            screenshot = await get_screenshot(page) if params.screenshot else None
-            page_url = page.url
-            title = await page.title()
 
-            # evaluating JavaScript: parse DOM and extract links of articles
-            parser_args = {}
-            with open(PARSER_SCRIPTS_DIR / 'links.js', encoding='utf-8') as f:
-                links = await page.evaluate(f.read() % parser_args)
+        # parser error: links are not extracted, result has 'err' field
+        if 'err' in links:
+            raise LinksParsingError(page_url, links['err'])
+
+        # filtering and grouping of links is CPU-bound, it runs outside the event loop
+        links = await processing.run(
+            process_links,
+            links,
+            tldextract.extract(url.url).domain,
+            link_parser_params.text_len_threshold,
+            link_parser_params.words_threshold,
+        )
 
-    # parser error: links are not extracted, result has 'err' field
-    if 'err' in links:
-        raise LinksParsingError(page_url, links['err'])
+        # set common fields
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()  # ISO 8601 format
+        domain = tldextract.extract(page_url).registered_domain
+
+        r = {
+            'id': r_id,
+            'url': page_url,
+            'domain': domain,
+            'date': now,
+            'resultUri': f'{host_url}/result/{r_id}',
+            'query': query_dict,
+            'links': links,
+            'title': title,
+            'meta': meta,
+        }
+
+        if params.full_content:
+            r['fullContent'] = page_content
+        if params.screenshot:
+            r['screenshotUri'] = f'{host_url}/screenshot/{r_id}'
+
+        # save result to disk
+        await cache.dump_result(r, key=r_id, screenshot=screenshot)
+        return r
+
+    # get cache data if exists
+    if params.cache:
+        cached = await cache.load_cached(key=r_id)
+        if cached:
+            freshness = cache.freshness(cached.date, params.max_age, params.stale_while_revalidate)
+            if freshness == cache.Freshness.STALE:
+                # the stale result is returned at once, the cache is refreshed in the background
+                flights.revalidate(r_id, produce, semaphore)
+            if freshness != cache.Freshness.EXPIRED:
+                # sent as stored, it's not decoded and validated against the response model again
+                return conditional.result_response(request, cached, r_id, str(host_url))
+
+    # identical requests in flight share one render
+    return await flights.do(r_id, produce)
+
+
+def process_links(links: list[dict], domain: str, text_len_threshold: int, words_threshold: int) -> list[dict]:
+    # runs in a worker process of the processing pool
 
     # filter links by domain
-    domain = tldextract.extract(url.url).domain
     links = [x for x in links if allowed_domain(x['href'], domain)]
 
     links_dict = group_links(links)
@@ -113,8 +176,8 @@ async def parser_links(
     for _, group in links_dict.items():
         stat = get_stat(
             group,
-            text_len_threshold=link_parser_params.text_len_threshold,
-            words_threshold=link_parser_params.words_threshold,
+            text_len_threshold=text_len_threshold,
+            words_threshold=words_threshold,
         )
         if stat['approved']:
             links.extend(group)
@@ -122,32 +185,7 @@ async def parser_links(
     # sort links by 'pos' field, to show links in the same order as they are on the page
     # ('pos' is position of link in DOM)
     links.sort(key=itemgetter('pos'))
-    links = list(map(util.improve_link, map(link_fields, links)))
-
-    # set common fields
-    now = datetime.datetime.now(datetime.timezone.utc).isoformat()  # ISO 8601 format
-    domain = tldextract.extract(page_url).registered_domain
-
-    r = {
-        'id': r_id,
-        'url': page_url,
-        'domain': domain,
-        'date': now,
-        'resultUri': f'{host_url}/result/{r_id}',
-        'query': query_dict,
-        'links': links,
-        'title': title,
-        'meta': util.social_meta_tags(page_content),
-    }
-
-    if params.full_content:
-        r['fullContent'] = page_content
-    if params.screenshot:
-        r['screenshotUri'] = f'{host_url}/screenshot/{r_id}'
-
-    # save result to disk
-    cache.dump_result(r, key=r_id, screenshot=screenshot)
-    return r
+    return list(map(util.improve_link, map(link_fields, links)))
 
 
 def allowed_domain(href: str, domain: str) -> bool:
@@ -5,8 +5,11 @@ from typing import Annotated
 from fastapi import APIRouter, Query
 from fastapi.requests import Request
 from pydantic import BaseModel
-from playwright.async_api import Browser
 
+from internal import cache, subresources
+from internal.janitor import janitor
+from internal.singleflight import flights
+from internal.cluster import BrowserCluster
 from settings import REVISION, BROWSER_CONTEXT_LIMIT
 
 
@@ -19,7 +22,20 @@ class PingData(BaseModel):
     browserContextLimit: Annotated[int, Query(description='the maximum number of browser contexts (aka tabs)')]
     browserContextUsed: Annotated[int, Query(description='the number of all open browser contexts')]
     availableSlots: Annotated[int, Query(description='the number of available browser contexts')]
-    isConnected: Annotated[bool, Query(description='indicates that the browser is connected')]
+    contextPool: Annotated[dict, Query(description='warm context pool stats (hits, misses, evictions, idle contexts)')]
+    isConnected: Annotated[bool, Query(description='indicates that all browser instances are connected')]
+    browserCrashes: Annotated[int, Query(description='the number of browser crashes (unexpected disconnects)')]
+    browserRestarts: Annotated[int, Query(description='the number of successful browser relaunches after a crash')]
+    browserRecycles: Annotated[int, Query(description='the number of browsers replaced by the recycling policy')]
+    retriedRequests: Annotated[int, Query(description='the number of in-flight requests retried after a crash')]
+    subresourceCache: Annotated[dict, Query(description='subresource cache stats (hits, misses, hit ratio, size)')]
+    resultCache: Annotated[dict, Query(description='result cache stats per tier (hits, misses, size, evictions)')]
+    singleFlight: Annotated[
+        dict, Query(description='identical requests coalesced into one render (in this worker, across workers)')
+    ]
+    postprocessing: Annotated[dict, Query(description='post-processing pool stats (queue, queue wait, timeouts)')]
+    instances: Annotated[list[dict], Query(description='per-instance usage of the browser processes')]
+    persistentContext: Annotated[dict, Query(description='usage of the shared persistent context (incognito=no)')]
     now: Annotated[datetime.datetime, Query(description='UTC time now')]
     revision: Annotated[str, Query(description='the scrapper revision')]
 
@@ -29,18 +45,29 @@ async def ping(request: Request) -> dict:
     """
     The ping endpoint checks if the Scrapper is running, both from Docker and externally.
     """
-    browser: Browser = request.state.browser
+    browsers: BrowserCluster = request.state.browsers
     semaphore: asyncio.Semaphore = request.state.semaphore
 
     now = datetime.datetime.now(datetime.timezone.utc)
 
     return {
-        'browserType': browser.browser_type.name,
-        'browserVersion': browser.version,
+        'browserType': browsers.browser.browser_type.name,
+        'browserVersion': browsers.browser.version,
         'browserContextLimit': BROWSER_CONTEXT_LIMIT,
-        'browserContextUsed': len(browser.contexts),
+        'browserContextUsed': browsers.contexts_count(),
         'availableSlots': semaphore._value,
-        'isConnected': browser.is_connected(),
+        'contextPool': browsers.pool_stats(),
+        'isConnected': browsers.is_connected(),
+        'browserCrashes': browsers.crashes(),
+        'browserRestarts': browsers.restarts(),
+        'browserRecycles': browsers.recycles(),
+        'retriedRequests': browsers.retries,
+        'subresourceCache': subresources.cache.stats(),
+        'resultCache': {'memory': cache.memory.stats(), 'disk': {**cache.disk.stats(), **janitor.stats()}},
+        'singleFlight': flights.stats(),
+        'postprocessing': request.state.processing.stats(),
+        'instances': browsers.stats(),
+        'persistentContext': request.state.persistent_context.stats(),
         'now': now,
         'revision': REVISION,
     }
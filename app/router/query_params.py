@@ -1,3 +1,4 @@
+import json
 from enum import Enum
 from email.errors import MessageParseError
 from email.parser import Parser as HeaderParser
@@ -8,10 +9,19 @@ import validators
 
 from fastapi import Query
 
+from internal import cache
+from internal.blocking import blocked_domains
 from internal.errors import QueryParsingError
+from internal.scripts import script_exists
 from settings import USER_SCRIPTS_DIR, DEVICE_REGISTRY
 
 
+# parameters that don't change the result, they are not part of the result ID
+NON_KEY_PARAMS = frozenset(('cache', 'max_age', 'stale_while_revalidate'))
+# list parameters whose order doesn't matter
+UNORDERED_PARAMS = frozenset(('resource', 'block_urls'))
+
+
 class WaitUntilEnum(str, Enum):
     LOAD = 'load'
     DOMCONTENTLOADED = 'domcontentloaded'
@@ -49,6 +59,29 @@ class CommonQueryParams:
                 ),
             ),
         ] = False,
+        max_age: Annotated[
+            int | None,
+            Query(
+                alias='max-age',
+                description=(
+                    'Maximum age of a cached result in seconds, older results are not returned from cache. '
+                    'Used only with `cache`. By default, a cached result is returned regardless of its age.<br><br>'
+                ),
+                ge=0,
+            ),
+        ] = None,
+        stale_while_revalidate: Annotated[
+            int,
+            Query(
+                alias='stale-while-revalidate',
+                description=(
+                    'Used with `cache` and `max-age`: a cached result that is older than `max-age` by no more than '
+                    'this number of seconds is still returned at once, and the page is scraped again in the background '
+                    'to refresh the cache.<br><br>'
+                ),
+                ge=0,
+            ),
+        ] = 0,
         full_content: Annotated[
             bool,
             Query(
@@ -97,6 +130,8 @@ class CommonQueryParams:
         ] = 0,
     ):
         self.cache = cache
+        self.max_age = max_age
+        self.stale_while_revalidate = stale_while_revalidate
         self.full_content = full_content
         self.screenshot = screenshot
         self.user_scripts = None
@@ -107,7 +142,7 @@ class CommonQueryParams:
             if user_scripts:
                 # check if all files exist
                 for script in user_scripts:
-                    if not (USER_SCRIPTS_DIR / script).exists():
+                    if not script_exists(USER_SCRIPTS_DIR / script):
                         raise QueryParsingError('user_scripts', 'User script not found', script)
                 self.user_scripts = user_scripts
 
@@ -121,7 +156,12 @@ class BrowserQueryParams:
             bool,
             Query(
                 description='Allows creating `incognito` browser contexts. '
-                "Incognito browser contexts don't write any browsing data to disk.<br><br>",
+                "Incognito browser contexts don't write any browsing data to disk.<br>"
+                'With `incognito=no` all requests share one persistent context opened with the default settings: '
+                'only `viewport-width`, `viewport-height` and `extra-http-headers` may be set, '
+                'other browser and proxy settings that differ from the defaults are rejected (422). '
+                'On Firefox and WebKit, only one of the `UVICORN_WORKERS` serves these requests, '
+                'the others respond with 503.<br><br>',
             ),
         ] = True,
         timeout: Annotated[
@@ -152,11 +192,46 @@ class BrowserQueryParams:
             Query(
                 description='Waits for the given timeout in milliseconds before parsing the article, and after the page has loaded.<br>'
                 'In many cases, a sleep timeout is not necessary. However, for some websites, it can be quite useful.<br>'
-                'Other waiting mechanisms, such as waiting for selector visibility, are not currently supported.<br>'
+                'Prefer `wait-for-selector`, `wait-for-dom-idle` or `wait-for-network-idle`, they finish as soon as the page is ready.<br>'
                 'The default value is 0, which means no sleep.<br><br>',
                 ge=0,
             ),
         ] = 0,
+        wait_for_selector: Annotated[
+            str | None,
+            Query(
+                alias='wait-for-selector',
+                description='Waits until an element matching the given CSS selector is attached to the DOM.<br>'
+                'The wait is capped by `wait-timeout`.<br><br>',
+            ),
+        ] = None,
+        wait_for_dom_idle: Annotated[
+            int,
+            Query(
+                alias='wait-for-dom-idle',
+                description='Waits until the DOM has not changed for the given number of milliseconds.<br>'
+                'The wait is capped by `wait-timeout`. The default value is 0, which means no wait.<br><br>',
+                ge=0,
+            ),
+        ] = 0,
+        wait_for_network_idle: Annotated[
+            int,
+            Query(
+                alias='wait-for-network-idle',
+                description='Waits until there have been no network requests in flight for the given number of milliseconds.<br>'
+                'The wait is capped by `wait-timeout`. The default value is 0, which means no wait.<br><br>',
+                ge=0,
+            ),
+        ] = 0,
+        wait_timeout: Annotated[
+            int,
+            Query(
+                alias='wait-timeout',
+                description='Overall cap in milliseconds for `wait-for-selector`, `wait-for-dom-idle` and `wait-for-network-idle`.<br>'
+                'When the cap is reached, the page is processed as it is. The default value is 10000 (10 seconds).<br><br>',
+                ge=1,
+            ),
+        ] = 10000,
         resource: Annotated[
             str | None,
             Query(
@@ -179,6 +254,23 @@ class BrowserQueryParams:
                 'By default, all resource types are allowed.',
             ),
         ] = None,
+        block_urls: Annotated[
+            str | None,
+            Query(
+                alias='block-urls',
+                description='Comma-separated list of URL patterns to block, for example `*.png, *://*.example.com/ads/*`.<br>'
+                'The `*` wildcard matches any sequence of characters, other characters (including `?`) match themselves. '
+                'A pattern must match the whole URL.<br><br>',
+            ),
+        ] = None,
+        block_trackers: Annotated[
+            bool,
+            Query(
+                alias='block-trackers',
+                description='Block requests to the tracker and ad domains from the server-side list (the `BLOCKED_DOMAINS` file).<br>'
+                'Subdomains of a listed domain are blocked too.<br><br>',
+            ),
+        ] = False,
         viewport_width: Annotated[
             int | None,
             Query(
@@ -237,7 +329,8 @@ class BrowserQueryParams:
                     'This is particularly useful when dealing with lazy-loading pages '
                     '(pages that are loaded only as you scroll down).<br>'
                     'This parameter is used in conjunction with the `sleep` parameter.<br>'
-                    "Make sure to set a positive value for the `sleep` parameter, otherwise, the scroll function won't work.<br><br>"
+                    "Make sure to set a positive value for the `sleep` parameter, otherwise, the scroll function won't work.<br>"
+                    'Scrolling (and sleeping) stops early once the page height stops growing.<br><br>'
                 ),
                 ge=0,
             ),
@@ -277,7 +370,8 @@ class BrowserQueryParams:
             Query(
                 alias='http-credentials',
                 description='Credentials for HTTP authentication '
-                '(string containing username and password separated by a colon, e.g. `username:password`).',
+                '(string containing username and password separated by a colon, e.g. `username:password`).<br>'
+                'Not supported with a persistent context (`incognito=no`).',
             ),
         ] = None,
         extra_http_headers: Annotated[
@@ -293,7 +387,13 @@ class BrowserQueryParams:
         self.timeout = timeout
         self.wait_until = wait_until
         self.sleep = sleep
+        self.wait_for_selector = wait_for_selector or None
+        self.wait_for_dom_idle = wait_for_dom_idle
+        self.wait_for_network_idle = wait_for_network_idle
+        self.wait_timeout = wait_timeout
         self.resource = None
+        self.block_urls = None
+        self.block_trackers = block_trackers
         self.viewport_width = viewport_width
         self.viewport_height = viewport_height
         self.screen_width = screen_width
@@ -312,6 +412,14 @@ class BrowserQueryParams:
             if resource:
                 self.resource = resource
 
+        if block_urls:
+            block_urls = list(filter(None, map(str.strip, block_urls.split(','))))
+            if block_urls:
+                self.block_urls = block_urls
+
+        if block_trackers and not len(blocked_domains()):
+            raise QueryParsingError('block_trackers', 'The list of blocked domains is empty', block_trackers)
+
         if device not in DEVICE_REGISTRY:
             raise QueryParsingError('device', 'Device not found', device)
 
@@ -444,3 +552,24 @@ class LinkParserQueryParams:
     ):
         self.text_len_threshold = text_len_threshold
         self.words_threshold = words_threshold
+
+
+def result_key(endpoint: str, url: URLParam, *params) -> str:
+    """
+    Unique result ID of a request, derived from the parsed parameters rather than the query string.
+    The order of the query parameters, parameters left at their defaults and the parameters
+    that don't change the result (e.g. `cache`) don't affect the ID.
+    """
+    key = {'endpoint': endpoint, 'url': url.url}
+    for p in params:
+        values = {}
+        for name, value in vars(p).items():
+            if name in NON_KEY_PARAMS:
+                continue
+            if name in UNORDERED_PARAMS and value:
+                value = sorted(set(value))
+            elif name == 'extra_http_headers' and value:
+                value = {k.lower(): v for k, v in value.items()}  # header names are case-insensitive
+            values[name] = value
+        key[type(p).__name__] = values
+    return cache.make_key(json.dumps(key, sort_keys=True, ensure_ascii=False))
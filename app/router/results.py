@@ -2,12 +2,13 @@ from typing import Annotated
 
 from fastapi import APIRouter, Path, HTTPException, status
 from fastapi.requests import Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.templating import Jinja2Templates
 
-from internal import cache
+from internal import cache, util
 from settings import REVISION, TEMPLATES_DIR, SCREENSHOT_TYPE
 from server.auth import AuthRequired
+from . import conditional
 
 
 router = APIRouter(tags=['results'])
@@ -20,7 +21,7 @@ async def result_html(
     r_id: Annotated[str, Path(title='Result ID', description='Unique result ID')],
     _: AuthRequired,
 ):
-    data = cache.load_result(key=r_id)
+    data = await cache.load_result(key=r_id)
     if not data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Not found result with id: {r_id}')
 
@@ -30,21 +31,37 @@ async def result_html(
 
 @router.get('/result/{r_id}', include_in_schema=False)
 async def result_json(
+    request: Request,
     r_id: Annotated[str, Path(title='Result ID', description='Unique result ID')],
     _: AuthRequired,
 ):
-    data = cache.load_result(key=r_id)
-    if not data:
+    # the result is sent as stored, without decoding and encoding it again
+    cached = await cache.load_cached(key=r_id)
+    if not cached:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Not found result with id: {r_id}')
-    return data
+    host_url, _, _ = util.split_url(request.url)
+    return conditional.result_response(request, cached, r_id, str(host_url))
 
 
 @router.get('/screenshot/{r_id}', response_class=FileResponse, include_in_schema=False)
 async def result_screenshot(
+    request: Request,
     r_id: Annotated[str, Path(title='Result ID', description='Unique result ID')],
     _: AuthRequired,
 ):
-    path = cache.screenshot_location(r_id)
-    if not path.exists():
+    # the screenshot is saved along with the result, it has the validators of the result
+    cached = await cache.load_cached(key=r_id, content=False)
+    if not cached:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Not found result with id: {r_id}')
+    headers = conditional.validators(f'"{cached.digest}.{SCREENSHOT_TYPE.value}"', cached.date)
+    if conditional.not_modified(request, headers, cached.date):
+        return Response(status_code=304, headers=headers)
+
+    media_type = f'image/{SCREENSHOT_TYPE.value}'
+    screenshot = await cache.load_screenshot(r_id)
+    if not screenshot:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Not found result with id: {r_id}')
-    return FileResponse(path, media_type=f'image/{SCREENSHOT_TYPE.value}')
+    if isinstance(screenshot, bytes):
+        return conditional.range_response(request, screenshot, media_type, headers)
+    # ranges of a file are sent by FileResponse
+    return FileResponse(screenshot, media_type=media_type, headers=headers)
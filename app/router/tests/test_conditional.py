@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from internal import cache
+from internal.storage import FileStorage, SQLiteStorage
+from main import app
+
+
+DATE = datetime.datetime(2024, 5, 1, 12, 30, 15, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture(params=['files', 'sqlite'])
+def result_id(request, monkeypatch, tmp_path):
+    if request.param == 'files':
+        storage = FileStorage(tmp_path)
+    else:
+        storage = SQLiteStorage(tmp_path / 'res.sqlite3')
+    monkeypatch.setattr(cache, 'storage', storage)
+    monkeypatch.setattr(cache, 'memory', cache.MemoryTier(max_size=0))
+
+    key = cache.make_key('http://example.com/conditional')
+    data = {
+        'id': key,
+        'date': DATE.isoformat(),
+        'resultUri': f'http://testserver/result/{key}',
+        'screenshotUri': f'http://testserver/screenshot/{key}',
+    }
+    asyncio.run(cache.dump_result(data, key=key, screenshot=b'0123456789'))
+    yield key
+    storage.close()
+
+
+def test_result_not_modified(result_id):
+    client = TestClient(app)  # the results don't need the browsers, the app isn't started
+    response = client.get(f'/result/{result_id}')
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    assert response.headers['last-modified'] == 'Wed, 01 May 2024 12:30:15 GMT'
+
+    response = client.get(f'/result/{result_id}', headers={'if-none-match': f'"other", {etag}'})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+
+    response = client.get(f'/result/{result_id}', headers={'if-modified-since': 'Wed, 01 May 2024 12:30:15 GMT'})
+    assert response.status_code == 304
+    response = client.get(f'/result/{result_id}', headers={'if-modified-since': 'Wed, 01 May 2024 12:30:14 GMT'})
+    assert response.status_code == 200
+
+    # the result for another host has other URIs, and another ETag
+    response = client.get(f'/result/{result_id}', headers={'host': 'scrapper.example', 'if-none-match': etag})
+    assert response.status_code == 200
+    assert response.json()['resultUri'] == f'http://scrapper.example/result/{result_id}'
+    assert response.headers['etag'] != etag
+
+    # a hostile Host header doesn't add fields to the result
+    response = client.get(f'/result/{result_id}', headers={'host': 'a","x":"1'})
+    assert response.status_code == 200
+    assert 'x' not in response.json()
+
+
+def test_screenshot_range(result_id):
+    client = TestClient(app)
+    response = client.get(f'/screenshot/{result_id}')
+    assert response.status_code == 200
+    assert response.content == b'0123456789'
+    assert response.headers['accept-ranges'] == 'bytes'
+    etag = response.headers['etag']
+
+    response = client.get(f'/screenshot/{result_id}', headers={'if-none-match': etag})
+    assert response.status_code == 304
+
+    response = client.get(f'/screenshot/{result_id}', headers={'range': 'bytes=2-4'})
+    assert response.status_code == 206
+    assert response.content == b'234'
+    assert response.headers['content-range'] == 'bytes 2-4/10'
+
+    response = client.get(f'/screenshot/{result_id}', headers={'range': 'bytes=-3', 'if-range': etag})
+    assert response.status_code == 206
+    assert response.content == b'789'
+
+    # the screenshot has changed since, it's sent whole
+    response = client.get(f'/screenshot/{result_id}', headers={'range': 'bytes=-3', 'if-range': '"old"'})
+    assert response.status_code == 200
+    assert response.content == b'0123456789'
+
+    response = client.get(f'/screenshot/{result_id}', headers={'range': 'bytes=20-'})
+    assert response.status_code == 416
@@ -1,6 +1,14 @@
 from fastapi.testclient import TestClient
 
 from main import app
+from router.query_params import (
+    URLParam,
+    CommonQueryParams,
+    BrowserQueryParams,
+    ProxyQueryParams,
+    ReadabilityQueryParams,
+    result_key,
+)
 from settings import USER_SCRIPTS_DIR
 
 
@@ -130,3 +138,35 @@ def test_various_query_params():
                 }
             ]
         }
+
+
+def test_result_key():
+    url = URLParam('https://example.com/news')
+
+    def key(common=None, browser=None, readability=None, endpoint='/api/article'):
+        return result_key(
+            endpoint,
+            url,
+            common or CommonQueryParams(),
+            browser or BrowserQueryParams(),
+            ProxyQueryParams(),
+            readability or ReadabilityQueryParams(),
+        )
+
+    default = key()
+    # cache doesn't change the result, defaults spelled out are the same as omitted
+    assert key(common=CommonQueryParams(cache=True)) == default
+    assert key(browser=BrowserQueryParams(sleep=0, device='Desktop Chrome')) == default
+    assert key(readability=ReadabilityQueryParams(char_threshold=500)) == default
+    # the order of resource types and the case of header names don't matter
+    assert key(browser=BrowserQueryParams(resource='document, script')) == key(
+        browser=BrowserQueryParams(resource='script,document,script')
+    )
+    assert key(browser=BrowserQueryParams(extra_http_headers=['X-Api-Key: 1'])) == key(
+        browser=BrowserQueryParams(extra_http_headers=['x-api-key: 1'])
+    )
+
+    assert key(common=CommonQueryParams(full_content=True)) != default
+    assert key(browser=BrowserQueryParams(sleep=1000)) != default
+    assert key(readability=ReadabilityQueryParams(char_threshold=100)) != default
+    assert key(endpoint='/api/page') != default
@@ -71,6 +71,12 @@ def _get_result(api_url: str, url: str):
         assert response.status_code == 200
         assert response.json() == data
 
+        # the URIs of a cached result point to the host it's requested from
+        response = client.get(api_url, params=params, headers={'host': 'scrapper.example'})
+        assert response.status_code == 200
+        assert response.json()['resultUri'] == f'http://scrapper.example/result/{data["id"]}'
+        assert response.json()['screenshotUri'] == f'http://scrapper.example/screenshot/{data["id"]}'
+
         # get html result view
         response = client.get(f'/view/{data["id"]}')
         assert response.status_code == 200
@@ -1,50 +1,14 @@
 
-() => {
-    function findComments(el) {
-        let arr = [];
-        for (let i = 0; i < el.childNodes.length; i++) {
-            let node = el.childNodes[i];
-            // 8 is the Node.COMMENT_NODE constant
-            // https://developer.mozilla.org/en-US/docs/Web/API/Node/nodeType
-            if(node.nodeType === 8) {
-                arr.push(node);
-            } else {
-                // recursively search for comments in child nodes
-                arr.push.apply(arr, findComments(node));
-            }
-        }
-        return arr;
-    };
-
+(options) => {
     try {
-        // mark elements that are not visible
-        let elements = document.body.getElementsByTagName("*");
-        for (let i = 0; i < elements.length; i++) {
-            let style = window.getComputedStyle(elements[i]);
-            if (style.display === "none" ||
-                style.visibility === "hidden" ||
-                style.opacity === "0" ||
-                style.opacity === "0.0" ||
-                (style.height === "0px" && style.width === "0px") ||
-                (style.height === "1px" && style.width === "1px")) {
-                elements[i].classList.add("scrapper-hidden");
-            }
-        }
-        // remove invisible elements
-        document.querySelectorAll(".scrapper-hidden").forEach(el => el.remove());
-
-        // find and remove comments
-        findComments(document.body).forEach(el => el.remove());
+        // invisible elements and comments are already removed by clean.js
 
         // parse the article with Mozilla's Readability.js (https://videoinu.com/blog/firefox-reader-view-heuristics/)
-        let documentClone = document.cloneNode(true);
+        // the page is already captured (content, screenshot) and is closed after parsing,
+        // so Readability may modify the document itself instead of a deep clone
         // https://github.com/mozilla/readability#api-reference
-        let options = {
-          maxElemsToParse: %(maxElemsToParse)d,
-          nbTopCandidates: %(nbTopCandidates)d,
-          charThreshold: %(charThreshold)d,
-        }
-        return new Readability(documentClone, options).parse();
+        // options: maxElemsToParse, nbTopCandidates, charThreshold
+        return new Readability(document, options).parse();
     } catch(err) {
         return { err: "Readability couldn't parse the page: " + err.toString() };
     }
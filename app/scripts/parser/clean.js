@@ -0,0 +1,50 @@
+(options) => {
+    // options: checkSize (also remove 0x0 and 1x1 elements), removeComments, maxNodes
+    function isHidden(el) {
+        let style = window.getComputedStyle(el);
+        if (style.display === "none" ||
+            style.visibility === "hidden" ||
+            style.opacity === "0" ||
+            style.opacity === "0.0") {
+            return true;
+        }
+        return options.checkSize && (
+            (style.height === "0px" && style.width === "0px") ||
+            (style.height === "1px" && style.width === "1px"));
+    };
+
+    // move to the next node that is not a descendant of the current one
+    function skipSubtree(walker) {
+        let next = walker.nextSibling();
+        while (!next && walker.parentNode()) {
+            next = walker.nextSibling();
+        }
+        return next;
+    };
+
+    try {
+        let whatToShow = NodeFilter.SHOW_ELEMENT | (options.removeComments ? NodeFilter.SHOW_COMMENT : 0);
+        let walker = document.createTreeWalker(document.body, whatToShow);
+        let nodes = [];
+        let examined = 0;
+
+        // the DOM isn't changed during the walk, so the styles are computed only once
+        let node = walker.nextNode();
+        while (node && examined < options.maxNodes) {
+            examined++;
+            // 8 is the Node.COMMENT_NODE constant
+            if (node.nodeType === 8 || isHidden(node)) {
+                nodes.push(node);
+                // the whole subtree is removed, there's no need to look inside
+                node = skipSubtree(walker);
+            } else {
+                node = walker.nextNode();
+            }
+        }
+
+        nodes.forEach(el => el.remove());
+        return { examined: examined, removed: nodes.length, truncated: node !== null };
+    } catch(err) {
+        return { err: "The page couldn't be cleaned: " + err.toString() };
+    }
+}
@@ -24,25 +24,13 @@
     let restrictedHrefs = ["", "/", "#", "javascript:void(0)", "javascript:;"];
 
     try {
-        // mark elements that are not visible
-        let elements = document.body.getElementsByTagName("*");
-        for (let i = 0; i < elements.length; i++) {
-            let style = window.getComputedStyle(elements[i]);
-            if (style.display === "none" ||
-                style.visibility === "hidden" ||
-                style.opacity === "0" ||
-                style.opacity === "0.0") {
-                elements[i].classList.add("scrapper-hidden");
-            }
-        }
-        // remove marked elements
-        document.querySelectorAll(".scrapper-hidden").forEach(el => el.remove());
+        // invisible elements are already removed by clean.js
 
         // traverse the DOM tree and extract links
         let links = [];
         let seenTexts = new Set();
         let seenHrefs = new Set();
-        elements = document.body.getElementsByTagName("A");
+        let elements = document.body.getElementsByTagName("A");
 
         for (let i = 0; i < elements.length; i++) {
             let text = elements[i].innerText.trim();
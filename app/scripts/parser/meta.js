@@ -0,0 +1,26 @@
+() => {
+    // social meta tags: open graph (<meta property="og:...">) and twitter (<meta name="twitter:...">)
+    let og = {};
+    let twitter = {};
+    let elements = document.getElementsByTagName("meta");
+    for (let i = 0; i < elements.length; i++) {
+        let el = elements[i];
+        if (!el.hasAttribute("content")) continue;
+        let content = el.getAttribute("content");
+
+        let property = el.getAttribute("property");
+        if (property && property.startsWith("og:") && property.length > 3) {
+            og[property.slice(3)] = content;
+        }
+
+        let name = el.getAttribute("name");
+        if (name && name.startsWith("twitter:") && name.length > 8) {
+            twitter[name.slice(8)] = content;
+        }
+    }
+
+    let res = {};
+    if (Object.keys(og).length) res.og = og;
+    if (Object.keys(twitter).length) res.twitter = twitter;
+    return res;
+}
@@ -5,17 +5,79 @@ from pathlib import Path
 from typing import TypedDict
 
 from fastapi import FastAPI
-from playwright.async_api import async_playwright, Browser, BrowserType
+
+from internal.blocking import blocked_domains
+from internal.browser import context_options
+from internal.cluster import BrowserCluster, BrowserInstance
+from internal.janitor import janitor
+from internal import cache, scripts, subresources
+from internal.logger import get_logger
+from internal.offload import ProcessingPool
+from internal.persistent import PersistentContext
+from internal.singleflight import flights
+from router.query_params import BrowserQueryParams, ProxyQueryParams
 import settings
 
 
+RECYCLE_CHECK_INTERVAL = 5  # seconds between checks of the browser recycling policy
+JANITOR_INTERVAL = 10  # seconds between sweeps of a few shards of the result cache
+
+
 class State(TypedDict):
     # https://playwright.dev/python/docs/api/class-browsertype
-    browser: Browser
+    browsers: BrowserCluster
+    persistent_context: PersistentContext
+    processing: ProcessingPool
     semaphore: asyncio.Semaphore
     basic_auth_credentials: dict[str, str] | None  # username: bcrypt hash of password
 
 
+async def supervise(instance: BrowserInstance, backoff_max: float) -> None:
+    """
+    Relaunch the browser of the given instance every time it disconnects (crashes),
+    retrying with exponential backoff until the browser is up again.
+    """
+    logger = get_logger()
+    while True:
+        await instance.disconnected.wait()
+        instance.crashes += 1
+        logger.warning(f'Browser instance {instance.index} has disconnected, relaunching')
+
+        delay = 1
+        while True:
+            try:
+                await instance.relaunch()
+            except Exception as exc:
+                logger.error(f'Browser instance {instance.index} relaunch failed, next try in {delay}s: {exc}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, backoff_max)
+            else:
+                logger.info(f'Browser instance {instance.index} has been relaunched')
+                break
+
+
+async def recycle(browsers: BrowserCluster, interval: float) -> None:
+    """
+    Replace long-running browsers to bound memory growth. A replacement is launched first,
+    then the old browser is closed once its in-flight contexts are finished.
+    """
+    logger = get_logger()
+    while True:
+        await asyncio.sleep(interval)
+        for instance in browsers.instances:
+            try:
+                reason = await instance.recycle_reason(
+                    max_contexts=settings.BROWSER_RECYCLE_CONTEXTS,
+                    max_uptime=settings.BROWSER_RECYCLE_UPTIME,
+                    max_rss=settings.BROWSER_RECYCLE_RSS_MB * 2**20,
+                )
+                if reason:
+                    logger.info(f'Browser instance {instance.index} is being recycled: {reason}')
+                    await instance.recycle()
+            except Exception as exc:
+                logger.error(f'Browser instance {instance.index} recycling failed: {exc}')
+
+
 @contextlib.asynccontextmanager
 async def lifespan(_: FastAPI):
     creds = None
@@ -29,13 +91,65 @@ async def lifespan(_: FastAPI):
 
     # browser set up
     os.makedirs(settings.USER_SCRIPTS_DIR, exist_ok=True)
+    scripts.registry.load()
+    blocked_domains()  # load the list of blocked domains before the first request
+    subresources.cache.load()
+    cache.open_cache()
+    cache.codec()  # warn at startup if the configured compression is not available
     semaphore = asyncio.Semaphore(settings.BROWSER_CONTEXT_LIMIT)
+    # context options for the default query parameters
+    options = context_options(settings.BROWSER_TYPE.value, BrowserQueryParams(), ProxyQueryParams())
+
+    # each browser instance has its own Playwright connection and context pool
+    browsers = BrowserCluster(
+        size=settings.BROWSER_INSTANCES,
+        browser_type=settings.BROWSER_TYPE.value,
+        pool_size=settings.BROWSER_CONTEXT_POOL_SIZE,
+        pool_idle_timeout=settings.BROWSER_CONTEXT_POOL_IDLE_TIMEOUT,
+        pool_max_idle=settings.BROWSER_CONTEXT_POOL_MAX_IDLE,
+        warm_up_options=options,
+    )
+    # the persistent context is opened once and shared by all non-incognito requests
+    persistent = PersistentContext(
+        browser_type=settings.BROWSER_TYPE.value,
+        user_data_dir=settings.USER_DATA_DIR,
+        limit=settings.PERSISTENT_CONTEXT_LIMIT,
+        options=options,
+        shared=settings.WORKERS > 1,
+    )
+
+    # CPU-bound post-processing of pages runs outside the event loop
+    processing = ProcessingPool(
+        workers=settings.POSTPROCESS_WORKERS,
+        queue_size=settings.POSTPROCESS_QUEUE_SIZE,
+        timeout=settings.POSTPROCESS_TIMEOUT,
+    )
+
+    tasks = []
+    try:
+        processing.start()
+        await browsers.start()
+        await persistent.start()
+        for instance in browsers.instances:
+            tasks.append(asyncio.create_task(supervise(instance, backoff_max=settings.BROWSER_RESTART_BACKOFF_MAX)))
+        tasks.append(asyncio.create_task(recycle(browsers, interval=RECYCLE_CHECK_INTERVAL)))
+        if janitor.enabled:
+            tasks.append(asyncio.create_task(janitor.run(interval=JANITOR_INTERVAL)))
 
-    async with async_playwright() as playwright:
-        browser_type: BrowserType = getattr(playwright, settings.BROWSER_TYPE.value)
-        browser = await browser_type.launch(headless=True)
         yield State(
             basic_auth_credentials=creds,
-            browser=browser,
+            browsers=browsers,
+            persistent_context=persistent,
+            processing=processing,
             semaphore=semaphore,
         )
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await persistent.close()
+        await browsers.close()
+        await processing.close()
+        await cache.close_cache()
+        await flights.close()
+        subresources.cache.close()
@@ -5,17 +5,31 @@ import pytest
 from fastapi import FastAPI
 from playwright.async_api import Browser
 
+from internal.cluster import BrowserInstance
 from server import state
-from server.state import lifespan
+from server.state import lifespan, supervise
 
 
 @pytest.fixture
-def mock_settings():
+def mock_settings(tmp_path):
     with mock.patch('server.state.settings') as mock_settings:
         mock_settings.VERSION = 'test_version'
         mock_settings.BASIC_HTPASSWD = None
         mock_settings.BROWSER_TYPE = mock.Mock(value='chromium')
+        mock_settings.BROWSER_INSTANCES = 1
         mock_settings.BROWSER_CONTEXT_LIMIT = 20
+        mock_settings.BROWSER_CONTEXT_POOL_SIZE = 2
+        mock_settings.BROWSER_CONTEXT_POOL_IDLE_TIMEOUT = 60
+        mock_settings.BROWSER_RESTART_BACKOFF_MAX = 30
+        mock_settings.BROWSER_RECYCLE_CONTEXTS = 0
+        mock_settings.BROWSER_RECYCLE_UPTIME = 0
+        mock_settings.BROWSER_RECYCLE_RSS_MB = 0
+        mock_settings.PERSISTENT_CONTEXT_LIMIT = 5
+        mock_settings.USER_DATA_DIR = tmp_path
+        mock_settings.WORKERS = 1
+        mock_settings.POSTPROCESS_WORKERS = 1
+        mock_settings.POSTPROCESS_QUEUE_SIZE = 64
+        mock_settings.POSTPROCESS_TIMEOUT = 30
         yield mock_settings
 
 
@@ -24,8 +38,10 @@ async def test_lifespan_no_credentials(mock_settings):
     app = FastAPI()
     async with lifespan(app) as state_instance:
         assert state_instance['basic_auth_credentials'] is None
-        assert isinstance(state_instance['browser'], Browser)
+        assert isinstance(state_instance['browsers'].browser, Browser)
         assert isinstance(state_instance['semaphore'], asyncio.Semaphore)
+        assert state_instance['browsers'].pool_stats()['idle'] == 2
+        assert state_instance['persistent_context'].owner is True
 
 
 @pytest.mark.asyncio
@@ -35,7 +51,7 @@ async def test_lifespan_with_credentials_file_not_found(mock_settings, tmp_path)
     app = FastAPI()
     async with lifespan(app) as state_instance:
         assert state_instance['basic_auth_credentials'] is None
-        assert isinstance(state_instance['browser'], Browser)
+        assert isinstance(state_instance['browsers'].browser, Browser)
         assert isinstance(state_instance['semaphore'], asyncio.Semaphore)
 
 
@@ -49,11 +65,40 @@ async def test_lifespan_with_credentials_file(mock_settings, tmp_path):
     app = FastAPI()
     async with lifespan(app) as state_instance:
         assert state_instance['basic_auth_credentials'] == {'user1': 'hash1', 'user2': 'hash2'}
-        assert isinstance(state_instance['browser'], Browser)
+        assert isinstance(state_instance['browsers'].browser, Browser)
         assert isinstance(state_instance['semaphore'], asyncio.Semaphore)
 
 
 def test_state_typed_dict():
     # Test that State is a properly defined TypedDict
-    state_dict = state.State(basic_auth_credentials={'user': 'hash'}, browser=mock.Mock(), semaphore=asyncio.Semaphore(1))
+    state_dict = state.State(
+        basic_auth_credentials={'user': 'hash'}, browsers=mock.Mock(), semaphore=asyncio.Semaphore(1)
+    )
     assert state_dict['basic_auth_credentials'] == {'user': 'hash'}
+
+
+@pytest.mark.asyncio
+async def test_supervise_relaunches_crashed_browser():
+    instance = BrowserInstance(0, 'chromium', pool_size=0, pool_idle_timeout=60)
+    attempts = []
+
+    async def relaunch():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('launch failed')  # the first attempt fails, the second one succeeds
+        instance.disconnected.clear()
+        instance.restarts += 1
+
+    instance.relaunch = relaunch
+    task = asyncio.create_task(supervise(instance, backoff_max=1))
+    instance.disconnected.set()
+
+    sleep = asyncio.sleep  # the backoff delay is mocked, but the test still needs to yield to the supervisor
+    with mock.patch('server.state.asyncio.sleep', new=mock.AsyncMock()):
+        for _ in range(10):
+            await sleep(0)
+
+    task.cancel()
+    assert instance.crashes == 1
+    assert instance.restarts == 1
+    assert len(attempts) == 2
@@ -30,6 +30,17 @@ class BrowserType(str, Enum):
     WEBKIT = 'webkit'
 
 
+class CacheCompression(str, Enum):
+    NONE = 'none'
+    GZIP = 'gzip'
+    ZSTD = 'zstd'
+
+
+class CacheBackend(str, Enum):
+    FILES = 'files'
+    SQLITE = 'sqlite'
+
+
 class ScreenshotType(str, Enum):
     JPEG = 'jpeg'
     PNG = 'png'
@@ -51,9 +62,125 @@ class Settings(BaseSettings):
         default=BrowserType.CHROMIUM,
         description='Browser type to use (chromium, firefox, webkit)',
     )
+    browser_instances: PositiveInt = Field(
+        alias='BROWSER_INSTANCES',
+        default=1,
+        description='Number of browser processes per worker, each with its own Playwright connection',
+    )
     browser_context_limit: PositiveInt = Field(
         alias='BROWSER_CONTEXT_LIMIT', default=20, description='Maximum number of browser contexts (aka tabs)'
     )
+    browser_context_pool_size: int = Field(
+        alias='BROWSER_CONTEXT_POOL_SIZE',
+        default=2,
+        description='Maximum number of idle incognito contexts kept warm per set of context options (0 disables the pool)',
+        ge=0,
+    )
+    browser_context_pool_idle_timeout: PositiveInt = Field(
+        alias='BROWSER_CONTEXT_POOL_IDLE_TIMEOUT',
+        default=60,
+        description='Idle incognito contexts are closed after this number of seconds',
+    )
+    browser_context_pool_max_idle: PositiveInt = Field(
+        alias='BROWSER_CONTEXT_POOL_MAX_IDLE',
+        default=8,
+        description='Maximum number of idle incognito contexts per browser instance for all sets of context options, '
+        'the least recently used one is closed first',
+    )
+    browser_restart_backoff_max: PositiveInt = Field(
+        alias='BROWSER_RESTART_BACKOFF_MAX',
+        default=30,
+        description='Maximum delay in seconds between attempts to relaunch a crashed browser',
+    )
+    browser_recycle_contexts: int = Field(
+        alias='BROWSER_RECYCLE_CONTEXTS',
+        default=0,
+        description='Replace a browser after it has served this number of contexts (0 disables the limit)',
+        ge=0,
+    )
+    browser_recycle_uptime: int = Field(
+        alias='BROWSER_RECYCLE_UPTIME',
+        default=0,
+        description='Replace a browser after this number of seconds (0 disables the limit)',
+        ge=0,
+    )
+    browser_recycle_rss_mb: int = Field(
+        alias='BROWSER_RECYCLE_RSS_MB',
+        default=0,
+        description='Replace a browser when its processes use more memory (RSS) in MiB (0 disables the limit)',
+        ge=0,
+    )
+    persistent_context_limit: PositiveInt = Field(
+        alias='PERSISTENT_CONTEXT_LIMIT',
+        default=5,
+        description='Maximum number of pages open at once in the shared persistent context (incognito=no)',
+    )
+    blocked_domains: str = Field(
+        alias='BLOCKED_DOMAINS',
+        default='/.blocked_domains',
+        description='Path to the list of tracker and ad domains blocked with block-trackers (plain, hosts or adblock format)',
+    )
+    subresource_cache_size_mb: int = Field(
+        alias='SUBRESOURCE_CACHE_SIZE_MB',
+        default=0,
+        description='Size of the on-disk cache of static subresources shared by incognito contexts, in MiB (0 disables the cache)',
+        ge=0,
+    )
+    postprocess_workers: int = Field(
+        alias='POSTPROCESS_WORKERS',
+        default=1,
+        description='Number of processes per worker for CPU-bound post-processing of pages (0 runs it in a thread)',
+        ge=0,
+    )
+    postprocess_queue_size: PositiveInt = Field(
+        alias='POSTPROCESS_QUEUE_SIZE',
+        default=64,
+        description='Maximum number of pages waiting for post-processing, further requests are rejected (503)',
+    )
+    postprocess_timeout: PositiveInt = Field(
+        alias='POSTPROCESS_TIMEOUT',
+        default=30,
+        description='Post-processing of a page that takes longer than this number of seconds fails the request (504)',
+    )
+    cache_backend: CacheBackend = Field(
+        alias='CACHE_BACKEND',
+        default=CacheBackend.FILES,
+        description='Storage of the result cache: a file per result (files) or a single SQLite database (sqlite)',
+    )
+    cache_write_behind: bool = Field(
+        alias='CACHE_WRITE_BEHIND',
+        default=False,
+        description='Save results to the disk in the background, the response is returned without waiting for the write',
+    )
+    cache_compression: CacheCompression = Field(
+        alias='CACHE_COMPRESSION',
+        default=CacheCompression.GZIP,
+        description='Compression of cached results (none, gzip or zstd)',
+    )
+    cache_max_size_mb: int = Field(
+        alias='CACHE_MAX_SIZE_MB',
+        default=0,
+        description='Maximum size of the result cache in MiB, the least recently used results are evicted (0 is unlimited)',
+        ge=0,
+    )
+    cache_max_entries: int = Field(
+        alias='CACHE_MAX_ENTRIES',
+        default=0,
+        description='Maximum number of results in the cache, the least recently used are evicted (0 is unlimited)',
+        ge=0,
+    )
+    cache_max_age: int = Field(
+        alias='CACHE_MAX_AGE',
+        default=0,
+        description='Cached results older than this number of seconds are removed (0 is unlimited)',
+        ge=0,
+    )
+    cache_memory_size_mb: int = Field(
+        alias='CACHE_MEMORY_SIZE_MB',
+        default=64,
+        description='Size of the in-memory tier of the result cache per worker, in MiB (0 disables the tier)',
+        ge=0,
+    )
     screenshot_type: ScreenshotType = Field(
         alias='SCREENSHOT_TYPE', default=ScreenshotType.JPEG, description='Screenshot type (jpeg or png)'
     )
@@ -131,7 +258,28 @@ AUTH_ENABLED = Path(BASIC_HTPASSWD).exists()
 
 # browser settings
 BROWSER_TYPE = _settings.browser_type
+BROWSER_INSTANCES = _settings.browser_instances
 BROWSER_CONTEXT_LIMIT = _settings.browser_context_limit
+BROWSER_CONTEXT_POOL_SIZE = _settings.browser_context_pool_size
+BROWSER_CONTEXT_POOL_IDLE_TIMEOUT = _settings.browser_context_pool_idle_timeout
+BROWSER_CONTEXT_POOL_MAX_IDLE = _settings.browser_context_pool_max_idle
+BROWSER_RESTART_BACKOFF_MAX = _settings.browser_restart_backoff_max
+BROWSER_RECYCLE_CONTEXTS = _settings.browser_recycle_contexts
+BROWSER_RECYCLE_UPTIME = _settings.browser_recycle_uptime
+BROWSER_RECYCLE_RSS_MB = _settings.browser_recycle_rss_mb
+PERSISTENT_CONTEXT_LIMIT = _settings.persistent_context_limit
+BLOCKED_DOMAINS = _settings.blocked_domains
+SUBRESOURCE_CACHE_SIZE_MB = _settings.subresource_cache_size_mb
+POSTPROCESS_WORKERS = _settings.postprocess_workers
+POSTPROCESS_QUEUE_SIZE = _settings.postprocess_queue_size
+POSTPROCESS_TIMEOUT = _settings.postprocess_timeout
+CACHE_BACKEND = _settings.cache_backend
+CACHE_WRITE_BEHIND = _settings.cache_write_behind
+CACHE_COMPRESSION = _settings.cache_compression
+CACHE_MAX_SIZE_MB = _settings.cache_max_size_mb
+CACHE_MAX_ENTRIES = _settings.cache_max_entries
+CACHE_MAX_AGE = _settings.cache_max_age
+CACHE_MEMORY_SIZE_MB = _settings.cache_memory_size_mb
 SCREENSHOT_TYPE = _settings.screenshot_type
 SCREENSHOT_QUALITY = _settings.screenshot_quality
 
@@ -192,7 +340,28 @@ def to_string() -> str:
         ],
         'Browser settings': [
             'browser_type',
+            'browser_instances',
             'browser_context_limit',
+            'browser_context_pool_size',
+            'browser_context_pool_idle_timeout',
+            'browser_context_pool_max_idle',
+            'browser_restart_backoff_max',
+            'browser_recycle_contexts',
+            'browser_recycle_uptime',
+            'browser_recycle_rss_mb',
+            'persistent_context_limit',
+            'blocked_domains',
+            'subresource_cache_size_mb',
+            'postprocess_workers',
+            'postprocess_queue_size',
+            'postprocess_timeout',
+            'cache_backend',
+            'cache_write_behind',
+            'cache_compression',
+            'cache_max_size_mb',
+            'cache_max_entries',
+            'cache_max_age',
+            'cache_memory_size_mb',
             'screenshot_type',
             'screenshot_quality',
         ],
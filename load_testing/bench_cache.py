@@ -0,0 +1,115 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from internal.cache import decode_result, encode_result, zstandard  # noqa: E402
+from settings import CacheCompression  # noqa: E402
+
+
+DEFAULT_PARAGRAPHS = 500
+DEFAULT_RUNS = 20
+
+
+@dataclass
+class Options:
+    results_dir: str | None = None
+    paragraphs: int = DEFAULT_PARAGRAPHS
+    runs: int = DEFAULT_RUNS
+
+
+def synthetic_result(paragraphs: int) -> dict:
+    # an article result with Cyrillic text, as saved by /api/article with full-content=yes
+    text = ' '.join(f'Абзац {i}: длинная статья о производительности кэша.' for i in range(paragraphs))
+    html = ''.join(f'<p>Абзац {i}: длинная статья о производительности кэша.</p>' for i in range(paragraphs))
+    return {
+        'title': 'Заголовок статьи',
+        'byline': 'Автор',
+        'content': f'<article>{html}</article>',
+        'textContent': text,
+        'fullContent': f'<html><body><nav>Меню</nav>{html}</body></html>',
+        'length': len(text),
+    }
+
+
+def legacy_encode(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=True).encode()
+
+
+def timeit(func, arg, runs: int) -> float:
+    res = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        func(arg)
+        res.append(time.perf_counter() - t0)
+    return statistics.median(res) * 1000
+
+
+def bench(results: dict[str, dict], runs: int) -> None:
+    codecs = [CacheCompression.NONE, CacheCompression.GZIP]
+    if zstandard is not None:
+        codecs.append(CacheCompression.ZSTD)
+
+    print(f'{"result":<30} {"format":<8} {"size, KiB":>10} {"ratio":>7} {"dump, ms":>9} {"load, ms":>9}')
+    for name, data in results.items():
+        legacy = legacy_encode(data)
+        legacy_load = timeit(json.loads, legacy, runs)
+        print(
+            f'{name[:30]:<30} {"legacy":<8} {len(legacy) / 1024:10.1f} {1:7.1f} '
+            f'{timeit(legacy_encode, data, runs):9.2f} {legacy_load:9.2f}'
+        )
+        for codec in codecs:
+            raw = encode_result(data, codec)
+            print(
+                f'{"":<30} {codec.value:<8} {len(raw) / 1024:10.1f} {len(legacy) / len(raw):7.1f} '
+                f'{timeit(lambda d: encode_result(d, codec), data, runs):9.2f} {timeit(decode_result, raw, runs):9.2f}'
+            )
+
+
+def process_args() -> Options:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the result cache format against the legacy plain JSON files.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,  # show defaults in help
+    )
+    parser.add_argument('-d', '--dir', metavar='DIR', type=str, default=None, help='directory with *.json results')
+    parser.add_argument('-p', '--paragraphs', metavar='N', type=int, default=DEFAULT_PARAGRAPHS, help='synthetic size')
+    parser.add_argument('-r', '--runs', metavar='N', type=int, default=DEFAULT_RUNS, help='runs per result')
+    args = parser.parse_args()
+
+    if args.dir and os.path.isdir(args.dir) is False:
+        parser.error(f'Directory {args.dir} not found')
+    if args.runs < 1:
+        parser.error('Runs must be > 0')
+
+    return Options(results_dir=args.dir, paragraphs=args.paragraphs, runs=args.runs)
+
+
+def load_results(opt: Options) -> dict[str, dict]:
+    results = {}
+    if opt.results_dir:
+        for path in sorted(glob.glob(os.path.join(opt.results_dir, '*.json'))):
+            with open(path, encoding='utf-8') as f:
+                results[os.path.basename(path)] = json.load(f)
+    if not results:
+        results[f'synthetic ({opt.paragraphs} paragraphs)'] = synthetic_result(opt.paragraphs)
+    return results
+
+
+def main() -> None:
+    opt = process_args()
+    bench(load_results(opt), opt.runs)
+
+
+if __name__ == '__main__':
+    # How to run (results saved with /result/{id}, or copied from user_data/_res by older versions):
+    # python -m load_testing.bench_cache -d saved_results
+    # or, with a synthetic article:
+    # python -m load_testing.bench_cache -p 500
+    main()
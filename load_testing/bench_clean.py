@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import glob
+import os
+import random
+import statistics
+
+from dataclasses import dataclass
+
+from playwright.async_api import async_playwright, Page
+
+
+CLEAN_SCRIPT = os.path.join(os.path.dirname(__file__), '..', 'app', 'scripts', 'parser', 'clean.js')
+DEFAULT_NODES = 20_000
+DEFAULT_RUNS = 5
+MAX_NODES = 50_000  # the same as PRECLEAN_MAX_NODES in internal/browser.py
+
+# the cleaning that article.js did before clean.js: mark hidden elements with a class, re-query them,
+# then collect comments recursively
+LEGACY_SCRIPT = """() => {
+    function findComments(el) {
+        let arr = [];
+        for (let i = 0; i < el.childNodes.length; i++) {
+            let node = el.childNodes[i];
+            if(node.nodeType === 8) {
+                arr.push(node);
+            } else {
+                arr.push.apply(arr, findComments(node));
+            }
+        }
+        return arr;
+    };
+    let elements = document.body.getElementsByTagName("*");
+    for (let i = 0; i < elements.length; i++) {
+        let style = window.getComputedStyle(elements[i]);
+        if (style.display === "none" ||
+            style.visibility === "hidden" ||
+            style.opacity === "0" ||
+            style.opacity === "0.0" ||
+            (style.height === "0px" && style.width === "0px") ||
+            (style.height === "1px" && style.width === "1px")) {
+            elements[i].classList.add("scrapper-hidden");
+        }
+    }
+    document.querySelectorAll(".scrapper-hidden").forEach(el => el.remove());
+    findComments(document.body).forEach(el => el.remove());
+    document.cloneNode(true);
+}"""
+
+# measures the time spent in the page, without the protocol round trip
+TIMED = """(args) => {{
+    const t0 = performance.now();
+    ({script})(args);
+    return [performance.now() - t0, document.body.getElementsByTagName("*").length];
+}}"""
+
+
+@dataclass
+class Options:
+    pages_dir: str | None = None
+    nodes: int = DEFAULT_NODES
+    runs: int = DEFAULT_RUNS
+
+
+def synthetic_page(n: int, seed: int = 42) -> str:
+    # nested blocks of text and links, some of them hidden, with comments in between
+    rnd = random.Random(seed)
+    parts = ['<html><body>']
+    for i in range(n // 5):
+        style = ''
+        if rnd.random() < 0.1:
+            style = rnd.choice(['display:none', 'visibility:hidden', 'opacity:0', 'width:1px;height:1px'])
+        parts.append(
+            f'<div style="{style}"><!-- block {i} --><p>Paragraph {i} <a href="/p/{i}">link {i}</a></p>'
+            f'<ul><li>item</li></ul></div>'
+        )
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+async def measure(page: Page, html: str, script: str, args: dict | None) -> tuple[float, int]:
+    await page.set_content(html, wait_until='load')
+    elapsed, remaining = await page.evaluate(TIMED.format(script=script), args)
+    return elapsed, remaining
+
+
+async def bench(pages: dict[str, str], runs: int) -> None:
+    with open(CLEAN_SCRIPT, encoding='utf-8') as f:
+        clean_script = f.read()
+    clean_args = {'checkSize': True, 'removeComments': True, 'maxNodes': MAX_NODES}
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        print(f'{"page":<40} {"legacy, ms":>12} {"clean.js, ms":>14} {"speedup":>8} {"nodes left":>12}')
+        for name, html in pages.items():
+            legacy, clean = [], []
+            for _ in range(runs):
+                elapsed, legacy_left = await measure(page, html, LEGACY_SCRIPT, None)
+                legacy.append(elapsed)
+                elapsed, clean_left = await measure(page, html, clean_script, clean_args)
+                clean.append(elapsed)
+            a, b = statistics.median(legacy), statistics.median(clean)
+            left = f'{clean_left}/{legacy_left}'
+            print(f'{name[:40]:<40} {a:12.1f} {b:14.1f} {a / max(b, 0.001):7.1f}x {left:>12}')
+        await browser.close()
+
+
+def process_args() -> Options:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the DOM pre-cleaning before parsing (clean.js) against the legacy cleaning.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,  # show defaults in help
+    )
+    parser.add_argument('-d', '--dir', metavar='DIR', type=str, default=None, help='directory with saved *.html pages')
+    parser.add_argument('-n', '--nodes', metavar='N', type=int, default=DEFAULT_NODES, help='synthetic page size')
+    parser.add_argument('-r', '--runs', metavar='N', type=int, default=DEFAULT_RUNS, help='runs per page')
+    args = parser.parse_args()
+
+    if args.dir and os.path.isdir(args.dir) is False:
+        parser.error(f'Directory {args.dir} not found')
+    if args.runs < 1:
+        parser.error('Runs must be > 0')
+
+    return Options(pages_dir=args.dir, nodes=args.nodes, runs=args.runs)
+
+
+def load_pages(opt: Options) -> dict[str, str]:
+    pages = {}
+    if opt.pages_dir:
+        for path in sorted(glob.glob(os.path.join(opt.pages_dir, '*.html'))):
+            with open(path, encoding='utf-8', errors='replace') as f:
+                pages[os.path.basename(path)] = f.read()
+    if not pages:
+        pages[f'synthetic ({opt.nodes} nodes)'] = synthetic_page(opt.nodes)
+    return pages
+
+
+def main() -> None:
+    opt = process_args()
+    asyncio.run(bench(load_pages(opt), opt.runs))
+
+
+if __name__ == '__main__':
+    # How to run (save large pages with "Save page as... HTML only"):
+    # python -m load_testing.bench_clean -d saved_pages -r 5
+    # or, with a synthetic page:
+    # python -m load_testing.bench_clean -n 50000
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+from dataclasses import dataclass
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from internal.util import CONTENT_TAGS, empty_blocks, improve_content  # noqa: E402
+
+
+DEFAULT_PARAGRAPHS = 2_000
+DEFAULT_DEPTH = 15
+DEFAULT_RUNS = 5
+
+
+@dataclass
+class Options:
+    pages_dir: str | None = None
+    paragraphs: int = DEFAULT_PARAGRAPHS
+    depth: int = DEFAULT_DEPTH
+    runs: int = DEFAULT_RUNS
+
+
+def legacy_empty_blocks(tree: BeautifulSoup) -> None:
+    # step 1 of improve_content before empty_blocks(): a subtree search for every p and div
+    for el in tree.find_all(['p', 'div']):
+        if el.find(list(CONTENT_TAGS)):
+            continue
+        words = el.get_text(strip=True).split()
+        if len(words) <= 1 or (''.join(words)).isnumeric():
+            el.decompose()
+
+
+def linear_empty_blocks(tree: BeautifulSoup) -> None:
+    for el in empty_blocks(tree):
+        el.decompose()
+
+
+def synthetic_article(paragraphs: int, depth: int) -> str:
+    # deeply nested blocks, as Readability leaves them for some sites
+    parts = []
+    for i in range(paragraphs):
+        parts.append(
+            '<div>' * depth
+            + f'<p>Paragraph {i} of a long read, with <a href="/{i}">a link</a> and <b>some</b> words.</p>'
+            + f'<p>{i}</p><div>Share</div>'
+            + '</div>' * depth
+        )
+    return '<div>' + ''.join(parts) + '</div>'
+
+
+def timeit(func, content: str, runs: int) -> float:
+    # median time of func(tree), without the parsing time
+    res = []
+    for _ in range(runs):
+        tree = BeautifulSoup(content, 'html.parser')
+        t0 = time.perf_counter()
+        func(tree)
+        res.append(time.perf_counter() - t0)
+    return statistics.median(res)
+
+
+def bench(pages: dict[str, str], runs: int) -> None:
+    print(f'{"article":<40} {"legacy, ms":>12} {"linear, ms":>12} {"speedup":>8} {"total, ms":>10}')
+    for name, content in pages.items():
+        a = timeit(legacy_empty_blocks, content, runs) * 1000
+        b = timeit(linear_empty_blocks, content, runs) * 1000
+        t0 = time.perf_counter()
+        improve_content('Title', content)
+        total = (time.perf_counter() - t0) * 1000
+        print(f'{name[:40]:<40} {a:12.1f} {b:12.1f} {a / max(b, 0.001):7.1f}x {total:10.1f}')
+
+
+def process_args() -> Options:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the empty block removal in improve_content against the legacy implementation.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,  # show defaults in help
+    )
+    parser.add_argument('-d', '--dir', metavar='DIR', type=str, default=None, help='directory with article *.html')
+    parser.add_argument('-p', '--paragraphs', metavar='N', type=int, default=DEFAULT_PARAGRAPHS, help='synthetic size')
+    parser.add_argument('--depth', metavar='N', type=int, default=DEFAULT_DEPTH, help='synthetic nesting depth')
+    parser.add_argument('-r', '--runs', metavar='N', type=int, default=DEFAULT_RUNS, help='runs per article')
+    args = parser.parse_args()
+
+    if args.dir and os.path.isdir(args.dir) is False:
+        parser.error(f'Directory {args.dir} not found')
+    if args.runs < 1:
+        parser.error('Runs must be > 0')
+
+    return Options(pages_dir=args.dir, paragraphs=args.paragraphs, depth=args.depth, runs=args.runs)
+
+
+def load_pages(opt: Options) -> dict[str, str]:
+    pages = {}
+    if opt.pages_dir:
+        for path in sorted(glob.glob(os.path.join(opt.pages_dir, '*.html'))):
+            with open(path, encoding='utf-8', errors='replace') as f:
+                pages[os.path.basename(path)] = f.read()
+    if not pages:
+        pages[f'synthetic ({opt.paragraphs} x depth {opt.depth})'] = synthetic_article(opt.paragraphs, opt.depth)
+    return pages
+
+
+def main() -> None:
+    opt = process_args()
+    bench(load_pages(opt), opt.runs)
+
+
+if __name__ == '__main__':
+    # How to run (article HTML, e.g. the `content` field of /api/article results):
+    # python -m load_testing.bench_improve -d saved_articles
+    # or, with a synthetic article:
+    # python -m load_testing.bench_improve -p 2000 --depth 15
+    main()